@@ -0,0 +1,69 @@
+"""Micro-benchmark of response decoding, parsing and frame assembly (rows/sec), without any network access.
+
+Usage: python benchmarks/parsing.py [--hits 1000] [--queries 1000] [--repeat 5]
+"""
+import argparse
+import json
+import time
+import pandas as pd
+from pyterrier_services import DblpApi, SemanticScholarApi, multi_query
+from pyterrier_services.dblp import DblpEntityType
+
+
+def dblp_payload(n):
+    return {'result': {'hits': {'@first': '0', '@sent': str(n), '@total': str(n), 'hit': [
+        {'info': {
+            'key': f'conf/x/Paper{i}',
+            'title': f'A Paper About Topic {i}.',
+            'authors': {'author': [{'text': f'Author {i}'}, {'text': f'Author {i + 1}'}]},
+            'year': '2021',
+            'type': 'Conference and Workshop Papers',
+        }} for i in range(n)
+    ]}}}
+
+
+def s2_payload(n):
+    return {'total': n, 'offset': 0, 'next': n, 'data': [
+        {'paperId': f'{i:040x}', 'title': f'A Paper About Topic {i}', 'abstract': 'Lorem ipsum dolor sit amet. ' * 20} for i in range(n)
+    ]}
+
+
+def bench(name, fn, rows, repeat):
+    fn() # warm-up
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    print(f'{name:<40} {rows / best:>14,.0f} rows/sec')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hits', type=int, default=1000, help='results per response')
+    parser.add_argument('--queries', type=int, default=1000, help='queries in the frame assembly benchmark')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    dblp, s2 = DblpApi(), SemanticScholarApi()
+    dblp_raw = json.dumps(dblp_payload(args.hits)).encode()
+    s2_raw = json.dumps(s2_payload(args.hits)).encode()
+
+    bench('decode dblp (json)', lambda: json.loads(dblp_raw), args.hits, args.repeat)
+    try:
+        import orjson
+        bench('decode dblp (orjson)', lambda: orjson.loads(dblp_raw), args.hits, args.repeat)
+    except ModuleNotFoundError:
+        print('decode dblp (orjson)                     not installed')
+
+    dblp_res, s2_res = json.loads(dblp_raw), json.loads(s2_raw)
+    bench('parse dblp search', lambda: dblp._parse_search(dblp_res, entity_type=DblpEntityType.publication, limit=args.hits, return_next=False, return_total=False), args.hits, args.repeat)
+    bench('parse s2 search', lambda: s2._parse_search(s2_res, fields=['title', 'abstract'], return_next=False, return_total=False), args.hits, args.repeat)
+
+    page = s2._parse_search(json.loads(json.dumps(s2_payload(100))), fields=['title', 'abstract'], return_next=False, return_total=False)
+    topics = pd.DataFrame({'qid': [str(i) for i in range(args.queries)], 'query': [f'query {i}' for i in range(args.queries)]})
+    bench('multi_query frame assembly', lambda: multi_query(lambda query: page, verbose=False)(topics), args.queries * len(page), args.repeat)
+
+
+if __name__ == '__main__':
+    main()
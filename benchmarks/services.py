@@ -0,0 +1,214 @@
+"""Throughput, latency and memory of the retrievers and encoders, measured against local stand-in servers.
+
+Each target is called with one input frame at a time (a query for the retrievers, a batch of documents for the loaders,
+encoders and re-ranker) from ``concurrency`` client threads. For each target and concurrency level, the benchmark
+reports calls/sec, rows/sec, the p50/p95/p99 latency of the calls, the peak Python heap usage (via ``tracemalloc``,
+which slows allocation-heavy code down, so only compare runs with the same ``--no-trace-memory`` setting) and the
+number of requests the stand-in throttled. Results can be saved with ``--json`` and compared against a saved baseline
+with ``--baseline``, which exits with status 1 when a target is slower than the baseline beyond ``--tolerance``.
+
+Usage: python benchmarks/services.py [--services semantic_scholar,dblp,google,pinecone] [--concurrency 1,4,16]
+       [--calls 100] [--latency lognormal:0.02,0.5] [--throttle 0.01] [--page-size N] [--json out.json]
+"""
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from pyterrier_services import SemanticScholarApi, DblpApi, RateLimiter
+from stand_ins import Latency, LocalTransport, StandInServer
+
+
+def _queries(n):
+    return [pd.DataFrame({'qid': [str(i)], 'query': [f'benchmark query {i}']}) for i in range(n)]
+
+
+def _docs(n, size, prefix=''):
+    return [pd.DataFrame({'docno': [f'{prefix}{i:06d}{j:04d}' for j in range(size)]}) for i in range(n)]
+
+
+def _texts(n, size):
+    return [pd.DataFrame({
+        'docno': [f'{i}-{j}' for j in range(size)],
+        'text': [f'document {j} of batch {i} about neural retrieval and query {j % 7}' for j in range(size)],
+    }) for i in range(n)]
+
+
+def _rerank_inputs(n, size):
+    return [pd.DataFrame({
+        'qid': str(i),
+        'query': f'neural retrieval {i}',
+        'docno': [f'{i}-{j}' for j in range(size)],
+        'text': [f'document {j} about neural retrieval and query {j % 7}' for j in range(size)],
+        'score': np.arange(size, 0, -1, dtype=float),
+        'rank': np.arange(size),
+    }) for i in range(n)]
+
+
+def _limiter(args):
+    # effectively unlimited, so that the client is bounded by the stand-in rather than the published rate limits
+    return RateLimiter(1e9, burst=1e9, max_concurrency=1024)
+
+
+def _transport(args, **routes):
+    return LocalTransport(pool_size=max(args.concurrency) * max(args.page_workers or 10, 4), **routes)
+
+
+def _semantic_scholar_targets(url, args):
+    api = SemanticScholarApi(api_key='benchmark', transport=_transport(args, semantic_scholar=url), rate_limiter=_limiter(args))
+    return {
+        'SemanticScholarRetriever': (api.retriever(num_results=args.num_results, verbose=False, max_workers=1, page_workers=args.page_workers), _queries(args.calls)),
+        'SemanticScholarRetriever(bulk)': (api.retriever(num_results=args.num_results, verbose=False, max_workers=1, bulk=True), _queries(args.calls)),
+        'SemanticScholarLoader': (api.loader(verbose=False, max_workers=1), _docs(args.calls, args.batch_size)),
+    }
+
+
+def _dblp_targets(url, args):
+    api = DblpApi(transport=_transport(args, dblp=url), rate_limiter=_limiter(args))
+    return {
+        'DblpRetriever': (api.retriever(num_results=args.num_results, verbose=False, max_workers=1, page_workers=args.page_workers), _queries(args.calls)),
+        'DblpBibtexLoader': (api.bibtex_loader(verbose=False, max_workers=4), _docs(args.calls, args.batch_size, prefix='conf/bench/')),
+    }
+
+
+def _google_targets(url, args):
+    from pyterrier_services import GoogleApi
+    api = GoogleApi(api_key='benchmark', rate_limiter=_limiter(args), api_endpoint=url)
+    retriever = api.retriever('benchmark', num_results=min(args.num_results, 100), max_workers=1, page_workers=args.page_workers)
+    return {
+        'GoogleSearchRetriever': (retriever, _queries(args.calls)),
+    }
+
+
+def _pinecone_targets(url, args):
+    from pyterrier_services import PineconeApi
+    api = PineconeApi(api_key='benchmark', host=url)
+    return {
+        'PineconeDenseEncoder(query)': (api.dense_model().query_encoder(), _queries(args.calls)),
+        'PineconeDenseEncoder(passage)': (api.dense_model().doc_encoder(), _texts(args.calls, args.batch_size)),
+        'PineconeSparseEncoder(passage)': (api.sparse_model().doc_encoder(), _texts(args.calls, args.batch_size)),
+        'PineconeReranker': (api.reranker(), _rerank_inputs(args.calls, args.batch_size)),
+    }
+
+
+TARGETS = {
+    'semantic_scholar': _semantic_scholar_targets,
+    'dblp': _dblp_targets,
+    'google': _google_targets,
+    'pinecone': _pinecone_targets,
+}
+
+
+def run(transformer, inputs, concurrency, trace_memory):
+    """Calls the transformer on each input from ``concurrency`` threads, returning the measurements."""
+    def call(inp):
+        start = time.perf_counter()
+        try:
+            rows = len(transformer(inp))
+        except Exception as e:
+            return time.perf_counter() - start, 0, e
+        return time.perf_counter() - start, rows, None
+
+    call(inputs[0]) # warm-up (connections, lazily-built clients)
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        res = list(pool.map(call, inputs))
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+    if trace_memory:
+        tracemalloc.stop()
+
+    latencies = np.array([r[0] for r in res])
+    errors = [r[2] for r in res if r[2] is not None]
+    return {
+        'calls_per_sec': len(inputs) / elapsed,
+        'rows_per_sec': sum(r[1] for r in res) / elapsed,
+        'p50_ms': float(np.percentile(latencies, 50) * 1000),
+        'p95_ms': float(np.percentile(latencies, 95) * 1000),
+        'p99_ms': float(np.percentile(latencies, 99) * 1000),
+        'peak_mib': peak / 2**20 if peak is not None else None,
+        'errors': len(errors),
+        'first_error': repr(errors[0]) if errors else None,
+    }
+
+
+def _print_header():
+    print(f'{"target":<32} {"conc":>4} {"calls/s":>9} {"rows/s":>10} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"peak MiB":>9} {"429s":>5} {"errors":>6}')
+
+
+def _print_row(res):
+    peak = f'{res["peak_mib"]:9.1f}' if res['peak_mib'] is not None else f'{"-":>9}'
+    print(f'{res["target"]:<32} {res["concurrency"]:>4} {res["calls_per_sec"]:>9.1f} {res["rows_per_sec"]:>10.0f} {res["p50_ms"]:>8.1f} {res["p95_ms"]:>8.1f} {res["p99_ms"]:>8.1f} {peak} {res["throttled"]:>5} {res["errors"]:>6}')
+    if res['first_error']:
+        print(f'    first error: {res["first_error"]}', file=sys.stderr)
+
+
+def compare(results, baseline, tolerance):
+    """Returns the results whose calls/sec or p95 latency regressed beyond ``tolerance`` relative to the baseline."""
+    baseline = {(r['target'], r['concurrency']): r for r in baseline}
+    regressions = []
+    for res in results:
+        base = baseline.get((res['target'], res['concurrency']))
+        if base is None:
+            continue
+        if res['calls_per_sec'] < base['calls_per_sec'] * (1 - tolerance) or res['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            regressions.append((res, base))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--services', default=','.join(TARGETS), help='comma-separated services to benchmark')
+    parser.add_argument('--targets', default=None, help='comma-separated target names to run (defaults to all)')
+    parser.add_argument('--concurrency', type=lambda s: [int(c) for c in s.split(',')], default=[1, 4, 16], help='comma-separated numbers of client threads')
+    parser.add_argument('--calls', type=int, default=100, help='calls per target and concurrency level')
+    parser.add_argument('--num-results', type=int, default=100, help='results per query for the retrievers')
+    parser.add_argument('--batch-size', type=int, default=50, help='documents per call for the loaders, encoders and re-ranker')
+    parser.add_argument('--page-workers', type=int, default=None, help='result pages of a query fetched concurrently (defaults to the retriever default)')
+    parser.add_argument('--latency', type=Latency.parse, default=Latency('lognormal', 0.02, 0.5), help='stand-in latency: e.g. 0.02, uniform:0.01,0.05, lognormal:0.02,0.5 or exp:0.02')
+    parser.add_argument('--throttle', type=float, default=0., help='fraction of requests the stand-ins answer with 429')
+    parser.add_argument('--retry-after', type=float, default=0.05, help='Retry-After (seconds) of throttled responses')
+    parser.add_argument('--page-size', type=int, default=None, help='maximum results (or inputs) per stand-in response')
+    parser.add_argument('--total', type=int, default=1000, help='results per search query on the stand-ins')
+    parser.add_argument('--no-trace-memory', dest='trace_memory', action='store_false', help='do not measure the peak heap usage')
+    parser.add_argument('--json', default=None, help='write the results to this file')
+    parser.add_argument('--baseline', default=None, help='compare against results previously written with --json')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='relative slow-down tolerated by --baseline')
+    args = parser.parse_args()
+
+    targets = set(args.targets.split(',')) if args.targets else None
+    results = []
+    _print_header()
+    for service in args.services.split(','):
+        server = StandInServer(service, latency=args.latency, throttle=args.throttle, retry_after=args.retry_after, page_size=args.page_size, total=args.total)
+        with server:
+            for name, (transformer, inputs) in TARGETS[service](server.url, args).items():
+                if targets is not None and name not in targets:
+                    continue
+                for concurrency in args.concurrency:
+                    before = server.stats()['throttled']
+                    res = run(transformer, inputs, concurrency, args.trace_memory)
+                    res = {'target': name, 'concurrency': concurrency, **res, 'throttled': server.stats()['throttled'] - before}
+                    _print_row(res)
+                    results.append(res)
+
+    if args.json:
+        with open(args.json, 'wt') as fout:
+            json.dump({'args': {k: repr(v) if isinstance(v, Latency) else v for k, v in vars(args).items()}, 'results': results}, fout, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'rt') as fin:
+            regressions = compare(results, json.load(fin)['results'], args.tolerance)
+        for res, base in regressions:
+            print(f'REGRESSION {res["target"]} (concurrency={res["concurrency"]}): '
+                  f'{res["calls_per_sec"]:.1f} calls/s vs {base["calls_per_sec"]:.1f}, p95 {res["p95_ms"]:.1f}ms vs {base["p95_ms"]:.1f}ms')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,421 @@
+"""Local stand-in HTTP servers that mimic the responses of the services wrapped by pyterrier-services.
+
+Each :class:`StandInServer` runs in its own process (so that it does not compete with the client for the GIL) and
+serves synthetic, deterministic results for any query, with a configurable latency distribution, rate of injected
+``429 Too Many Requests`` responses and page size. :class:`LocalTransport` points the API objects at a stand-in.
+
+Usage (to serve a stand-in on its own, e.g. for manual testing):
+    python benchmarks/stand_ins.py semantic_scholar [--port 8000] [--latency lognormal:0.05,0.5] [--throttle 0.01]
+"""
+import argparse
+import hashlib
+import json
+import math
+import multiprocessing
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import parse_qs, urlsplit
+import numpy as np
+from pyterrier_services import HttpTransport, SemanticScholarApi, DblpApi
+from pyterrier_services.transport import json_dumps
+
+
+class Latency:
+    """A distribution of response latencies, in seconds.
+
+    Specified as ``kind:param,...``: ``const:SECONDS``, ``uniform:LOW,HIGH``, ``lognormal:MEDIAN,SIGMA`` or
+    ``exp:MEAN``. A bare number is a constant latency.
+    """
+    KINDS = {'const': 1, 'uniform': 2, 'lognormal': 2, 'exp': 1}
+
+    def __init__(self, kind: str = 'const', *params: float):
+        if kind not in self.KINDS:
+            raise ValueError(f'unknown latency distribution {kind!r} (expected one of {list(self.KINDS)})')
+        if len(params) != self.KINDS[kind]:
+            raise ValueError(f'{kind} latency expects {self.KINDS[kind]} parameter(s), got {len(params)}')
+        self.kind = kind
+        self.params = tuple(float(p) for p in params)
+
+    @classmethod
+    def parse(cls, spec: str) -> 'Latency':
+        kind, _, params = spec.partition(':')
+        if not params:
+            return cls('const', float(kind))
+        return cls(kind, *(float(p) for p in params.split(',')))
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == 'const':
+            return self.params[0]
+        if self.kind == 'uniform':
+            return rng.uniform(*self.params)
+        if self.kind == 'lognormal':
+            return rng.lognormvariate(math.log(self.params[0]), self.params[1])
+        return rng.expovariate(1. / self.params[0])
+
+    def __repr__(self):
+        return f'{self.kind}:' + ','.join(f'{p:g}' for p in self.params)
+
+
+class _BadRequest(Exception):
+    pass
+
+
+def _ids(query: str, start: int, stop: int):
+    prefix = hashlib.sha1(query.encode()).hexdigest()[:24]
+    return [f'{prefix}{i:016x}' for i in range(start, stop)]
+
+
+def _int_param(params, name, default):
+    try:
+        return int(params.get(name, default))
+    except ValueError as e:
+        raise _BadRequest(f'invalid {name}') from e
+
+
+def _s2_paper(paper_id, fields):
+    values = {
+        'title': f'Paper {paper_id[-6:]}',
+        'abstract': f'The abstract of paper {paper_id}. ' * 8,
+        'year': 2000 + int(paper_id[-2:], 16) % 25,
+        'venue': 'Stand-In Conference',
+        'authors': [{'authorId': str(int(paper_id[-4:], 16)), 'name': 'Ada Author'}, {'authorId': '1', 'name': 'Bo Author'}],
+        'citationCount': int(paper_id[-3:], 16),
+    }
+    return {'paperId': paper_id, **{f: values.get(f.split('.')[0]) for f in fields}}
+
+
+def _semantic_scholar(server, method, path, params, body):
+    fields = [f for f in params.get('fields', '').split(',') if f]
+    if method == 'POST' and path == '/graph/v1/paper/batch':
+        ids = (body or {}).get('ids', [])
+        if len(ids) > (server.page_size or SemanticScholarApi.MAX_BATCH_SIZE):
+            raise _BadRequest('too many ids')
+        return [_s2_paper(i, fields) if not i.startswith('missing') else None for i in ids]
+    if path == '/graph/v1/paper/search':
+        offset, limit = _int_param(params, 'offset', 0), _int_param(params, 'limit', 100)
+        if limit > SemanticScholarApi.MAX_PAGE_SIZE or offset + limit > SemanticScholarApi.MAX_SEARCH_RESULTS:
+            raise _BadRequest('offset + limit must be < 1000 and limit <= 100')
+        total = min(server.total, SemanticScholarApi.MAX_SEARCH_RESULTS)
+        stop = max(min(offset + min(limit, server.page_size or limit), total), offset)
+        res = {'total': server.total, 'offset': offset, 'data': [_s2_paper(i, fields) for i in _ids(params.get('query', ''), offset, stop)]}
+        if stop < total:
+            res['next'] = stop
+        return res
+    if path == '/graph/v1/paper/search/bulk':
+        start = _int_param(params, 'token', 0)
+        stop = min(start + (server.page_size or 1000), server.total)
+        res = {'total': server.total, 'data': [_s2_paper(i, fields) for i in _ids(params.get('query', ''), start, stop)]}
+        res['token'] = str(stop) if stop < server.total else None
+        return res
+    return None
+
+
+def _dblp(server, method, path, params, body):
+    match = re.fullmatch(r'/search/(publ|author|venue)/api', path)
+    if match:
+        first, count = _int_param(params, 'f', 0), _int_param(params, 'c', 30)
+        if count > DblpApi.MAX_PAGE_SIZE:
+            raise _BadRequest('c must be <= 1000')
+        stop = max(min(first + min(count, server.page_size or count), server.total), first)
+        hits = []
+        for i in _ids(params.get('q', ''), first, stop):
+            if match.group(1) == 'publ':
+                info = {
+                    'authors': {'author': [{'@pid': '00/0001', 'text': 'Ada Author'}, {'@pid': '00/0002', 'text': 'Bo Author'}]},
+                    'title': f'Paper {i[-6:]}.',
+                    'venue': 'SIGIR',
+                    'year': '2021',
+                    'type': 'Conference and Workshop Papers',
+                    'key': f'conf/bench/{i}',
+                    'url': f'https://dblp.org/rec/conf/bench/{i}',
+                }
+            elif match.group(1) == 'author':
+                info = {'author': f'Author {i[-6:]}', 'url': f'https://dblp.org/pid/{i[-8:-4]}/{i[-4:]}'}
+            else:
+                info = {'venue': f'Venue {i[-6:]}', 'acronym': i[-6:].upper(), 'type': 'Conference or Workshop', 'url': f'https://dblp.org/db/conf/{i[-6:]}/'}
+            hits.append({'@score': '1', '@id': i, 'info': info})
+        return {'result': {'hits': {'@total': str(server.total), '@computed': str(server.total), '@sent': str(len(hits)), '@first': str(first), 'hit': hits}}}
+    match = re.fullmatch(r'/rec/(.+)\.bib', path)
+    if match:
+        key = match.group(1)
+        return (
+            f'@inproceedings{{DBLP:{key},\n'
+            f'  author       = {{Ada Author and Bo Author}},\n'
+            f'  title        = {{Paper {key[-6:]}}},\n'
+            f'  booktitle    = {{SIGIR}},\n'
+            f'  year         = {{2021}},\n'
+            f'  biburl       = {{https://dblp.org/rec/{key}.bib}}\n'
+            f'}}\n'
+        )
+    return None
+
+
+def _google(server, method, path, params, body):
+    if path != '/customsearch/v1':
+        return None
+    start, num = max(_int_param(params, 'start', 1), 1), _int_param(params, 'num', 10) # start is 1-based
+    if num > 10 or start + num > 100: # the API never returns more than 100 results
+        raise _BadRequest('num must be <= 10 and start + num <= 100')
+    first = start - 1
+    stop = max(min(first + min(num, server.page_size or num), server.total), first)
+    return {
+        'searchInformation': {'totalResults': str(server.total), 'searchTime': 0.1},
+        'items': [{
+            'title': f'Page {i[-6:]}',
+            'link': f'https://example.com/{i}',
+            'displayLink': 'example.com',
+            'snippet': f'A snippet of page {i}...',
+        } for i in _ids(params.get('q', ''), first, stop)],
+    }
+
+
+def _pinecone(server, method, path, params, body):
+    if method != 'POST' or path not in ('/embed', '/rerank'):
+        return None
+    if path == '/embed':
+        texts = [i['text'] for i in body['inputs']]
+        if len(texts) > (server.page_size or 96):
+            raise _BadRequest('too many inputs')
+        if 'sparse' in body['model']:
+            data = []
+            for text in texts:
+                tokens = list(dict.fromkeys(text.lower().split()))
+                data.append({
+                    'vector_type': 'sparse',
+                    'sparse_values': [1. / len(tokens)] * len(tokens),
+                    'sparse_indices': [int(hashlib.sha1(t.encode()).hexdigest()[:7], 16) for t in tokens],
+                    'sparse_tokens': tokens,
+                })
+            return {'model': body['model'], 'vector_type': 'sparse', 'data': data, 'usage': {'total_tokens': sum(len(t.split()) for t in texts)}}
+        seeds = [int(hashlib.sha1(t.encode()).hexdigest()[:8], 16) for t in texts]
+        data = [{'vector_type': 'dense', 'values': np.random.default_rng(s).standard_normal(server.dim, dtype=np.float32).tolist()} for s in seeds]
+        return {'model': body['model'], 'vector_type': 'dense', 'data': data, 'usage': {'total_tokens': sum(len(t.split()) for t in texts)}}
+    docs = [d['text'] for d in body['documents']]
+    if len(docs) > (server.page_size or 100):
+        raise _BadRequest('too many documents')
+    query = set(body['query'].lower().split())
+    scores = [len(query.intersection(d.lower().split())) / (len(query) or 1) for d in docs]
+    order = sorted(range(len(docs)), key=lambda i: -scores[i])[:body.get('top_n') or len(docs)]
+    return {'model': body['model'], 'data': [{'index': i, 'score': scores[i]} for i in order], 'usage': {'rerank_units': 1}}
+
+
+SERVICES = {
+    'semantic_scholar': _semantic_scholar,
+    'dblp': _dblp,
+    'google': _google,
+    'pinecone': _pinecone,
+}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # keep-alive
+    disable_nagle_algorithm = True # otherwise, delayed ACKs add ~40ms to every response
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def _handle(self, method):
+        server = self.server.stand_in
+        url = urlsplit(self.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        if url.path == '/_stats':
+            with server.lock:
+                return self._send(200, dict(server.stats))
+
+        with server.lock:
+            server.stats['requests'] += 1
+            delay = server.latency.sample(server.rng)
+            throttled = server.rng.random() < server.throttle
+            if throttled:
+                server.stats['throttled'] += 1
+        time.sleep(max(delay, 0.))
+        if throttled:
+            return self._send(429, {'message': 'Too Many Requests'}, {'Retry-After': f'{server.retry_after:g}'})
+        try:
+            res = SERVICES[server.service](server, method, url.path, params, body)
+        except _BadRequest as e:
+            return self._send(400, {'error': str(e)})
+        if res is None:
+            return self._send(404, {'error': f'no route for {method} {url.path}'})
+        self._send(200, res)
+
+    def _send(self, status, res, headers=None):
+        if isinstance(res, str):
+            data, content_type = res.encode(), 'text/plain; charset=utf-8'
+        else:
+            data, content_type = json_dumps(res), 'application/json'
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _Config:
+    def __init__(self, service, latency, throttle, retry_after, page_size, total, dim, seed):
+        self.service = service
+        self.latency = latency
+        self.throttle = throttle
+        self.retry_after = retry_after
+        self.page_size = page_size
+        self.total = total
+        self.dim = dim
+        self.seed = seed
+
+
+def _serve(config: _Config, host: str, port: int, conn) -> None:
+    config.rng = random.Random(config.seed)
+    config.lock = threading.Lock()
+    config.stats = {'requests': 0, 'throttled': 0}
+    httpd = ThreadingHTTPServer((host, port), _Handler)
+    httpd.daemon_threads = True
+    httpd.request_queue_size = 1024
+    httpd.stand_in = config
+    conn.send(httpd.server_address[1])
+    conn.close()
+    httpd.serve_forever()
+
+
+class StandInServer:
+    """A local stand-in for one of the services, running in a separate process.
+
+    Example::
+
+        with StandInServer('semantic_scholar', latency=Latency('lognormal', 0.05, 0.5), throttle=0.01) as server:
+            s2 = SemanticScholarApi(transport=LocalTransport(semantic_scholar=server.url))
+    """
+
+    def __init__(self,
+        service: str,
+        *,
+        latency: Optional[Latency] = None,
+        throttle: float = 0.,
+        retry_after: float = 0.05,
+        page_size: Optional[int] = None,
+        total: int = 1000,
+        dim: int = 1024,
+        seed: int = 0,
+        host: str = '127.0.0.1',
+        port: int = 0,
+    ):
+        """
+        Args:
+            service: The service to mimic: ``'semantic_scholar'``, ``'dblp'``, ``'google'`` or ``'pinecone'``.
+            latency: The distribution of response latencies. Defaults to no added latency.
+            throttle: The fraction of requests answered with ``429 Too Many Requests``. Defaults to 0.
+            retry_after: The ``Retry-After`` (in seconds) sent with throttled responses. Defaults to 0.05.
+            page_size: The maximum number of results (or inputs) per request, below the service's own limit. Defaults
+                to None (the service's limit).
+            total: The number of results of each search query. Defaults to 1000.
+            dim: The dimension of dense embeddings. Defaults to 1024.
+            seed: The seed of the latency and throttling samples. Defaults to 0.
+            host: The address to listen on. Defaults to ``127.0.0.1``.
+            port: The port to listen on. Defaults to 0 (any free port).
+        """
+        if service not in SERVICES:
+            raise ValueError(f'unknown service {service!r} (expected one of {list(SERVICES)})')
+        self.service = service
+        self.host = host
+        self._config = _Config(service, latency or Latency('const', 0.), throttle, retry_after, page_size, total, dim, seed)
+        self._port = port
+        self._process = None
+
+    def start(self) -> 'StandInServer':
+        ctx = multiprocessing.get_context('spawn')
+        parent, child = ctx.Pipe(duplex=False)
+        self._process = ctx.Process(target=_serve, args=(self._config, self.host, self._port, child), daemon=True)
+        self._process.start()
+        self._port = parent.recv()
+        return self
+
+    def stop(self) -> None:
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join()
+            self._process = None
+
+    @property
+    def url(self) -> str:
+        return f'http://{self.host}:{self._port}'
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the number of requests served and throttled so far."""
+        import requests
+        return requests.get(self.url + '/_stats').json()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def __repr__(self):
+        c = self._config
+        return f'StandInServer({self.service!r}, latency={c.latency!r}, throttle={c.throttle!r}, page_size={c.page_size!r})'
+
+
+class LocalTransport(HttpTransport):
+    """An :class:`~pyterrier_services.HttpTransport` that sends the requests of an API object to a stand-in server."""
+
+    def __init__(self, *, semantic_scholar: Optional[str] = None, dblp: Optional[str] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.routes = {}
+        if semantic_scholar is not None:
+            self.routes[SemanticScholarApi.API_BASE_URL] = semantic_scholar + urlsplit(SemanticScholarApi.API_BASE_URL).path
+        if dblp is not None:
+            self.routes[DblpApi.API_BASE_URL] = dblp
+
+    def _route(self, url: str) -> str:
+        for remote, local in self.routes.items():
+            if url.startswith(remote):
+                return local + url[len(remote):]
+        return url
+
+    def get(self, url, **kwargs):
+        return super().get(self._route(url), **kwargs)
+
+    def post(self, url, **kwargs):
+        return super().post(self._route(url), **kwargs)
+
+    async def async_get(self, url, **kwargs):
+        return await super().async_get(self._route(url), **kwargs)
+
+    async def async_post(self, url, **kwargs):
+        return await super().async_post(self._route(url), **kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('service', choices=list(SERVICES))
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=Latency.parse, default=Latency('const', 0.), help='e.g. 0.02, uniform:0.01,0.05, lognormal:0.05,0.5 or exp:0.05')
+    parser.add_argument('--throttle', type=float, default=0., help='fraction of requests answered with 429')
+    parser.add_argument('--retry-after', type=float, default=0.05)
+    parser.add_argument('--page-size', type=int, default=None)
+    parser.add_argument('--total', type=int, default=1000, help='results per search query')
+    args = parser.parse_args()
+    server = StandInServer(args.service, latency=args.latency, throttle=args.throttle, retry_after=args.retry_after, page_size=args.page_size, total=args.total, port=args.port)
+    with server:
+        print(f'{server!r} listening on {server.url}')
+        try:
+            server._process.join()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,70 @@
 __version__ = '0.4.3'
 
-from .core import http_error_retry, paginated_search, multi_query
-from .semantic_scholar import SemanticScholarApi, SemanticScholarRetriever
-from .pinecone import PineconeApi, PineconeSparseModel, PineconeDenseModel, PineconeReranker
-from .dblp import DblpApi, DblpRetriever, DblpBibtexLoader
-from .google import GoogleApi, GoogleSearchRetriever
+import importlib
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+	from .core import http_error_retry, paginated_search, multi_query, multi_query_iter
+	from .core import async_http_error_retry, async_paginated_search, async_multi_query
+	from .cache import ResponseCache
+	from .transport import HttpTransport
+	from .ratelimit import RateLimiter
+	from .resilience import HedgePolicy, CircuitBreaker, CircuitOpenError, SingleFlight
+	from .metrics import Metrics
+	from .semantic_scholar import SemanticScholarApi, SemanticScholarRetriever, SemanticScholarLoader
+	from .inference_cache import InferenceCache
+	from .sparse import SparseVectors, SparseVector
+	from .pinecone import PineconeApi, PineconeSparseModel, PineconeDenseModel, PineconeReranker
+	from .dblp import DblpApi, DblpRetriever, DblpBibtexLoader
+	from .dblp_local import DblpLocalApi
+	from .dense_index import DenseIndex, DenseIndexer, DenseRetriever
+	from .sparse_index import SparseIndex, SparseIndexer, SparseRetriever
+	from .google import GoogleApi, GoogleSearchRetriever
+
+# Submodules are only imported when one of their attributes is first accessed, so that (e.g.) using DblpApi does not
+# pay for importing the Pinecone or Google clients. Keep in sync with the imports above.
+_LAZY = {
+	'core': ['http_error_retry', 'paginated_search', 'multi_query', 'multi_query_iter', 'async_http_error_retry', 'async_paginated_search', 'async_multi_query'],
+	'cache': ['ResponseCache'],
+	'transport': ['HttpTransport'],
+	'ratelimit': ['RateLimiter'],
+	'resilience': ['HedgePolicy', 'CircuitBreaker', 'CircuitOpenError', 'SingleFlight'],
+	'metrics': ['Metrics'],
+	'semantic_scholar': ['SemanticScholarApi', 'SemanticScholarRetriever', 'SemanticScholarLoader'],
+	'inference_cache': ['InferenceCache'],
+	'sparse': ['SparseVectors', 'SparseVector'],
+	'pinecone': ['PineconeApi', 'PineconeSparseModel', 'PineconeDenseModel', 'PineconeReranker'],
+	'dblp': ['DblpApi', 'DblpRetriever', 'DblpBibtexLoader'],
+	'dblp_local': ['DblpLocalApi'],
+	'dense_index': ['DenseIndex', 'DenseIndexer', 'DenseRetriever'],
+	'sparse_index': ['SparseIndex', 'SparseIndexer', 'SparseRetriever'],
+	'google': ['GoogleApi', 'GoogleSearchRetriever'],
+}
+_ATTR_MODULES = {attr: module for module, attrs in _LAZY.items() for attr in attrs}
+
+
+def __getattr__(name):
+	module = _ATTR_MODULES.get(name)
+	if module is None:
+		raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+	value = getattr(importlib.import_module(f'.{module}', __name__), name)
+	globals()[name] = value # cache, so that __getattr__ is only called on first access
+	return value
+
+
+def __dir__():
+	return sorted(set(globals()) | set(_ATTR_MODULES))
+
 
 __all__ = [
-	'http_error_retry', 'paginated_search', 'multi_query',
-	'SemanticScholarApi', 'SemanticScholarRetriever',
+	'http_error_retry', 'paginated_search', 'multi_query', 'multi_query_iter',
+	'async_http_error_retry', 'async_paginated_search', 'async_multi_query',
+	'ResponseCache', 'HttpTransport', 'RateLimiter', 'HedgePolicy', 'CircuitBreaker', 'CircuitOpenError', 'SingleFlight', 'Metrics',
+	'SemanticScholarApi', 'SemanticScholarRetriever', 'SemanticScholarLoader',
+	'InferenceCache', 'SparseVectors', 'SparseVector',
 	'PineconeApi', 'PineconeSparseModel', 'PineconeDenseModel', 'PineconeReranker',
-	'DblpApi', 'DblpRetriever', 'DblpBibtexLoader',
+	'DblpApi', 'DblpRetriever', 'DblpBibtexLoader', 'DblpLocalApi',
+	'DenseIndex', 'DenseIndexer', 'DenseRetriever',
+	'SparseIndex', 'SparseIndexer', 'SparseRetriever',
 	'GoogleApi', 'GoogleSearchRetriever',
 ]
@@ -0,0 +1,153 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from hashlib import sha256
+from typing import Any, Awaitable, Callable, Dict, Optional
+from .transport import json_loads, json_dumps
+
+_MISSING = object() # marks a cache miss, as None is a valid (JSON null) response
+
+
+class ResponseCache:
+    """A persistent on-disk cache of API responses, backed by a single SQLite file.
+
+    Responses are keyed on the service, endpoint and (normalised) request parameters, and are stored zlib-compressed.
+    Entries older than ``ttl`` seconds are treated as misses, and the least-recently-used entries are evicted once the
+    stored responses exceed ``max_bytes``. The file can be shared safely by multiple threads and processes.
+
+    Example::
+
+        cache = ResponseCache('responses.sqlite', ttl=7 * 24 * 60 * 60, max_bytes=2 ** 30)
+        s2 = SemanticScholarApi(cache=cache)
+        dblp = DblpApi(cache=cache)
+    """
+
+    def __init__(self,
+        path: str,
+        *,
+        ttl: Optional[float] = None,
+        max_bytes: Optional[int] = None,
+        compress_level: int = 6,
+    ):
+        """
+        Args:
+            path: The path of the SQLite file. It is created if it does not exist.
+            ttl: The number of seconds a response stays valid. Defaults to None (responses never expire).
+            max_bytes: The maximum (compressed) size of the stored responses. Defaults to None (unbounded).
+            compress_level: The zlib compression level (0-9). Defaults to 6.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.compress_level = compress_level
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+        self._local = threading.local()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    service TEXT NOT NULL,
+                    endpoint TEXT NOT NULL,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    accessed REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite connections cannot be shared across threads, so each thread gets its own
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=60.)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def key(service: str, endpoint: str, params: Dict[str, Any]) -> str:
+        """Returns the cache key for a request."""
+        params = sorted((str(k), str(v)) for k, v in params.items() if v is not None)
+        return sha256(json.dumps([service, endpoint, params]).encode()).hexdigest()
+
+    def get(self, service: str, endpoint: str, params: Dict[str, Any], default: Any = None) -> Optional[Any]:
+        """Returns the cached response for the request, or ``default`` (None) if it is missing or expired."""
+        key = self.key(service, endpoint, params)
+        now = time.time()
+        with self._connection() as conn:
+            row = conn.execute('SELECT value, created FROM responses WHERE key=?', (key,)).fetchone()
+            if row is not None and self.ttl is not None and row[1] < now - self.ttl:
+                conn.execute('DELETE FROM responses WHERE key=?', (key,))
+                row = None
+            if row is not None:
+                conn.execute('UPDATE responses SET accessed=? WHERE key=?', (now, key))
+        with self._stats_lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if row is None:
+            return default
+        return json_loads(zlib.decompress(row[0]))
+
+    def put(self, service: str, endpoint: str, params: Dict[str, Any], value: Any) -> None:
+        """Stores a (JSON-serialisable) response for the request."""
+        key = self.key(service, endpoint, params)
+        blob = zlib.compress(json_dumps(value), self.compress_level)
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (key, service, endpoint, blob, len(blob), now, now))
+            if self.max_bytes is not None:
+                self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        to_delete = []
+        for key, size in conn.execute('SELECT key, size FROM responses ORDER BY accessed'):
+            if total <= self.max_bytes:
+                break
+            to_delete.append((key,))
+            total -= size
+        conn.executemany('DELETE FROM responses WHERE key=?', to_delete)
+
+    def get_or_fetch(self, service: str, endpoint: str, params: Dict[str, Any], fetch: Callable[[], Any]) -> Any:
+        """Returns the cached response for the request, calling ``fetch()`` (and caching its result) on a miss."""
+        value = self.get(service, endpoint, params, default=_MISSING)
+        if value is _MISSING:
+            value = fetch()
+            self.put(service, endpoint, params, value)
+        return value
+
+    async def async_get_or_fetch(self, service: str, endpoint: str, params: Dict[str, Any], fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """Async version of :meth:`get_or_fetch`, where ``fetch`` is a coroutine function."""
+        value = self.get(service, endpoint, params, default=_MISSING)
+        if value is _MISSING:
+            value = await fetch()
+            self.put(service, endpoint, params, value)
+        return value
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the number of hits and misses of this cache object, and the number and size of stored responses."""
+        with self._connection() as conn:
+            count, size = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses').fetchone()
+        return {'hits': self.hits, 'misses': self.misses, 'count': count, 'bytes': size}
+
+    def clear(self) -> None:
+        """Removes all stored responses."""
+        with self._connection() as conn:
+            conn.execute('DELETE FROM responses')
+
+    def __repr__(self):
+        return f'ResponseCache({self.path!r})'
@@ -1,30 +1,166 @@
 import sys
+import asyncio
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import nullcontext
 from time import sleep
+from typing import Optional
 import requests
+import numpy as np
 import pyterrier as pt
 import pandas as pd
+from .ratelimit import retry_after
 
 
-def http_error_retry(fn, retries=5, cooldown=2., exp_cooldown=True):
+def _transient_errors():
+    errors = (requests.exceptions.HTTPError, requests.exceptions.Timeout, requests.exceptions.ConnectionError)
+    try:
+        import httpx
+        errors = errors + (httpx.HTTPStatusError, httpx.TimeoutException, httpx.TransportError)
+    except ModuleNotFoundError:
+        pass
+    try:
+        from googleapiclient.errors import HttpError
+        errors = errors + (HttpError,)
+    except ModuleNotFoundError:
+        pass
+    return errors
+
+
+def _error_response(e):
+    # Returns the status code and headers of the response that caused error e (None, None if there was no response)
+    response = getattr(e, 'response', None)
+    if response is not None:
+        return getattr(response, 'status_code', None), getattr(response, 'headers', None)
+    resp = getattr(e, 'resp', None) # googleapiclient's HttpError carries an httplib2 response (which is also its headers)
+    if resp is not None:
+        return getattr(resp, 'status', None), resp
+    return None, None
+
+
+def _retry_wait(e, cd, rate_limiter=None):
+    # Returns the number of seconds to wait before retrying after error e, or None if it should not be retried
+    status_code, headers = _error_response(e)
+    if status_code == 429:
+        wait = retry_after(headers)
+        if wait is not None and rate_limiter is not None:
+            # the rate limiter already paused for Retry-After, which holds back the retry along with all other requests
+            sys.stderr.write(f'Too many requests, rate limiter paused [{wait}sec]...\n')
+            return 0.
+        wait = cd if wait is None else wait
+        sys.stderr.write(f'Too many requests, cooling down [{wait}sec]...\n')
+        return wait
+    if status_code is not None and status_code < 500:
+        return None # other client errors will not succeed when retried
+    sys.stderr.write(f'{type(e).__name__}: {e}, retrying in [{cd}sec]...\n')
+    return cd
+
+
+def _record_error(circuit_breaker, endpoint, e):
+    # Only server errors, timeouts and connection errors count as failures of the endpoint; other client errors (e.g.,
+    # 404 for an unknown id) mean that the endpoint is healthy. 429 responses are left to the rate limiter.
+    status_code = _error_response(e)[0]
+    if status_code is None or status_code >= 500:
+        circuit_breaker.record_failure(endpoint)
+    elif status_code != 429:
+        circuit_breaker.record_success(endpoint)
+
+
+def http_error_retry(fn, retries=5, cooldown=2., exp_cooldown=True, *, hedge=None, circuit_breaker=None, endpoint=None, metrics=None, rate_limiter=None):
+    """Wraps ``fn`` to retry it when it fails with a transient error.
+
+    Transient errors are HTTP 429 (Too Many Requests) and 5xx responses, timeouts and connection errors. The wait before
+    retrying follows the response's ``Retry-After`` header when present, or ``cooldown`` seconds otherwise (doubling
+    after each attempt when ``exp_cooldown``). With ``cooldown=None``, failed requests are not retried.
+
+    Args:
+        hedge: A :class:`~pyterrier_services.HedgePolicy` used to run each attempt. Defaults to None (no hedging).
+        circuit_breaker: A :class:`~pyterrier_services.CircuitBreaker` guarding ``endpoint``. Defaults to None.
+        endpoint: The name of the endpoint called by ``fn``, used by the circuit breaker and metrics.
+        metrics: A :class:`~pyterrier_services.Metrics` to record retries and cooldowns to. Defaults to None.
+        rate_limiter: The :class:`~pyterrier_services.RateLimiter` that ``fn`` sends its requests through. A
+            ``Retry-After`` header then only pauses the limiter (which delays the retry), rather than also sleeping
+            before the retry. Defaults to None.
+    """
     def wrapped(*args, **kwargs):
         cd = cooldown
         ex = None
         for i in range(retries):
+            if circuit_breaker is not None:
+                circuit_breaker.check(endpoint)
+            try:
+                res = hedge.run(fn, *args, **kwargs) if hedge is not None else fn(*args, **kwargs)
+            except _transient_errors() as e:
+                ex = e
+                wait = _retry_wait(e, cd, rate_limiter) if cd is not None else None # no cooldown: do not retry
+                if circuit_breaker is not None:
+                    _record_error(circuit_breaker, endpoint, e)
+                if wait is None or i + 1 == retries:
+                    break
+                if metrics is not None:
+                    metrics.record_retry(endpoint, wait)
+                sleep(wait)
+                if exp_cooldown:
+                    cd = cd * 2
+            else:
+                if circuit_breaker is not None:
+                    circuit_breaker.record_success(endpoint)
+                return res
+        if ex is not None:
+            raise ex
+    return wrapped
+
+
+def async_http_error_retry(fn, retries=5, cooldown=2., exp_cooldown=True, *, hedge=None, circuit_breaker=None, endpoint=None, metrics=None, rate_limiter=None):
+    """Async version of :func:`http_error_retry`, for wrapping coroutine functions."""
+    async def wrapped(*args, **kwargs):
+        cd = cooldown
+        ex = None
+        for i in range(retries):
+            if circuit_breaker is not None:
+                circuit_breaker.check(endpoint)
             try:
-                return fn(*args, **kwargs)
-            except requests.exceptions.HTTPError as e:
+                res = await (hedge.async_run(fn, *args, **kwargs) if hedge is not None else fn(*args, **kwargs))
+            except _transient_errors() as e:
                 ex = e
-                if e.response.status_code == 429 and cd is not None and i + 1 != retries:
-                    sys.stderr.write(f'Too many requests, cooling down [{cd}sec]...\n')
-                    sleep(cd)
-                    if exp_cooldown:
-                        cd = cd * 2
+                wait = _retry_wait(e, cd, rate_limiter) if cd is not None else None # no cooldown: do not retry
+                if circuit_breaker is not None:
+                    _record_error(circuit_breaker, endpoint, e)
+                if wait is None or i + 1 == retries:
+                    break
+                if metrics is not None:
+                    metrics.record_retry(endpoint, wait)
+                await asyncio.sleep(wait)
+                if exp_cooldown:
+                    cd = cd * 2
+            else:
+                if circuit_breaker is not None:
+                    circuit_breaker.record_success(endpoint)
+                return res
         if ex is not None:
             raise ex
     return wrapped
 
 
-def paginated_search(fn, num_results):
+def paginated_search(fn, num_results, *, page_size: Optional[int] = None, max_workers: Optional[int] = None, use_total: bool = True, token: bool = False):
+    """Wraps ``fn(query, offset=, limit=, return_next=True) -> (DataFrame, next_offset)`` to fetch ``num_results`` results.
+
+    By default, pages are fetched one after another. When ``page_size`` is provided and ``max_workers > 1``, the
+    offsets of the following pages are computed from the first page instead, and up to ``max_workers`` pages are
+    fetched concurrently. With ``use_total``, ``fn`` must also accept ``return_total=True``, and no pages are requested
+    past the total number of results; otherwise, full pages are assumed, and fetching stops at the first short page.
+    Either way, the results are returned in rank order.
+
+    With ``token``, pages are instead linked by continuation tokens: ``fn(query, token=, limit=, return_next=True)``
+    returns the token of the next page (or None after the last one), and the first page is requested with
+    ``token=None``. Pages are then fetched one after another, and the ranks of each page (which start at 0) are
+    shifted by the number of results before it (with ``score = -rank``).
+    """
+    if token:
+        return _token_search(fn, num_results)
+    if page_size is not None and max_workers is not None and max_workers > 1:
+        return _prefetched_search(fn, num_results, page_size, max_workers, use_total)
+
     def wrapped(query):
         pages = []
         count = 0
@@ -39,25 +175,270 @@ def paginated_search(fn, num_results):
     return wrapped
 
 
-def multi_query(fn, verbose=True, verbose_desc='retrieving'):
+def _shift_ranks(page, count):
+    rank = page['rank'] + count
+    return page.assign(rank=rank, score=-rank)
+
+
+def _token_search(fn, num_results):
+    def wrapped(query):
+        pages = []
+        count = 0
+        token = None
+        while count < num_results:
+            page, token = fn(query, token=token, limit=num_results-count, return_next=True)
+            pages.append(_shift_ranks(page, count))
+            count += len(page)
+            if len(page) == 0 or token is None:
+                break
+        return pd.concat(pages, ignore_index=True)
+    return wrapped
+
+
+def _page_requests(offset, count, target, page_size, max_pages):
+    # The (offset, limit) of up to max_pages full pages following the one that ended at offset
+    requests = []
+    while count < target and len(requests) < max_pages:
+        limit = min(page_size, target - count)
+        requests.append((offset, limit))
+        offset += limit
+        count += limit
+    return requests
+
+
+def _first_page(res, use_total, num_results):
+    if use_total:
+        page, offset, total = res
+        return page, offset, min(num_results, total)
+    page, offset = res
+    return page, offset, num_results
+
+
+def _collect_wave(pages, wave, results):
+    # Adds the pages of a wave (in rank order), returning whether the results ran out
+    for (_, limit), page in zip(wave, results):
+        pages.append(page)
+        if len(page) < limit:
+            return True
+    return False
+
+
+def _prefetched_search(fn, num_results, page_size, max_workers, use_total):
+    def wrapped(query):
+        extra = {'return_total': True} if use_total else {}
+        page, offset, target = _first_page(fn(query, offset=0, limit=min(page_size, num_results), return_next=True, **extra), use_total, num_results)
+        pages = [page]
+        count = len(page)
+        if offset is None or count < min(page_size, num_results):
+            return pd.concat(pages, ignore_index=True)
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            while True:
+                wave = _page_requests(offset, count, target, page_size, max_workers)
+                if not wave:
+                    break
+                results = pool.map(lambda req: fn(query, offset=req[0], limit=req[1], return_next=True)[0], wave) # map preserves the page order
+                if _collect_wave(pages, wave, results):
+                    break
+                offset, count = wave[-1][0] + wave[-1][1], count + sum(limit for _, limit in wave)
+        return pd.concat(pages, ignore_index=True)
+    return wrapped
+
+
+def async_paginated_search(fn, num_results, *, page_size: Optional[int] = None, max_workers: Optional[int] = None, use_total: bool = True, token: bool = False):
+    """Async version of :func:`paginated_search`, for wrapping coroutine functions."""
+    if token:
+        return _async_token_search(fn, num_results)
+    if page_size is not None and max_workers is not None and max_workers > 1:
+        return _async_prefetched_search(fn, num_results, page_size, max_workers, use_total)
+
+    async def wrapped(query):
+        pages = []
+        count = 0
+        offset = 0
+        while count < num_results and offset is not None:
+            page, offset = await fn(query, offset=offset, limit=num_results-count, return_next=True)
+            pages.append(page)
+            count += len(page)
+            if len(page) == 0:
+                break
+        return pd.concat(pages, ignore_index=True)
+    return wrapped
+
+
+def _async_token_search(fn, num_results):
+    async def wrapped(query):
+        pages = []
+        count = 0
+        token = None
+        while count < num_results:
+            page, token = await fn(query, token=token, limit=num_results-count, return_next=True)
+            pages.append(_shift_ranks(page, count))
+            count += len(page)
+            if len(page) == 0 or token is None:
+                break
+        return pd.concat(pages, ignore_index=True)
+    return wrapped
+
+
+def _async_prefetched_search(fn, num_results, page_size, max_workers, use_total):
+    async def wrapped(query):
+        extra = {'return_total': True} if use_total else {}
+        page, offset, target = _first_page(await fn(query, offset=0, limit=min(page_size, num_results), return_next=True, **extra), use_total, num_results)
+        pages = [page]
+        count = len(page)
+        if offset is None or count < min(page_size, num_results):
+            return pd.concat(pages, ignore_index=True)
+        while True:
+            wave = _page_requests(offset, count, target, page_size, max_workers)
+            if not wave:
+                break
+            results = await asyncio.gather(*[fn(query, offset=o, limit=limit, return_next=True) for o, limit in wave])
+            if _collect_wave(pages, wave, [r[0] for r in results]):
+                break
+            offset, count = wave[-1][0] + wave[-1][1], count + sum(limit for _, limit in wave)
+        return pd.concat(pages, ignore_index=True)
+    return wrapped
+
+
+def multi_query(fn, verbose=True, verbose_desc='retrieving', max_workers: Optional[int] = None, executor: Optional[Executor] = None, metrics=None):
+    """Wraps ``fn(query) -> DataFrame`` to run it over every row of a query frame.
+
+    Queries are run concurrently when ``max_workers > 1`` (using a thread pool) or when an ``executor`` is provided;
+    the provided executor is not shut down afterwards. Either way, results are returned in the order of the input rows.
+    A query string that appears in several rows (e.g., under different qids) is only run once, and its results are
+    repeated for each of the rows. The time spent assembling the output frame is recorded to the ``assemble`` stage of
+    ``metrics`` (if provided).
+    """
+    def wrapped(inp):
+        rows = inp['query'].tolist()
+        queries = list(dict.fromkeys(rows))
+        if executor is not None:
+            ctx = nullcontext(executor)
+        elif max_workers is not None and max_workers > 1:
+            ctx = ThreadPoolExecutor(max_workers=max_workers)
+        else:
+            ctx = nullcontext(None)
+        with ctx as ex:
+            it = map(fn, queries) if ex is None else ex.map(fn, queries) # map preserves the input order
+            if verbose:
+                it = pt.tqdm(it, desc=verbose_desc, unit='q', total=len(queries))
+            res = _fan_out(list(it), queries, rows)
+
+        if metrics is None:
+            return _concat_results(res, inp)
+        with metrics.timer('assemble'):
+            return _concat_results(res, inp)
+    return wrapped
+
+
+def multi_query_iter(fn, verbose=True, verbose_desc='retrieving', max_workers: Optional[int] = None):
+    """Wraps ``fn(query) -> DataFrame`` to run it over an iterable of query records, yielding result records.
+
+    Unlike :func:`multi_query`, results are streamed rather than collected: the records of each query are yielded (in
+    input order) as soon as it and all preceding queries have finished, and at most ``max_workers`` queries are in
+    flight or waiting to be consumed at once. This keeps memory bounded over very large query sets, and lets
+    downstream stages start on the first results straight away.
+    """
+    def run_query(query):
+        query_res = fn(query['query'])
+        return [_order_record({**query, **rec}) for rec in query_res.to_dict(orient='records')]
+
     def wrapped(inp):
-        it = inp.itertuples(index=False)
-        if verbose:
-            it = pt.tqdm(it, desc=verbose_desc, unit='q', total=len(inp))
-        res = []
-        for query in it:
-            query_res = fn(query.query)
-            query_res = query_res.assign(**{k: v for k, v in query._asdict().items() if k not in query_res.columns})
-            res.append(query_res)
+        pbar = pt.tqdm(desc=verbose_desc, unit='q', total=len(inp) if hasattr(inp, '__len__') else None) if verbose else None
+        try:
+            if max_workers is None or max_workers <= 1:
+                for query in inp:
+                    yield from run_query(query)
+                    if pbar is not None:
+                        pbar.update(1)
+                return
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                pending = deque()
+                for query in inp:
+                    pending.append(pool.submit(run_query, query))
+                    if len(pending) >= max_workers:
+                        yield from pending.popleft().result()
+                        if pbar is not None:
+                            pbar.update(1)
+                while pending:
+                    yield from pending.popleft().result()
+                    if pbar is not None:
+                        pbar.update(1)
+        finally:
+            if pbar is not None:
+                pbar.close()
+    return wrapped
+
 
-        df = pd.concat(res, ignore_index=True)
+def async_multi_query(fn, verbose=True, verbose_desc='retrieving', max_concurrency: Optional[int] = None, metrics=None):
+    """Async version of :func:`multi_query`, for wrapping ``async fn(query) -> DataFrame``.
 
-        desired_order = ["qid", "query", "docno", "score", "rank"]
+    All queries are dispatched on the running event loop, with at most ``max_concurrency`` in flight at once (unlimited
+    if not provided). Results are returned in the order of the input rows, and duplicate query strings are only run once.
+    """
+    async def wrapped(inp):
+        rows = inp['query'].tolist()
+        queries = list(dict.fromkeys(rows))
+        semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+        pbar = pt.tqdm(desc=verbose_desc, unit='q', total=len(queries)) if verbose else None
 
-        # Add any remaining columns not in the desired order
-        remaining_columns = [col for col in df.columns if col not in desired_order]
-        new_order = desired_order + remaining_columns
+        async def run_query(query):
+            if semaphore is not None:
+                async with semaphore:
+                    query_res = await fn(query)
+            else:
+                query_res = await fn(query)
+            if pbar is not None:
+                pbar.update(1)
+            return query_res
 
-        # Reorder the dataframe
-        return df[new_order]
+        try:
+            res = _fan_out(await asyncio.gather(*[run_query(query) for query in queries]), queries, rows)
+        finally:
+            if pbar is not None:
+                pbar.close()
+        if metrics is None:
+            return _concat_results(res, inp)
+        with metrics.timer('assemble'):
+            return _concat_results(res, inp)
     return wrapped
+
+
+def _fan_out(res, queries, rows):
+    # Maps the results of each (unique) query back to the rows it came from
+    if len(queries) == len(rows):
+        return res
+    by_query = dict(zip(queries, res))
+    return [by_query[query] for query in rows]
+
+
+_DESIRED_ORDER = ["qid", "query", "docno", "score", "rank"]
+
+
+def _order_record(record):
+    res = {k: record[k] for k in _DESIRED_ORDER if k in record}
+    res.update((k, v) for k, v in record.items() if k not in res)
+    return res
+
+
+def _concat_results(res, inp):
+    # the output is assembled once, column by column, rather than assigning the query columns to every per-query
+    # frame and re-ordering the concatenated frame (which copies every row several times)
+    df = pd.concat(res, ignore_index=True)
+    query_columns = [c for c in inp.columns if c not in df.columns]
+    query_df = inp.iloc[np.repeat(np.arange(len(inp)), [len(r) for r in res])][query_columns].reset_index(drop=True)
+    columns = {c: df[c] for c in df.columns}
+    columns.update((c, query_df[c]) for c in query_columns)
+
+    # the desired columns first, followed by the result columns and then the remaining query columns
+    new_order = _DESIRED_ORDER + [c for c in columns if c not in _DESIRED_ORDER]
+    return pd.DataFrame({c: columns[c] for c in new_order}, copy=False)
+
+
+def _take_factorized(values, codes: np.ndarray) -> np.ndarray:
+    # values[codes] (as an object array) for codes from pd.factorize, with NaN where the code is -1 (a missing value)
+    values = pd.Series(values, dtype=object).to_numpy() # 1-d, even if the values are lists
+    res = np.full(len(codes), np.nan, dtype=object)
+    found = codes >= 0
+    res[found] = values[codes[found]]
+    return res
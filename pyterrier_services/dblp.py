@@ -1,11 +1,25 @@
 from typing import Optional, Union, Tuple
 from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
+import numpy as np
 import pandas as pd
-import requests
 import pyterrier as pt
 import pyterrier_alpha as pta
-from . import http_error_retry, paginated_search, multi_query
+from .core import http_error_retry, paginated_search, multi_query, multi_query_iter, _take_factorized
+from .core import async_http_error_retry, async_paginated_search, async_multi_query
+from .cache import ResponseCache
+from .transport import HttpTransport, json_loads
+from .ratelimit import RateLimiter
+from .resilience import HedgePolicy, CircuitBreaker, SingleFlight
+from .metrics import Metrics
+
+
+def _author_names(authors):
+    authors = (authors or {}).get('author', [])
+    if isinstance(authors, dict): # a single author is not wrapped in a list
+        return [authors['text']]
+    return [a['text'] for a in authors]
 
 
 class DblpEntityType(Enum):
@@ -24,12 +38,44 @@ class DblpApi:
     """Represents a reference to the DBLP search API."""
 
     API_BASE_URL = 'https://dblp.org'
+    DEFAULT_MAX_WORKERS = 2 # dblp.org asks clients to keep their load modest
+    MAX_PAGE_SIZE = 1000
+
+    def __init__(self,
+        *,
+        cache: Optional[ResponseCache] = None,
+        transport: Optional[HttpTransport] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        hedge: Optional[HedgePolicy] = None,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        single_flight: Optional[SingleFlight] = None,
+        metrics: Optional[Metrics] = None,
+    ):
+        """
+        Args:
+            cache: A cache for API responses. Defaults to None (no caching).
+            transport: The HTTP transport to send requests over. Defaults to a new instance of :class:`~pyterrier_services.HttpTransport`.
+            rate_limiter: The client-side rate limiter for requests. Defaults to ``RateLimiter.dblp()``.
+            hedge: A policy for hedging slow requests. Defaults to None (no hedging).
+            circuit_breaker: A circuit breaker that fails fast on endpoints that keep failing. Defaults to None.
+            single_flight: Coalesces identical requests that are in flight at the same time. Defaults to a new instance of :class:`~pyterrier_services.SingleFlight`.
+            metrics: The metrics to record requests and timings to. Defaults to a new instance of :class:`~pyterrier_services.Metrics`.
+        """
+        self.cache = cache
+        self.transport = transport or HttpTransport()
+        self.rate_limiter = rate_limiter or RateLimiter.dblp()
+        self.hedge = hedge
+        self.circuit_breaker = circuit_breaker
+        self.single_flight = single_flight or SingleFlight()
+        self.metrics = metrics or Metrics()
 
     def retriever(self,
         *,
         num_results: int = 100,
         entity_type: Union[str, DblpEntityType] = DblpEntityType.publication,
-        verbose: bool = True
+        verbose: bool = True,
+        max_workers: Optional[int] = None,
+        page_workers: int = 1,
     ) -> pt.Transformer:
         """Returns a :class:`~pyterrier.Transformer` that retrieves from DBLP.
 
@@ -37,21 +83,25 @@ class DblpApi:
             num_results: The number of results to retrieve. Defaults to 100.
             entity_type: The type of entity to search over. Defaults to ``DblpEntityType.publication``.
             verbose: Whether to log the progress. Defaults to True.
+            max_workers: The number of queries to run concurrently. Defaults to ``DblpApi.DEFAULT_MAX_WORKERS``.
+            page_workers: The number of result pages of a query to fetch concurrently. Defaults to 1 (one after another).
         """
-        return DblpRetriever(api=self, num_results=num_results, entity_type=entity_type, verbose=verbose)
+        return DblpRetriever(api=self, num_results=num_results, entity_type=entity_type, verbose=verbose, max_workers=max_workers, page_workers=page_workers)
 
     def bibtex_loader(self,
         *,
         bib_type: Union[str, DblpBibType] = DblpBibType.standard,
-        verbose: bool = True
+        verbose: bool = True,
+        max_workers: Optional[int] = None,
     ) -> pt.Transformer:
         """Returns a :class:`~pyterrier.Transformer` that loads bibtex data from DBLP.
 
         Args:
             bib_type: The type of BibTeX to load. Defaults to ``DblpBibType.standard``.
             verbose: Whether to log the progress. Defaults to True.
+            max_workers: The number of records to load concurrently. Defaults to ``DblpApi.DEFAULT_MAX_WORKERS``.
         """
-        return DblpBibtexLoader(api=self, bib_type=bib_type, verbose=verbose)
+        return DblpBibtexLoader(api=self, bib_type=bib_type, verbose=verbose, max_workers=max_workers)
 
     def search(self,
         query: str,
@@ -73,7 +123,29 @@ class DblpApi:
             return_total: Whether to return the total number of results. Defaults to False.
         """
         entity_type = DblpEntityType(entity_type)
-        limit = max(min(limit, 1000), 1)
+        endpoint, params = self._search_request(query, entity_type=entity_type, offset=offset, limit=limit)
+        http_res = self._get(endpoint, params=params, name=f'dblp/search/{entity_type.value}')
+        with self.metrics.timer('parse'):
+            return self._parse_search(http_res, entity_type=entity_type, limit=params['c'], return_next=return_next, return_total=return_total)
+
+    async def async_search(self,
+        query: str,
+        *,
+        entity_type: Union[str, DblpEntityType] = DblpEntityType.publication,
+        offset: int = 0,
+        limit: int = 100,
+        return_next: bool = False,
+        return_total: bool = False,
+    ) -> Union[pd.DataFrame, Tuple[pd.DataFrame, int], Tuple[pd.DataFrame, int, int]]:
+        """Async version of :meth:`search`. Requires the ``httpx`` package."""
+        entity_type = DblpEntityType(entity_type)
+        endpoint, params = self._search_request(query, entity_type=entity_type, offset=offset, limit=limit)
+        http_res = await self._async_get(endpoint, params=params, name=f'dblp/search/{entity_type.value}')
+        with self.metrics.timer('parse'):
+            return self._parse_search(http_res, entity_type=entity_type, limit=params['c'], return_next=return_next, return_total=return_total)
+
+    def _search_request(self, query, *, entity_type, offset, limit):
+        limit = max(min(limit, self.MAX_PAGE_SIZE), 1)
         params = {
             'q': query,
             'format': 'json',
@@ -85,36 +157,36 @@ class DblpApi:
             DblpEntityType.author: '/search/author/api',
             DblpEntityType.venue: '/search/venue/api',
         }[entity_type]
-        http_res = requests.get(DblpApi.API_BASE_URL + endpoint, params=params)
-        http_res.raise_for_status()
-        http_res = http_res.json()['result']
-
-        data_columns, docno_column_fn = {
-            DblpEntityType.publication: (['title', 'authors', 'year', 'type'], lambda hit: hit['info']['key']),
-            DblpEntityType.author: (['author'], lambda hit: hit['info']['url'].replace('https://dblp.org/pid/', '')),
-            DblpEntityType.venue: (['venue', 'acronym', 'type'], lambda hit: hit['info']['url'].replace('https://dblp.org/db/', '')[:-1]),
-        }[entity_type]
+        return endpoint, params
+
+    def _parse_search(self, http_res, *, entity_type, limit, return_next, return_total):
+        http_res = http_res['result']
 
-        result_df = []
         first = int(http_res['hits']['@first'])
-        for rank, hit in zip(range(limit), http_res['hits'].get('hit', [])):
-            row = [
-                docno_column_fn(hit),
-                first + rank,
-                -1.0 * (first + rank),
-            ]
-            for c in data_columns:
-                if c == 'authors':
-                    authors = hit['info'][c].get('author', [])
-                    if isinstance(authors, dict):
-                        authors = [authors]
-                    row.append([a['text'] for a in authors])
-                elif c == 'title':
-                    row.append(hit['info'][c].rstrip('.')) # dblp search results add a trailing . to titles for some reason?
-                else:
-                    row.append(hit['info'].get(c))
-            result_df.append(row)
-        result_df = pd.DataFrame(result_df, columns=['docno', 'rank', 'score', *data_columns])
+        infos = [hit['info'] for hit in http_res['hits'].get('hit', [])[:limit]]
+        ranks = np.arange(first, first + len(infos))
+        if entity_type == DblpEntityType.publication:
+            columns = {
+                'docno': [info['key'] for info in infos],
+                'title': [info['title'].rstrip('.') for info in infos], # dblp search results add a trailing . to titles for some reason?
+                'authors': [_author_names(info.get('authors')) for info in infos],
+                'year': [info.get('year') for info in infos],
+                'type': [info.get('type') for info in infos],
+            }
+        elif entity_type == DblpEntityType.author:
+            columns = {
+                'docno': [info['url'].replace('https://dblp.org/pid/', '') for info in infos],
+                'author': [info.get('author') for info in infos],
+            }
+        else:
+            columns = {
+                'docno': [info['url'].replace('https://dblp.org/db/', '')[:-1] for info in infos],
+                'venue': [info.get('venue') for info in infos],
+                'acronym': [info.get('acronym') for info in infos],
+                'type': [info.get('type') for info in infos],
+            }
+        docno = columns.pop('docno')
+        result_df = pd.DataFrame({'docno': docno, 'rank': ranks, 'score': -ranks.astype(float), **columns})
 
         res = [result_df]
         if return_next:
@@ -130,15 +202,53 @@ class DblpApi:
         *,
         bib_type: Union[str, DblpBibType] = DblpBibType.standard,
     ) -> str:
+        endpoint, params = self._bibtex_request(docno, bib_type=bib_type)
+        return self._get(endpoint, params=params, name='dblp/rec', text=True)
+
+    async def async_load_bibtex(self,
+        docno: str,
+        *,
+        bib_type: Union[str, DblpBibType] = DblpBibType.standard,
+    ) -> str:
+        """Async version of :meth:`load_bibtex`. Requires the ``httpx`` package."""
+        endpoint, params = self._bibtex_request(docno, bib_type=bib_type)
+        return await self._async_get(endpoint, params=params, name='dblp/rec', text=True)
+
+    async def aclose(self):
+        """Closes the async HTTP client used by the running event loop."""
+        await self.transport.aclose()
+
+    def _get(self, endpoint, *, params, name, text=False):
+        def fetch():
+            with self.rate_limiter.limit() as permit, self.metrics.request(name) as req:
+                http_res = self.transport.get(DblpApi.API_BASE_URL + endpoint, params=params)
+                req.observe(http_res.status_code, len(http_res.content))
+                permit.observe(http_res.status_code, http_res.headers)
+            http_res.raise_for_status()
+            with self.metrics.timer('decode'):
+                return http_res.text if text else json_loads(http_res.content)
+        return self.metrics.get_or_fetch(self.cache, name, 'dblp', endpoint, params, fetch)
+
+    async def _async_get(self, endpoint, *, params, name, text=False):
+        async def fetch():
+            async with self.rate_limiter.async_limit() as permit:
+                with self.metrics.request(name) as req:
+                    http_res = await self.transport.async_get(DblpApi.API_BASE_URL + endpoint, params=params)
+                    req.observe(http_res.status_code, len(http_res.content))
+                permit.observe(http_res.status_code, http_res.headers)
+            http_res.raise_for_status()
+            with self.metrics.timer('decode'):
+                return http_res.text if text else json_loads(http_res.content)
+        return await self.metrics.async_get_or_fetch(self.cache, name, 'dblp', endpoint, params, fetch)
+
+    def _bibtex_request(self, docno, *, bib_type):
         bib_type = DblpBibType(bib_type)
         param = {
             DblpBibType.standard: '1',
             DblpBibType.condensed: '0',
             DblpBibType.with_crossref: '2',
         }[bib_type]
-        http_res = requests.get(f'{DblpApi.API_BASE_URL}/rec/{docno}.bib', params={'param': param})
-        http_res.raise_for_status()
-        return http_res.text
+        return f'/rec/{docno}.bib', {'param': param}
 
 
 class DblpRetriever(pt.Transformer):
@@ -148,7 +258,9 @@ class DblpRetriever(pt.Transformer):
         api: Optional[DblpApi] = None,
         num_results: int = 100,
         entity_type: Union[str, DblpEntityType] = DblpEntityType.publication,
-        verbose: bool = True
+        verbose: bool = True,
+        max_workers: Optional[int] = None,
+        page_workers: int = 1,
     ):
         """
         Args:
@@ -156,54 +268,124 @@ class DblpRetriever(pt.Transformer):
             num_results: The number of results to retrieve per query. Defaults to 100.
             entity_type: The type of entity to search over. Defaults to ``DblpEntityType.publication``
             verbose: Whether to log the progress. Defaults to True.
+            max_workers: The number of queries to run concurrently. Defaults to ``api.DEFAULT_MAX_WORKERS``.
+            page_workers: The number of result pages of a query to fetch concurrently. Defaults to 1 (one after another).
         """
         self.api = api or DblpApi()
         self.num_results = num_results
         self.entity_type = entity_type
         self.verbose = verbose
+        self.max_workers = max_workers or self.api.DEFAULT_MAX_WORKERS
+        self.page_workers = page_workers
+
+    def _search_fn(self):
+        return paginated_search(
+            self.api.single_flight.wrap(http_error_retry(
+                partial(self.api.search, entity_type=self.entity_type),
+                hedge=self.api.hedge,
+                circuit_breaker=self.api.circuit_breaker,
+                endpoint=f'dblp/search/{DblpEntityType(self.entity_type).value}',
+                metrics=self.api.metrics,
+                rate_limiter=self.api.rate_limiter,
+            ), ('dblp/search', DblpEntityType(self.entity_type).value)),
+            num_results=self.num_results,
+            page_size=self.api.MAX_PAGE_SIZE,
+            max_workers=self.page_workers,
+        )
+
+    def _async_search_fn(self):
+        return async_paginated_search(
+            self.api.single_flight.async_wrap(async_http_error_retry(
+                partial(self.api.async_search, entity_type=self.entity_type),
+                hedge=self.api.hedge,
+                circuit_breaker=self.api.circuit_breaker,
+                endpoint=f'dblp/search/{DblpEntityType(self.entity_type).value}',
+                metrics=self.api.metrics,
+                rate_limiter=self.api.rate_limiter,
+            ), ('dblp/search', DblpEntityType(self.entity_type).value)),
+            num_results=self.num_results,
+            page_size=self.api.MAX_PAGE_SIZE,
+            max_workers=self.page_workers,
+        )
 
     def transform(self, inp: pd.DataFrame) -> pd.DataFrame:
         pta.validate.query_frame(inp, extra_columns=['query'])
-        return multi_query(
-            paginated_search(
-                http_error_retry(
-                    partial(self.api.search, entity_type=self.entity_type)
-                ),
-                num_results=self.num_results,
-            ),
+        with self.api.metrics.call('DblpRetriever'):
+            return multi_query(
+                self._search_fn(),
+                verbose=self.verbose,
+                verbose_desc='DblpRetriever',
+                max_workers=self.max_workers,
+                metrics=self.api.metrics,
+            )(inp)
+
+    def transform_iter(self, inp: pt.model.IterDict) -> pt.model.IterDict:
+        """Streaming version of :meth:`transform`, which yields the results of each query as soon as they arrive."""
+        return self.api.metrics.call_iter('DblpRetriever', multi_query_iter(
+            self._search_fn(),
             verbose=self.verbose,
             verbose_desc='DblpRetriever',
-        )(inp)
+            max_workers=self.max_workers,
+        )(inp))
+
+    async def async_transform(self, inp: pd.DataFrame) -> pd.DataFrame:
+        """Async version of :meth:`transform`, which runs the queries on the current event loop."""
+        pta.validate.query_frame(inp, extra_columns=['query'])
+        with self.api.metrics.call('DblpRetriever'):
+            return await async_multi_query(
+                self._async_search_fn(),
+                verbose=self.verbose,
+                verbose_desc='DblpRetriever',
+                max_concurrency=self.max_workers,
+                metrics=self.api.metrics,
+            )(inp)
 
     def fuse_rank_cutoff(self, k: int) -> Optional['DblpRetriever']:
         if k < self.num_results:
-            return DblpRetriever(api=self.api, num_results=k, entity_type=self.entity_type, verbose=self.verbose)
+            return DblpRetriever(api=self.api, num_results=k, entity_type=self.entity_type, verbose=self.verbose, max_workers=self.max_workers, page_workers=self.page_workers)
 
 
 class DblpBibtexLoader(pt.Transformer):
-    """A :class:`~pyterrier.Transformer` that loads BibTeX data from DBLP."""
+    """A :class:`~pyterrier.Transformer` that loads BibTeX data from DBLP.
+
+    Each distinct ``docno`` is only loaded once, with up to ``max_workers`` records loaded concurrently (paced by the
+    API's rate limiter, and retried on transient errors).
+    """
     def __init__(self,
         *,
         api: Optional[DblpApi] = None,
         bib_type: Union[str, DblpBibType] = DblpBibType.standard,
-        verbose: bool = True
+        verbose: bool = True,
+        max_workers: Optional[int] = None,
     ):
         """
         Args:
             api: The DBLP api service. Defaults to a new instance of :class:`~pyterrier_services.DblpApi`.
             bib_type: The type of BibTeX to load. Defaults to ``DblpBibType.standard``.
             verbose: Whether to log the progress. Defaults to True.
+            max_workers: The number of records to load concurrently. Defaults to ``api.DEFAULT_MAX_WORKERS``.
         """
         self.api = api or DblpApi()
         self.bib_type = bib_type
         self.verbose = verbose
+        self.max_workers = max_workers or self.api.DEFAULT_MAX_WORKERS
 
     def transform(self, inp: pd.DataFrame) -> pd.DataFrame:
         pta.validate.columns(inp, includes=['docno'])
-        bibtex = []
-        it = inp['docno']
-        if self.verbose:
-            it = pt.tqdm(it, desc='DblpBibtexLoader')
-        for docno in it:
-            bibtex.append(self.api.load_bibtex(docno, bib_type=self.bib_type))
-        return inp.assign(bibtex=bibtex)
+        with self.api.metrics.call('DblpBibtexLoader'):
+            codes, docnos = pd.factorize(inp['docno'])
+            load = self.api.single_flight.wrap(http_error_retry(
+                partial(self.api.load_bibtex, bib_type=self.bib_type),
+                hedge=self.api.hedge,
+                circuit_breaker=self.api.circuit_breaker,
+                endpoint='dblp/rec',
+                metrics=self.api.metrics,
+                rate_limiter=self.api.rate_limiter,
+            ), ('dblp/rec', DblpBibType(self.bib_type).value))
+            with ThreadPoolExecutor(max_workers=max(self.max_workers, 1)) as pool:
+                it = pool.map(load, docnos) # map preserves the input order
+                if self.verbose:
+                    it = pt.tqdm(it, desc='DblpBibtexLoader', total=len(docnos))
+                bibtex = list(it)
+            with self.api.metrics.timer('assemble'):
+                return inp.assign(bibtex=_take_factorized(bibtex, codes)) # NaN for missing docnos
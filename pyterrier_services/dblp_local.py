@@ -0,0 +1,437 @@
+import contextlib
+import gzip
+import heapq
+import json
+import os
+import re
+import unicodedata
+import xml.etree.ElementTree as ET
+from array import array
+from html.entities import name2codepoint
+from itertools import groupby
+from operator import itemgetter
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+import numpy as np
+import pandas as pd
+import pyterrier as pt
+from .dblp import DblpApi, DblpBibType, DblpEntityType
+from .metrics import Metrics
+
+_PUBLICATION_TYPES = {
+    'article': 'Journal Articles',
+    'inproceedings': 'Conference and Workshop Papers',
+    'proceedings': 'Editorship',
+    'book': 'Books and Theses',
+    'phdthesis': 'Books and Theses',
+    'mastersthesis': 'Books and Theses',
+    'incollection': 'Parts in Books or Collections',
+    'data': 'Data and Artifacts',
+}
+_RECORD_TAGS = set(_PUBLICATION_TYPES) | {'www'}
+_LIST_FIELDS = {'author', 'editor', 'ee', 'isbn'}
+_TEXT_FIELDS = {'title', 'year', 'journal', 'booktitle', 'volume', 'number', 'pages', 'publisher', 'series', 'school', 'crossref', 'url', 'month', 'note'}
+_VENUE_TYPES = {
+    'conf': 'Conference or Workshop',
+    'journals': 'Journal',
+    'series': 'Series',
+    'books': 'Book',
+    'reference': 'Reference Work',
+}
+_ENTITY_KINDS = {
+    DblpEntityType.publication: 'publ',
+    DblpEntityType.author: 'author',
+    DblpEntityType.venue: 'venue',
+}
+
+
+def _tokens(text: str) -> List[str]:
+    # dblp matches case- and diacritic-insensitively
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return re.findall(r'[^\W_]+', text.lower())
+
+
+def _mmap(path: str, dtype) -> np.ndarray:
+    if os.path.getsize(path) == 0:
+        return np.empty(0, dtype=dtype) # empty files cannot be memory-mapped
+    return np.memmap(path, dtype=dtype, mode='r')
+
+
+class _PostingsWriter:
+    """Builds a term -> sorted doc id postings file in bounded memory, spilling sorted runs to disk and merging them."""
+    def __init__(self, prefix: str, spill_size: int):
+        self.prefix = prefix
+        self.spill_size = spill_size
+        self._postings = {}
+        self._count = 0
+        self._runs = []
+
+    def add(self, term: str, docid: int) -> None:
+        postings = self._postings.get(term)
+        if postings is None:
+            postings = self._postings[term] = array('i')
+        if not postings or postings[-1] != docid:
+            postings.append(docid)
+            self._count += 1
+            if self._count >= self.spill_size:
+                self._spill()
+
+    def _spill(self) -> None:
+        path = f'{self.prefix}.run{len(self._runs)}'
+        with open(path, 'wt', encoding='utf8') as fout:
+            for term in sorted(self._postings):
+                fout.write(term + '\t' + ','.join(map(str, self._postings[term])) + '\n')
+        self._runs.append(path)
+        self._postings = {}
+        self._count = 0
+
+    @staticmethod
+    def _read_run(path: str) -> Iterator[Tuple[str, str]]:
+        with open(path, 'rt', encoding='utf8') as fin:
+            for line in fin:
+                term, postings = line.rstrip('\n').split('\t')
+                yield term, postings
+
+    def finish(self) -> None:
+        self._spill()
+        with open(f'{self.prefix}.terms', 'wb') as f_terms, \
+             open(f'{self.prefix}.terms.offsets', 'wb') as f_term_offsets, \
+             open(f'{self.prefix}.postings', 'wb') as f_postings, \
+             open(f'{self.prefix}.postings.offsets', 'wb') as f_postings_offsets:
+            term_offset, postings_offset = 0, 0
+            f_term_offsets.write(array('q', [0]).tobytes())
+            f_postings_offsets.write(array('q', [0]).tobytes())
+            # runs hold increasing doc ids, and the merge is stable, so each term's postings come out sorted
+            merged = heapq.merge(*(self._read_run(path) for path in self._runs), key=itemgetter(0))
+            for term, group in groupby(merged, key=itemgetter(0)):
+                postings = array('i', (int(d) for _, p in group for d in p.split(',')))
+                term = term.encode()
+                f_terms.write(term)
+                f_postings.write(postings.tobytes())
+                term_offset += len(term)
+                postings_offset += len(postings)
+                f_term_offsets.write(array('q', [term_offset]).tobytes())
+                f_postings_offsets.write(array('q', [postings_offset]).tobytes())
+        for path in self._runs:
+            os.remove(path)
+
+
+class _RecordsWriter:
+    """Appends JSON records to a file, along with the offset of each record. The files are open within a ``with`` block."""
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self._files = None
+        self._offset = 0
+        self.count = 0
+
+    def __enter__(self) -> '_RecordsWriter':
+        self._files = contextlib.ExitStack()
+        self._records = self._files.enter_context(open(f'{self.prefix}.records', 'wb'))
+        self._offsets = self._files.enter_context(open(f'{self.prefix}.records.offsets', 'wb'))
+        self._offsets.write(array('q', [0]).tobytes())
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._files.close()
+
+    def add(self, record: dict) -> int:
+        data = json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode()
+        self._records.write(data)
+        self._offset += len(data)
+        self._offsets.write(array('q', [self._offset]).tobytes())
+        self.count += 1
+        return self.count - 1
+
+
+class _PostingsReader:
+    """Memory-mapped lookups into a file written by :class:`_PostingsWriter`."""
+    def __init__(self, prefix: str):
+        self._terms = _mmap(f'{prefix}.terms', np.uint8)
+        self._term_offsets = _mmap(f'{prefix}.terms.offsets', np.int64)
+        self._postings = _mmap(f'{prefix}.postings', np.int32)
+        self._postings_offsets = _mmap(f'{prefix}.postings.offsets', np.int64)
+
+    def __len__(self) -> int:
+        return len(self._term_offsets) - 1
+
+    def term(self, i: int) -> str:
+        return self._terms[self._term_offsets[i]:self._term_offsets[i+1]].tobytes().decode()
+
+    def _bisect(self, term: str) -> int:
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.term(mid) < term:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def postings(self, term: str, prefix: bool = False) -> np.ndarray:
+        """Returns the sorted doc ids of the term (or of all terms starting with it, when ``prefix``)."""
+        lo = self._bisect(term)
+        if prefix:
+            hi = self._bisect(term + '\U0010ffff')
+        else:
+            hi = lo + 1 if lo < len(self) and self.term(lo) == term else lo
+        postings = np.asarray(self._postings[self._postings_offsets[lo]:self._postings_offsets[hi]])
+        return np.unique(postings) if hi - lo > 1 else postings
+
+
+class _RecordsReader:
+    """Memory-mapped access to a file written by :class:`_RecordsWriter`."""
+    def __init__(self, prefix: str):
+        self._records = _mmap(f'{prefix}.records', np.uint8)
+        self._offsets = _mmap(f'{prefix}.records.offsets', np.int64)
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i: int) -> dict:
+        return json.loads(self._records[self._offsets[i]:self._offsets[i+1]].tobytes())
+
+
+def _parse_records(source) -> Iterator[Tuple[str, Dict[str, str], dict]]:
+    """Stream-parses the records of a dblp.xml file, yielding ``(tag, attributes, fields)`` in constant memory."""
+    parser = ET.XMLParser()
+    # dblp.xml uses the (HTML) character entities declared in dblp.dtd, which expat does not load
+    parser.entity.update((name, chr(cp)) for name, cp in name2codepoint.items())
+    root = None
+    for event, elem in ET.iterparse(source, events=('start', 'end'), parser=parser):
+        if root is None:
+            root = elem
+            continue
+        if event != 'end' or elem.tag not in _RECORD_TAGS:
+            continue
+        fields = {}
+        for child in elem:
+            text = ''.join(child.itertext()).strip() # titles can contain inline markup
+            if child.tag in _LIST_FIELDS:
+                fields.setdefault(child.tag, []).append(text)
+            elif child.tag in _TEXT_FIELDS:
+                fields.setdefault(child.tag, text)
+        yield elem.tag, dict(elem.attrib), fields
+        root.clear() # drop the records that have been processed
+
+
+def _build_index(source: str, path: str, *, verbose: bool, spill_size: int) -> None:
+    """Builds a local DBLP index at ``path`` from a ``dblp.xml`` or ``dblp.xml.gz`` dump."""
+    os.makedirs(path, exist_ok=True)
+    writers = {kind: _PostingsWriter(os.path.join(path, kind), spill_size) for kind in ('publ', 'author', 'venue', 'publ.keys')}
+    records = {kind: _RecordsWriter(os.path.join(path, kind)) for kind in ('publ', 'author', 'venue')}
+    venues = {} # venue key -> record (the number of venues is small)
+    with records['publ'], records['author'], records['venue']:
+        with open(os.path.join(path, 'publ.years'), 'wb') as f_years:
+            opener = gzip.open if source.endswith('.gz') else open
+            with opener(source, 'rb') as fin:
+                it = _parse_records(fin)
+                if verbose:
+                    it = pt.tqdm(it, desc='indexing dblp', unit='record')
+                for tag, attrib, fields in it:
+                    key = attrib.get('key', '')
+                    if tag == 'www':
+                        if key.startswith('homepages/') and fields.get('author'):
+                            docid = records['author'].add({'pid': key[len('homepages/'):], 'author': fields['author'][0]})
+                            for term in {t for name in fields['author'] for t in _tokens(name)}:
+                                writers['author'].add(term, docid)
+                        continue
+                    venue_key = '/'.join(key.split('/')[:2])
+                    venue_name = fields.get('journal') or fields.get('booktitle')
+                    if key.split('/')[0] in _VENUE_TYPES and venue_name and venue_key not in venues:
+                        venues[venue_key] = {
+                            'key': venue_key,
+                            'venue': venue_name,
+                            'acronym': fields.get('booktitle') if key.startswith('conf/') else None,
+                            'type': _VENUE_TYPES[key.split('/')[0]],
+                        }
+                    publtype = attrib.get('publtype')
+                    record = {'key': key, 'tag': tag, 'mdate': attrib.get('mdate'), **fields}
+                    record['type'] = 'Informal and Other Publications' if publtype == 'informal' else _PUBLICATION_TYPES[tag]
+                    docid = records['publ'].add(record)
+                    writers['publ.keys'].add(key, docid)
+                    text = ' '.join([fields.get('title', ''), *fields.get('author', []), *fields.get('editor', []), venue_name or '', fields.get('year', '')])
+                    for term in set(_tokens(text)):
+                        writers['publ'].add(term, docid)
+                    year = fields.get('year', '')
+                    f_years.write(array('h', [int(year) if year.isdigit() else 0]).tobytes())
+        for venue in venues.values():
+            docid = records['venue'].add(venue)
+            for term in set(_tokens(venue['venue'] + ' ' + (venue['acronym'] or '') + ' ' + venue['key'])):
+                writers['venue'].add(term, docid)
+    for writer in writers.values():
+        writer.finish()
+    with open(os.path.join(path, 'meta.json'), 'wt') as fout:
+        json.dump({'source': os.path.basename(source), **{kind: writer.count for kind, writer in records.items()}}, fout)
+
+
+class DblpLocalApi(DblpApi):
+    """A local, offline stand-in for :class:`~pyterrier_services.DblpApi`, served from an index of the dblp.xml dump.
+
+    The index is built once from ``dblp.xml.gz`` (available from `dblp.org/xml <https://dblp.org/xml/>`__) with
+    :meth:`build`. It holds term postings over the titles, authors, venues and years of publications (and over the
+    names of authors and venues), and memory-mapped record storage. :meth:`search` and :meth:`load_bibtex` are then
+    answered locally, with the same output as the live API, so the object can be used wherever a :class:`DblpApi` is
+    expected (e.g., in :meth:`retriever` and :meth:`bibtex_loader`).
+
+    Queries are matched like on dblp.org: every query term must prefix-match a term of the entity (or match it
+    exactly, when suffixed with ``$``). Results that match more query terms exactly come first, followed by newer
+    publications.
+
+    Example::
+
+        dblp = DblpLocalApi.build('dblp.xml.gz', 'dblp-index/')
+        dblp.retriever(num_results=100)
+    """
+    DEFAULT_MAX_WORKERS = 1 # searches are CPU-bound
+
+    def __init__(self, path: str, *, metrics: Optional[Metrics] = None):
+        """
+        Args:
+            path: The directory of an index built by :meth:`build`.
+            metrics: The metrics to record timings to. Defaults to a new instance of :class:`~pyterrier_services.Metrics`.
+        """
+        super().__init__(metrics=metrics)
+        # requests are answered locally, so they are neither sent over the network nor rate limited
+        self.transport = None
+        self.rate_limiter = None
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), 'rt') as fin:
+            self.meta = json.load(fin)
+        self._postings = {kind: _PostingsReader(os.path.join(path, kind)) for kind in ('publ', 'author', 'venue', 'publ.keys')}
+        self._records = {kind: _RecordsReader(os.path.join(path, kind)) for kind in ('publ', 'author', 'venue')}
+        self._years = _mmap(os.path.join(path, 'publ.years'), np.int16)
+
+    @classmethod
+    def build(cls, source: str, path: str, *, verbose: bool = True, spill_size: int = 10_000_000) -> 'DblpLocalApi':
+        """Builds an index from a dblp.xml dump, streaming over it in constant memory, and returns the local API.
+
+        Args:
+            source: The path to ``dblp.xml`` or ``dblp.xml.gz``.
+            path: The directory to write the index to.
+            verbose: Whether to log the progress. Defaults to True.
+            spill_size: The number of postings held in memory before they are spilled to disk. Defaults to 10M.
+        """
+        _build_index(source, path, verbose=verbose, spill_size=spill_size)
+        return cls(path)
+
+    def _match(self, kind: str, query: str) -> np.ndarray:
+        postings = self._postings[kind]
+        terms = [(term, raw.endswith('$')) for raw in query.split() for term in _tokens(raw)]
+        if not terms:
+            return np.empty(0, dtype=np.int32)
+        matches = sorted((postings.postings(term, prefix=not exact) for term, exact in terms), key=len)
+        docids = matches[0]
+        for match in matches[1:]:
+            docids = np.intersect1d(docids, match, assume_unique=True)
+        exact_matches = sum(np.isin(docids, postings.postings(term), assume_unique=True).astype(np.int32) for term, _ in terms)
+        years = self._years[docids] if kind == 'publ' else np.zeros(len(docids), dtype=np.int16)
+        return docids[np.lexsort((docids, -years.astype(np.int32), -exact_matches))]
+
+    def _info(self, entity_type: DblpEntityType, docid: int) -> dict:
+        # mirrors the "info" objects of the dblp.org search API, so that results can be parsed by _parse_search
+        record = self._records[_ENTITY_KINDS[entity_type]][docid]
+        if entity_type == DblpEntityType.author:
+            return {'author': record['author'], 'url': f"https://dblp.org/pid/{record['pid']}"}
+        if entity_type == DblpEntityType.venue:
+            return {'venue': record['venue'], 'acronym': record['acronym'], 'type': record['type'], 'url': f"https://dblp.org/db/{record['key']}/"}
+        return {
+            'key': record['key'],
+            'title': record.get('title', ''),
+            'authors': {'author': [{'text': a} for a in record.get('author', [])]},
+            'year': record.get('year'),
+            'type': record['type'],
+        }
+
+    def search(self,
+        query: str,
+        *,
+        entity_type: Union[str, DblpEntityType] = DblpEntityType.publication,
+        offset: int = 0,
+        limit: int = 100,
+        return_next: bool = False,
+        return_total: bool = False,
+    ) -> Union[pd.DataFrame, Tuple[pd.DataFrame, int], Tuple[pd.DataFrame, int, int]]:
+        """Searches the local index. See :meth:`DblpApi.search`."""
+        entity_type = DblpEntityType(entity_type)
+        limit = max(min(limit, self.MAX_PAGE_SIZE), 1)
+        with self.metrics.timer('search'):
+            docids = self._match(_ENTITY_KINDS[entity_type], query)
+            hits = [{'info': self._info(entity_type, int(docid))} for docid in docids[offset:offset+limit]]
+        http_res = {'result': {'hits': {'@first': str(offset), '@sent': str(len(hits)), '@total': str(len(docids)), 'hit': hits}}}
+        with self.metrics.timer('parse'):
+            return self._parse_search(http_res, entity_type=entity_type, limit=limit, return_next=return_next, return_total=return_total)
+
+    async def async_search(self, query: str, **kwargs):
+        """Async version of :meth:`search` (which is answered locally)."""
+        return self.search(query, **kwargs)
+
+    def _record(self, docno: str) -> dict:
+        docids = self._postings['publ.keys'].postings(docno)
+        if len(docids) == 0:
+            raise KeyError(f'{docno!r} not found in the local dblp index')
+        return self._records['publ'][int(docids[0])]
+
+    def load_bibtex(self,
+        docno: str,
+        *,
+        bib_type: Union[str, DblpBibType] = DblpBibType.standard,
+    ) -> str:
+        """Formats the BibTeX of a publication from the local index. See :meth:`DblpApi.load_bibtex`.
+
+        Unlike the live API, which responds with an HTTP error, a ``docno`` that is not in the index raises ``KeyError``.
+        """
+        bib_type = DblpBibType(bib_type)
+        record = self._record(docno)
+        crossref = None
+        if record.get('crossref') and bib_type != DblpBibType.condensed:
+            try:
+                crossref = self._record(record['crossref'])
+            except KeyError:
+                pass
+        if bib_type == DblpBibType.with_crossref and crossref is not None:
+            return _format_bibtex(record, None, bib_type) + '\n' + _format_bibtex(crossref, None, DblpBibType.standard)
+        return _format_bibtex(record, crossref, bib_type)
+
+    async def async_load_bibtex(self, docno: str, **kwargs) -> str:
+        """Async version of :meth:`load_bibtex` (which is answered locally)."""
+        return self.load_bibtex(docno, **kwargs)
+
+    async def aclose(self):
+        pass
+
+    def __repr__(self):
+        return f'DblpLocalApi({self.path!r})'
+
+
+def _format_bibtex(record: dict, crossref: Optional[dict], bib_type: DblpBibType) -> str:
+    entry_type = 'misc' if record['tag'] == 'data' else record['tag']
+    parent = crossref or {}
+    ee = record.get('ee', [])
+    doi = next((e[len('https://doi.org/'):] for e in ee if e.startswith('https://doi.org/')), None)
+    fields = [
+        ('author', ' and '.join(record.get('author', []))),
+        ('editor', ' and '.join(record.get('editor') or parent.get('editor', []))),
+        ('title', record.get('title', '').rstrip('.')),
+        ('booktitle', (parent.get('title') or record.get('booktitle', '')).rstrip('.') if record['tag'] != 'article' else None),
+        ('journal', record.get('journal')),
+        ('volume', record.get('volume') or parent.get('volume')),
+        ('number', record.get('number')),
+        ('series', record.get('series') or parent.get('series')),
+        ('pages', (record.get('pages') or '').replace('-', '--')),
+        ('publisher', record.get('publisher') or parent.get('publisher')),
+        ('school', record.get('school')),
+        ('year', record.get('year')),
+    ]
+    if bib_type == DblpBibType.condensed:
+        fields = [(k, v) for k, v in fields if k in ('author', 'title', 'booktitle', 'journal', 'volume', 'number', 'pages', 'year')]
+    else:
+        if bib_type == DblpBibType.with_crossref and record.get('crossref'):
+            fields.append(('crossref', f"DBLP:{record['crossref']}"))
+        fields += [
+            ('url', ee[0] if ee else record.get('url')),
+            ('doi', doi),
+            ('biburl', f"https://dblp.org/rec/{record['key']}.bib"),
+            ('bibsource', 'dblp computer science bibliography, https://dblp.org'),
+        ]
+    lines = [f"  {k:<12} = {{{v}}}" for k, v in fields if v]
+    return f"@{entry_type}{{DBLP:{record['key']},\n" + ',\n'.join(lines) + '\n}\n'
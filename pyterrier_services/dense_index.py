@@ -0,0 +1,445 @@
+import json
+import os
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+import pyterrier as pt
+import pyterrier_alpha as pta
+from .metrics import Metrics
+
+
+def _mmap(path: str, dtype, shape=None) -> np.ndarray:
+    if os.path.getsize(path) == 0:
+        return np.empty(shape or 0, dtype=dtype) # empty files cannot be memory-mapped
+    return np.memmap(path, dtype=dtype, mode='r', shape=shape)
+
+
+class _TopK:
+    """Keeps the ``k`` highest scores (and their doc ids) of each of ``n_queries`` queries."""
+    def __init__(self, n_queries: int, k: int):
+        self.scores = np.full((n_queries, k), -np.inf, dtype=np.float32)
+        self.docids = np.full((n_queries, k), -1, dtype=np.int64)
+
+    def update(self, scores: np.ndarray, docids: np.ndarray, queries=slice(None)) -> None:
+        """Adds a block of ``scores`` (queries x docs) of the ``docids`` (one per column, or one per score)."""
+        k = self.scores.shape[1]
+        scores = np.concatenate([self.scores[queries], scores], axis=1)
+        docids = np.concatenate([self.docids[queries], np.broadcast_to(docids, scores[:, k:].shape)], axis=1)
+        if scores.shape[1] > k:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            scores = np.take_along_axis(scores, top, axis=1)
+            docids = np.take_along_axis(docids, top, axis=1)
+        self.scores[queries] = scores
+        self.docids[queries] = docids
+
+    def merge(self, other: '_TopK') -> None:
+        self.update(other.scores, other.docids)
+
+    def results(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns the doc ids and scores of each query, in descending order of score (unfilled slots have doc id -1)."""
+        order = np.argsort(-self.scores, axis=1, kind='stable')
+        return np.take_along_axis(self.docids, order, axis=1), np.take_along_axis(self.scores, order, axis=1)
+
+
+class _Strings:
+    """Memory-mapped access to a list of strings, stored as concatenated UTF-8 along with their offsets."""
+    def __init__(self, prefix: str):
+        self._data = _mmap(f'{prefix}', np.uint8)
+        self._offsets = _mmap(f'{prefix}.offsets', np.int64)
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return self._data[self._offsets[i]:self._offsets[i+1]].tobytes().decode()
+
+    def take(self, ids: np.ndarray) -> List[str]:
+        return [self[i] for i in ids.tolist()]
+
+
+class DenseIndex:
+    """A local, memory-mapped index of dense vectors (e.g., ``doc_vec`` from :class:`PineconeDenseEncoder`).
+
+    The index is written by :meth:`indexer`, which streams the vectors of a corpus into shards of float32 files, along
+    with the docno of each vector. :meth:`retriever` then scores query vectors against every vector in the index by
+    inner product, in blocks over a thread pool, so memory use does not depend on the size of the index. Optionally,
+    :meth:`build_ivf` partitions the vectors into clusters, so that retrievers with ``nprobe`` only score the vectors
+    of the clusters closest to each query.
+
+    Example::
+
+        model = PineconeDenseModel()
+        index = DenseIndex('dense-index/')
+        (model.doc_encoder() >> index.indexer()).index(dataset.get_corpus_iter())
+        retriever = model.query_encoder() >> index.retriever(num_results=100)
+    """
+
+    def __init__(self, path: str, *, metrics: Optional[Metrics] = None):
+        """
+        Args:
+            path: The directory of the index.
+            metrics: The metrics to record timings to. Defaults to a new instance of :class:`~pyterrier_services.Metrics`.
+        """
+        self.path = path
+        self.metrics = metrics or Metrics()
+        self._meta = None
+
+    def built(self) -> bool:
+        """Returns whether the index has been written."""
+        return os.path.exists(os.path.join(self.path, 'meta.json'))
+
+    @property
+    def meta(self) -> dict:
+        """The metadata of the index (its dimensionality, the number of vectors in each shard, and its clusters)."""
+        return self._load()
+
+    def _load(self) -> dict:
+        # opens the files of the index on first use (as it may be written after this object is created)
+        if self._meta is None:
+            with open(os.path.join(self.path, 'meta.json'), 'rt') as fin:
+                self._meta = json.load(fin)
+            self._shards = [_mmap(os.path.join(self.path, f'vecs.{i}.f32'), np.float32, (count, self._meta['dim'])) for i, count in enumerate(self._meta['shards'])]
+            self._shard_starts = np.cumsum([0] + self._meta['shards'])
+            self._docnos = _Strings(os.path.join(self.path, 'docnos'))
+            self._ivf = None
+            if self._meta.get('ivf'):
+                n_lists = self._meta['ivf']['n_lists']
+                self._ivf = (
+                    _mmap(os.path.join(self.path, 'ivf.centroids.f32'), np.float32, (n_lists, self._meta['dim'])),
+                    _mmap(os.path.join(self.path, 'ivf.offsets'), np.int64),
+                    _mmap(os.path.join(self.path, 'ivf.docids'), np.int64),
+                    _mmap(os.path.join(self.path, 'ivf.vecs.f32'), np.float32, (len(self), self._meta['dim'])),
+                )
+        return self._meta
+
+    def _reset(self) -> None:
+        self._meta = None
+
+    def __len__(self) -> int:
+        return self.meta['count']
+
+    @property
+    def dim(self) -> Optional[int]:
+        """The dimensionality of the vectors (None for an empty index)."""
+        return self.meta['dim']
+
+    def docnos(self, docids: np.ndarray) -> List[str]:
+        """Returns the docnos of the vectors with the provided (0-based) ids."""
+        self._load()
+        return self._docnos.take(np.asarray(docids))
+
+    def vectors(self, docids: np.ndarray) -> np.ndarray:
+        """Returns the vectors with the provided (0-based) ids."""
+        self._load()
+        docids = np.asarray(docids, dtype=np.int64)
+        res = np.empty((len(docids), self.dim or 0), dtype=np.float32)
+        shard_ids = np.searchsorted(self._shard_starts, docids, side='right') - 1
+        for shard_id in np.unique(shard_ids):
+            mask = shard_ids == shard_id
+            res[mask] = self._shards[shard_id][docids[mask] - self._shard_starts[shard_id]]
+        return res
+
+    def _blocks(self, block_size: int) -> Iterator[Tuple[int, np.ndarray]]:
+        # yields (first doc id, vectors) over the whole index, in blocks of at most block_size vectors
+        self._load()
+        for start, shard in zip(self._shard_starts, self._shards):
+            for i in range(0, len(shard), block_size):
+                yield int(start) + i, shard[i:i+block_size]
+
+    def indexer(self, *, shard_size: int = 1_000_000, overwrite: bool = False, verbose: bool = True) -> 'DenseIndexer':
+        """Returns an indexer that writes the ``doc_vec`` of each document to this index.
+
+        Args:
+            shard_size: The number of vectors per shard file. Defaults to 1M.
+            overwrite: Whether to replace an existing index. Defaults to False (raises an error if the index exists).
+            verbose: Whether to log the progress. Defaults to True.
+        """
+        return DenseIndexer(self, shard_size=shard_size, overwrite=overwrite, verbose=verbose)
+
+    def retriever(self,
+        *,
+        num_results: int = 1000,
+        nprobe: Optional[int] = None,
+        batch_size: int = 256,
+        block_size: int = 16_384,
+        max_workers: Optional[int] = None,
+        verbose: bool = False,
+    ) -> 'DenseRetriever':
+        """Returns a retriever that scores the ``query_vec`` of each query against the vectors of this index.
+
+        Args:
+            num_results: The number of results to retrieve per query. Defaults to 1000.
+            nprobe: The number of clusters (see :meth:`build_ivf`) to score for each query. Defaults to None (scores
+                every vector, exactly).
+            batch_size: The number of queries scored together over each block of vectors. Defaults to 256.
+            block_size: The number of vectors scored at once by each worker. Defaults to 16,384.
+            max_workers: The number of threads scoring blocks. Defaults to the number of CPUs.
+            verbose: Whether to log the progress over the batches of queries. Defaults to False.
+        """
+        return DenseRetriever(self, num_results=num_results, nprobe=nprobe, batch_size=batch_size, block_size=block_size, max_workers=max_workers, verbose=verbose)
+
+    def build_ivf(self,
+        n_lists: Optional[int] = None,
+        *,
+        sample_size: Optional[int] = None,
+        iterations: int = 10,
+        block_size: int = 16_384,
+        seed: int = 0,
+        verbose: bool = True,
+    ) -> None:
+        """Partitions the vectors of the index into clusters, for approximate retrieval with ``nprobe``.
+
+        The centroids are found by (spherical) k-means over a sample of the vectors, and each vector is assigned to the
+        centroid with the highest inner product. A copy of the vectors, grouped by cluster, is written alongside the
+        shards, so that the vectors of each cluster are read contiguously.
+
+        Args:
+            n_lists: The number of clusters. Defaults to ``4 * sqrt(len(index))``.
+            sample_size: The number of vectors to find the centroids from. Defaults to ``64 * n_lists``.
+            iterations: The number of k-means iterations. Defaults to 10.
+            block_size: The number of vectors assigned at once. Defaults to 16,384.
+            seed: The random seed for sampling. Defaults to 0.
+            verbose: Whether to log the progress. Defaults to True.
+        """
+        count = len(self)
+        if count == 0:
+            raise ValueError('cannot partition an empty index')
+        n_lists = min(n_lists or max(int(4 * np.sqrt(count)), 1), count)
+        sample_size = min(sample_size or 64 * n_lists, count)
+        rng = np.random.default_rng(seed)
+        sample = self.vectors(np.sort(rng.choice(count, sample_size, replace=False)))
+        centroids = sample[rng.choice(sample_size, n_lists, replace=False)]
+        it = range(iterations)
+        if verbose:
+            it = pt.tqdm(it, desc='k-means', unit='it')
+        for _ in it:
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            sizes = np.bincount(assignment, minlength=n_lists)
+            empty = sizes == 0
+            sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))] # re-seed empty clusters
+            centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+
+        assignment = np.empty(count, dtype=np.int32)
+        blocks = self._blocks(block_size)
+        if verbose:
+            blocks = pt.tqdm(blocks, desc='assigning', unit='block', total=-(-count // block_size))
+        for start, vecs in blocks:
+            assignment[start:start+len(vecs)] = np.argmax(vecs @ centroids.T, axis=1)
+        order = np.argsort(assignment, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=n_lists))])
+
+        self._write_array('ivf.centroids.f32', centroids.astype(np.float32))
+        self._write_array('ivf.offsets', offsets.astype(np.int64))
+        self._write_array('ivf.docids', order.astype(np.int64))
+        with open(os.path.join(self.path, 'ivf.vecs.f32'), 'wb') as fout:
+            for i in range(0, count, block_size):
+                fout.write(self.vectors(order[i:i+block_size]).tobytes())
+        meta = {**self.meta, 'ivf': {'n_lists': n_lists, 'sample_size': sample_size, 'iterations': iterations}}
+        with open(os.path.join(self.path, 'meta.json'), 'wt') as fout:
+            json.dump(meta, fout)
+        self._reset()
+
+    def _write_array(self, name: str, arr: np.ndarray) -> None:
+        with open(os.path.join(self.path, name), 'wb') as fout:
+            fout.write(arr.tobytes())
+
+    def __repr__(self):
+        return f'DenseIndex({self.path!r})'
+
+
+class DenseIndexer(pt.Indexer):
+    """Writes the ``doc_vec`` of each document to a :class:`DenseIndex`, streaming them to disk as they arrive."""
+
+    CHUNK_SIZE = 4096 # the number of vectors buffered before they are written
+
+    def __init__(self, index: DenseIndex, *, shard_size: int = 1_000_000, overwrite: bool = False, verbose: bool = True):
+        """
+        Args:
+            index: The index to write to.
+            shard_size: The number of vectors per shard file. Defaults to 1M.
+            overwrite: Whether to replace an existing index. Defaults to False (raises an error if the index exists).
+            verbose: Whether to log the progress. Defaults to True.
+        """
+        self.index_ = index
+        self.shard_size = shard_size
+        self.overwrite = overwrite
+        self.verbose = verbose
+
+    def index(self, inp: pt.model.IterDict) -> DenseIndex:
+        """Writes the documents (with ``docno`` and ``doc_vec``) to the index, returning it."""
+        path = self.index_.path
+        if self.index_.built():
+            if not self.overwrite:
+                raise FileExistsError(f'{path!r} already contains an index (pass overwrite=True to replace it)')
+            for name in os.listdir(path):
+                if name == 'meta.json' or name.startswith(('vecs.', 'docnos', 'ivf.')):
+                    os.remove(os.path.join(path, name))
+        os.makedirs(path, exist_ok=True)
+        self.index_._reset()
+        with self.index_.metrics.call(repr(self)):
+            if self.verbose:
+                inp = pt.tqdm(inp, desc=repr(self), unit='d')
+            meta = self._write(inp, path)
+            with open(os.path.join(path, 'meta.json'), 'wt') as fout:
+                json.dump(meta, fout)
+        return self.index_
+
+    def _write(self, inp: pt.model.IterDict, path: str) -> dict:
+        dim = None
+        shards = []
+        buffer = []
+        docno_offset = 0
+        with open(os.path.join(path, 'docnos'), 'wb') as f_docnos, open(os.path.join(path, 'docnos.offsets'), 'wb') as f_offsets:
+            f_offsets.write(array('q', [0]).tobytes())
+
+            def flush():
+                vecs = np.stack(buffer).astype(np.float32, copy=False)
+                buffer.clear()
+                while len(vecs):
+                    if not shards or shards[-1] == self.shard_size:
+                        shards.append(0)
+                    n = min(self.shard_size - shards[-1], len(vecs))
+                    # each chunk is appended to the current shard, so no shard file is left open between chunks
+                    with open(os.path.join(path, f'vecs.{len(shards) - 1}.f32'), 'ab' if shards[-1] else 'wb') as f_vecs:
+                        f_vecs.write(vecs[:n].tobytes())
+                    shards[-1] += n
+                    vecs = vecs[n:]
+
+            for doc in inp:
+                vec = np.asarray(doc['doc_vec'], dtype=np.float32)
+                if dim is None:
+                    dim = len(vec)
+                elif vec.shape != (dim,):
+                    raise ValueError(f'doc_vec of {doc["docno"]!r} has shape {vec.shape}, expected ({dim},)')
+                docno = str(doc['docno']).encode()
+                f_docnos.write(docno)
+                docno_offset += len(docno)
+                f_offsets.write(array('q', [docno_offset]).tobytes())
+                buffer.append(vec)
+                if len(buffer) == self.CHUNK_SIZE:
+                    flush()
+            if buffer:
+                flush()
+        return {'dim': dim, 'count': sum(shards), 'shards': shards, 'dtype': 'float32', 'ivf': None}
+
+    def __repr__(self):
+        return f'DenseIndexer({self.index_!r})'
+
+
+class DenseRetriever(pt.Transformer):
+    """Retrieves the documents of a :class:`DenseIndex` with the highest inner product with each ``query_vec``."""
+
+    def __init__(self,
+        index: DenseIndex,
+        *,
+        num_results: int = 1000,
+        nprobe: Optional[int] = None,
+        batch_size: int = 256,
+        block_size: int = 16_384,
+        max_workers: Optional[int] = None,
+        verbose: bool = False,
+    ):
+        """
+        Args:
+            index: The index to retrieve from.
+            num_results: The number of results to retrieve per query. Defaults to 1000.
+            nprobe: The number of clusters (see :meth:`DenseIndex.build_ivf`) to score for each query. Defaults to None
+                (scores every vector, exactly).
+            batch_size: The number of queries scored together over each block of vectors. Defaults to 256.
+            block_size: The number of vectors scored at once by each worker. Defaults to 16,384.
+            max_workers: The number of threads scoring blocks. Defaults to the number of CPUs.
+            verbose: Whether to log the progress over the batches of queries. Defaults to False.
+        """
+        self.index = index
+        self.num_results = num_results
+        self.nprobe = nprobe
+        self.batch_size = batch_size
+        self.block_size = block_size
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.verbose = verbose
+
+    def _scan(self, query_vecs: np.ndarray, k: int, pool: ThreadPoolExecutor) -> _TopK:
+        # exact: every worker scores a strided subset of the blocks, keeping its own top k, which are then merged
+        blocks = list(self.index._blocks(self.block_size))
+        def score(blocks):
+            top = _TopK(len(query_vecs), k)
+            for start, vecs in blocks:
+                top.update(query_vecs @ vecs.T, np.arange(start, start + len(vecs)))
+            return top
+        tops = list(pool.map(score, [blocks[i::self.max_workers] for i in range(self.max_workers)]))
+        for top in tops[1:]:
+            tops[0].merge(top)
+        return tops[0]
+
+    def _probe(self, query_vecs: np.ndarray, k: int, pool: ThreadPoolExecutor) -> _TopK:
+        # approximate: each cluster is scored against the queries that probe it
+        centroids, offsets, docids, vecs = self.index._ivf
+        nprobe = min(self.nprobe, len(centroids))
+        probes = np.argpartition(-(query_vecs @ centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+        lists = probes.ravel()
+        queries = np.repeat(np.arange(len(query_vecs)), nprobe)
+        order = np.argsort(lists, kind='stable')
+        lists, queries = lists[order], queries[order]
+        bounds = np.flatnonzero(np.diff(lists)) + 1
+        work = [(int(ls[0]), qs) for ls, qs in zip(np.split(lists, bounds), np.split(queries, bounds)) if len(ls)]
+        def score(work):
+            top = _TopK(len(query_vecs), k)
+            for lst, qs in work:
+                for start in range(offsets[lst], offsets[lst+1], self.block_size):
+                    stop = min(start + self.block_size, offsets[lst+1])
+                    top.update(query_vecs[qs] @ vecs[start:stop].T, docids[start:stop], queries=qs)
+            return top
+        tops = list(pool.map(score, [work[i::self.max_workers] for i in range(self.max_workers)]))
+        for top in tops[1:]:
+            tops[0].merge(top)
+        return tops[0]
+
+    def _search(self, query_vecs: np.ndarray, pool: ThreadPoolExecutor) -> Tuple[np.ndarray, np.ndarray]:
+        k = min(self.num_results, len(self.index))
+        if k == 0:
+            return np.empty((len(query_vecs), 0), dtype=np.int64), np.empty((len(query_vecs), 0), dtype=np.float32)
+        with self.index.metrics.timer('search'):
+            top = self._scan(query_vecs, k, pool) if self.nprobe is None else self._probe(query_vecs, k, pool)
+            docids, scores = top.results()
+        return docids, scores
+
+    def transform(self, inp: pd.DataFrame) -> pd.DataFrame:
+        pta.validate.query_frame(inp, extra_columns=['query_vec'])
+        if self.nprobe is not None and self.index.meta.get('ivf') is None:
+            raise ValueError(f'{self.index!r} has no clusters to probe; build them with build_ivf() first')
+        with self.index.metrics.call(repr(self)):
+            query_vecs = np.stack(inp['query_vec'].tolist()).astype(np.float32, copy=False) if len(inp) else np.empty((0, self.index.dim or 0), dtype=np.float32)
+            if len(inp) and self.index.dim is not None and query_vecs.shape[1] != self.index.dim:
+                raise ValueError(f'query_vec has {query_vecs.shape[1]} dimensions, but {self.index!r} has {self.index.dim}')
+            all_docids, all_scores = [], []
+            batches = range(0, len(inp), self.batch_size)
+            if self.verbose:
+                batches = pt.tqdm(batches, desc=repr(self), unit='batch')
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                for i in batches:
+                    docids, scores = self._search(query_vecs[i:i+self.batch_size], pool)
+                    all_docids.append(docids)
+                    all_scores.append(scores)
+            with self.index.metrics.timer('assemble'):
+                docids = np.concatenate(all_docids) if all_docids else np.empty((0, 0), dtype=np.int64)
+                scores = np.concatenate(all_scores) if all_scores else np.empty((0, 0), dtype=np.float32)
+                found = docids >= 0 # fewer than num_results vectors in the probed clusters
+                lengths = found.sum(axis=1)
+                rows = np.repeat(np.arange(len(inp)), lengths)
+                docids, scores = docids[found], scores[found]
+                return inp.iloc[rows].reset_index(drop=True).assign(
+                    docno=self.index.docnos(docids),
+                    score=scores,
+                    rank=np.arange(len(rows)) - np.repeat(np.cumsum(lengths) - lengths, lengths),
+                )
+
+    def fuse_rank_cutoff(self, k: int) -> Optional['DenseRetriever']:
+        if k < self.num_results:
+            return DenseRetriever(self.index, num_results=k, nprobe=self.nprobe, batch_size=self.batch_size, block_size=self.block_size, max_workers=self.max_workers, verbose=self.verbose)
+
+    def __repr__(self):
+        return f'DenseRetriever({self.index!r}, num_results={self.num_results!r}, nprobe={self.nprobe!r})'
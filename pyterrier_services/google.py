@@ -1,32 +1,93 @@
 from typing import Optional, Union, Tuple
 import os
+import threading
+from functools import partial
+import numpy as np
 import pandas as pd
 import pyterrier as pt
-from pyterrier_services import paginated_search, multi_query
+from .core import http_error_retry, paginated_search, multi_query, multi_query_iter
+from .cache import ResponseCache
+from .ratelimit import RateLimiter
+from .resilience import SingleFlight
+from .metrics import Metrics
 
 _HELP_URL = 'https://developers.google.com/custom-search/v1/overview'
 
 class GoogleApi:
     """Represents a refernece to the Google API."""
 
-    def __init__(self, api_key: Optional[str] = None):
+    DEFAULT_MAX_WORKERS = 4 # the CSE JSON API allows 100 queries/minute per user
+    MAX_PAGE_SIZE = 10
+    MAX_RESULTS = 99 # the API rejects requests with start + num > 100 (where start is 1-based)
+
+    def __init__(self,
+        api_key: Optional[str] = None,
+        *,
+        cache: Optional[ResponseCache] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        api_endpoint: Optional[str] = None,
+        single_flight: Optional[SingleFlight] = None,
+        metrics: Optional[Metrics] = None,
+    ):
         """
         Args: 
             api_key (str): the Google API key (taken from ``GOOGLE_API_KEY`` env variable if not provided)
+            cache (ResponseCache): A cache for API responses. Defaults to None (no caching).
+            rate_limiter (RateLimiter): The client-side rate limiter for requests. Defaults to ``RateLimiter.google_cse()``.
+            api_endpoint (str): The URL of the API (e.g., a proxy or a local stand-in). Defaults to Google's API.
+            single_flight (SingleFlight): Coalesces identical requests that are in flight at the same time. Defaults to a new instance of :class:`~pyterrier_services.SingleFlight`.
+            metrics (Metrics): The metrics to record requests and timings to. Defaults to a new instance of :class:`~pyterrier_services.Metrics`.
         """
         if api_key is None:
             api_key = os.environ.get("GOOGLE_API_KEY")
         if api_key is None:
             raise ValueError(f"A Google API key must be specified (either as GOOGLE_API_KEY env variable or passed to `GoogleApi(api_key='...')`). See <{_HELP_URL}> for details on how to get an API key.")
         self.api_key = api_key
+        self.cache = cache
+        self.rate_limiter = rate_limiter or RateLimiter.google_cse()
+        self.single_flight = single_flight or SingleFlight()
+        self.metrics = metrics or Metrics()
 
         try:
             from googleapiclient.discovery import build
         except ModuleNotFoundError as mnfe:
             raise Exception("You need to pip install google-api-python-client") from mnfe
+        self.api_endpoint = api_endpoint
+        if api_endpoint is not None:
+            build = partial(build, client_options={'api_endpoint': api_endpoint})
         self._build = build
-
-    def retriever(self, cx: Optional[str] = None, *, num_results: int = 10, verbose: bool = False) -> pt.Transformer:
+        self._cse_service = None
+        self._cse_lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def cse_service(self):
+        """The Custom Search (``cse``) resource, built on first use from the discovery document bundled with
+        ``google-api-python-client`` (so without a network request) and shared by all retrievers of this API."""
+        if self._cse_service is None:
+            with self._cse_lock:
+                if self._cse_service is None:
+                    self._cse_service = self._build("customsearch", "v1", developerKey=self.api_key, static_discovery=True).cse()
+        return self._cse_service
+
+    def _http(self):
+        # httplib2 connections are not thread-safe, so requests are sent through a connection owned by each thread
+        if not hasattr(self._local, 'http'):
+            from googleapiclient.http import build_http
+            self._local.http = build_http()
+        return self._local.http
+
+    def _list(self, params):
+        return self.cse_service.list(**params).execute(http=self._http())
+
+    def retriever(self,
+        cx: Optional[str] = None,
+        *,
+        num_results: int = 10,
+        verbose: bool = False,
+        max_workers: Optional[int] = None,
+        page_workers: Optional[int] = None,
+    ) -> pt.Transformer:
         """Creates a :class:`GoogleSearchRetriever` instance, allowing retrieval over the Google search engine.
 
         Follow Google's guide for a `Custom Search JSON API <{_HELP_URL}>`_ to get
@@ -35,6 +96,9 @@ class GoogleApi:
         Arguments:
             cx (str): the service to access (taken from ``GOOGLE_CSE_CX`` env variable if not provided)
             num_results (int): The number of results to retrieve per query. Defaults to 10.
+            max_workers (int): The number of queries to run concurrently. Defaults to ``GoogleApi.DEFAULT_MAX_WORKERS``.
+            page_workers (int): The number of result pages of a query to fetch concurrently. Defaults to all the pages
+                after the first one (whose total number of results caps the pages requested).
 
         Returns:
             :class:`pyterrier.Transformer`: A PyTerrier transformer that can be used to
@@ -47,7 +111,7 @@ class GoogleApi:
             url                 https://www.britannica.com/science/chemical-re...
             snippet             Mar 24, 2025 ... A chemical reaction is a proc...
         """.format(_HELP_URL=_HELP_URL)
-        return GoogleSearchRetriever(self, cx, num_results=num_results, verbose=verbose)
+        return GoogleSearchRetriever(self, cx, num_results=num_results, verbose=verbose, max_workers=max_workers, page_workers=page_workers)
 
 
 class GoogleSearchRetriever(pt.Transformer):
@@ -59,13 +123,18 @@ class GoogleSearchRetriever(pt.Transformer):
         *,
         num_results: int = 10,
         verbose: bool = False,
+        max_workers: Optional[int] = None,
+        page_workers: Optional[int] = None,
     ):
         """
         Args:
             api (GoogleApi): The Google API service. Defaults to a new instance of :class:`GoogleApi`.
             cx: (str): The Google Custom Search Engine ID. This is required to perform searches.
-            num_results (int): The number of results to retrieve per query. Defaults to 10.
+            num_results (int): The number of results to retrieve per query (at most ``GoogleApi.MAX_RESULTS``). Defaults to 10.
             verbose (bool): Whether to log the progress. Defaults to False.
+            max_workers (int): The number of queries to run concurrently. Defaults to ``api.DEFAULT_MAX_WORKERS``.
+            page_workers (int): The number of result pages of a query to fetch concurrently. Defaults to all the pages
+                after the first one (whose total number of results caps the pages requested).
         """
         self.api = api or GoogleApi()
         if cx is None:
@@ -73,16 +142,44 @@ class GoogleSearchRetriever(pt.Transformer):
         if cx is None:
             raise ValueError(f"A Google Custom Search Engine ID (cx) must be specified. See <{_HELP_URL}> for details on how to get a Custom Search Engine ID.")
         self.cx = cx
-        self.cse_service = self.api._build("customsearch", "v1", developerKey=self.api.api_key).cse()
         self.num_results = num_results
         self.verbose = verbose
+        self.max_workers = max_workers or self.api.DEFAULT_MAX_WORKERS
+        self.page_workers = page_workers
+
+    @property
+    def cse_service(self):
+        """The Custom Search resource of the API (see :attr:`GoogleApi.cse_service`)."""
+        return self.api.cse_service
+
+    def _search_fn(self):
+        pages = -(-min(self.num_results, self.api.MAX_RESULTS) // self.api.MAX_PAGE_SIZE)
+        return paginated_search(
+            self.api.single_flight.wrap(http_error_retry(self._search_internal, endpoint='google/customsearch', metrics=self.api.metrics, rate_limiter=self.api.rate_limiter), ('google/customsearch', self.cx)),
+            num_results=self.num_results,
+            page_size=self.api.MAX_PAGE_SIZE,
+            max_workers=self.page_workers or max(pages - 1, 1),
+            use_total=True,
+        )
 
     def transform(self, inp: pd.DataFrame) -> pd.DataFrame:
-        return multi_query(
-            paginated_search(self._search_internal, num_results=self.num_results),
+        with self.api.metrics.call('GoogleSearchRetriever'):
+            return multi_query(
+                self._search_fn(),
+                verbose=self.verbose,
+                verbose_desc='GoogleSearchRetriever',
+                max_workers=self.max_workers,
+                metrics=self.api.metrics,
+            )(inp)
+
+    def transform_iter(self, inp: pt.model.IterDict) -> pt.model.IterDict:
+        """Streaming version of :meth:`transform`, which yields the results of each query as soon as they arrive."""
+        return self.api.metrics.call_iter('GoogleSearchRetriever', multi_query_iter(
+            self._search_fn(),
             verbose=self.verbose,
             verbose_desc='GoogleSearchRetriever',
-        )(inp)
+            max_workers=self.max_workers,
+        )(inp))
 
     def _search_internal(self,
         query: str,
@@ -101,23 +198,52 @@ class GoogleSearchRetriever(pt.Transformer):
             return_next: Whether to return the next query URL. Defaults to False.
             return_total: Whether to return the total number of results. Defaults to False.
         """
-        api_result = self.cse_service.list(q=query, cx=self.cx, num=min(limit, 10), start=offset).execute()
-        if len(api_result["items"]) == 0:
+        limit = min(limit, self.api.MAX_PAGE_SIZE, self.api.MAX_RESULTS - offset)
+        if limit <= 0: # past the last result the API can return
+            api_result = {'items': [], 'searchInformation': {'totalResults': '0'}}
+            return self._parse_search(api_result, offset=offset, return_next=return_next, return_total=return_total)
+        params = {'q': query, 'cx': self.cx, 'num': limit, 'start': offset + 1} # start is 1-based
+        api_result = self.api.metrics.get_or_fetch(self.api.cache, 'google/customsearch', 'google', 'customsearch/v1', params, lambda: self._execute(params))
+        with self.api.metrics.timer('parse'):
+            return self._parse_search(api_result, offset=offset, return_next=return_next, return_total=return_total)
+
+    def _parse_search(self, api_result, *, offset, return_next, return_total):
+        items = api_result.get("items", []) # omitted when there are no results
+        if len(items) == 0:
             result_df = pd.DataFrame(columns=['docno', 'url', 'title', 'snippet', 'rank', 'score'])
         else:
-            result_df = pd.DataFrame([[r['link'], r['link'], r['title'], r['snippet']] for r in api_result["items"]], columns=['docno', 'url', 'title', 'snippet'])
-            result_df['rank'] = range(offset, offset+len(result_df))
-            result_df['score'] = -result_df['rank']
+            links = [r['link'] for r in items]
+            ranks = np.arange(offset, offset + len(items))
+            result_df = pd.DataFrame({
+                'docno': links,
+                'url': links,
+                'title': [r['title'] for r in items],
+                'snippet': [r['snippet'] for r in items],
+                'rank': ranks,
+                'score': -ranks,
+            })
 
         res = [result_df]
         if return_next:
-            res.append(offset + len(result_df) + 1)
+            res.append(offset + len(result_df))
         if return_total:
-            res.append(int(res['searchInformation']['totalResults']))
+            res.append(min(int(api_result['searchInformation']['totalResults']), self.api.MAX_RESULTS))
         if len(res) == 1:
             return res[0]
         return tuple(res)
 
+    def _execute(self, params):
+        from googleapiclient.errors import HttpError
+        with self.api.rate_limiter.limit() as permit, self.api.metrics.request('google/customsearch') as req:
+            try:
+                res = self.api._list(params)
+            except HttpError as e:
+                req.observe(e.resp.status, len(e.content or b''))
+                permit.observe(e.resp.status, e.resp)
+                raise
+            req.observe(200)
+            return res
+
     def fuse_rank_cutoff(self, k: int) -> Optional['GoogleSearchRetriever']:
         if k < self.num_results:
-            return GoogleSearchRetriever(api=self.api, cx=self.cx, num_results=k, verbose=self.verbose)
+            return GoogleSearchRetriever(api=self.api, cx=self.cx, num_results=k, verbose=self.verbose, max_workers=self.max_workers, page_workers=self.page_workers)
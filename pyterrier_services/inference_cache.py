@@ -0,0 +1,154 @@
+import os
+import sqlite3
+import threading
+from hashlib import sha256
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+
+
+def _hash(text: str) -> bytes:
+    return sha256(text.encode()).digest()[:16]
+
+
+class InferenceCache:
+    """A persistent, content-addressed cache of model inference results (embeddings and re-ranking scores).
+
+    Entries are keyed by the model name, the input type and a hash of the text: ``(model_name, input_type, text)`` for
+    embeddings and ``(model_name, query, document)`` for re-ranking scores. Dense vectors are appended to one
+    memory-mapped float32 file per model and input type, sparse vectors are stored as token/float64 arrays, and the
+    index lives in a SQLite database in the same directory. The directory can be shared by multiple threads and
+    processes.
+
+    Example::
+
+        cache = InferenceCache('pinecone-cache/')
+        pinecone = PineconeApi()
+        model = pinecone.dense_model(cache=cache)
+        reranker = pinecone.reranker(cache=cache)
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: The directory to store the cache in. It is created if it does not exist.
+        """
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(path, exist_ok=True)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._mmaps = {}
+        with self._connection() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS dense_files (model TEXT, input_type TEXT, dim INTEGER, rows INTEGER, PRIMARY KEY (model, input_type))')
+            conn.execute('CREATE TABLE IF NOT EXISTS dense (model TEXT, input_type TEXT, text_hash BLOB, row INTEGER, PRIMARY KEY (model, input_type, text_hash))')
+            conn.execute('CREATE TABLE IF NOT EXISTS sparse (model TEXT, input_type TEXT, text_hash BLOB, tokens TEXT, vals BLOB, PRIMARY KEY (model, input_type, text_hash))')
+            conn.execute('CREATE TABLE IF NOT EXISTS rerank (model TEXT, query_hash BLOB, doc_hash BLOB, score REAL, PRIMARY KEY (model, query_hash, doc_hash))')
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(os.path.join(self.path, 'index.sqlite'), timeout=60.)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def _count(self, found: int, total: int) -> None:
+        with self._lock:
+            self.hits += found
+            self.misses += total - found
+
+    def _lookup(self, sql: str, prefix: tuple, hashes: List[bytes]) -> dict:
+        res = {}
+        conn = self._connection()
+        for i in range(0, len(hashes), 500): # stay under sqlite's parameter limit
+            chunk = hashes[i:i+500]
+            res.update((r[0], r[1:]) for r in conn.execute(sql.format(','.join('?' * len(chunk))), (*prefix, *chunk)))
+        return res
+
+    def _dense_file(self, model: str, input_type: str) -> str:
+        return os.path.join(self.path, 'dense-' + sha256(f'{model}\0{input_type}'.encode()).hexdigest()[:16] + '.f32')
+
+    def get_dense(self, model: str, input_type: str, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """Returns the cached dense vector for each text (None for misses)."""
+        hashes = [_hash(t) for t in texts]
+        rows = self._lookup('SELECT text_hash, row FROM dense WHERE model=? AND input_type=? AND text_hash IN ({})', (model, input_type), hashes)
+        self._count(sum(h in rows for h in hashes), len(hashes))
+        if not rows:
+            return [None] * len(texts)
+        dim, = self._connection().execute('SELECT dim FROM dense_files WHERE model=? AND input_type=?', (model, input_type)).fetchone()
+        mmap = self._dense_mmap(model, input_type, dim, max(r[0] for r in rows.values()) + 1)
+        return [np.array(mmap[rows[h][0]]) if h in rows else None for h in hashes]
+
+    def _dense_mmap(self, model: str, input_type: str, dim: int, min_rows: int) -> np.ndarray:
+        with self._lock:
+            mmap = self._mmaps.get((model, input_type))
+            if mmap is None or mmap.shape[0] < min_rows: # (re-)map when the file has grown
+                path = self._dense_file(model, input_type)
+                mmap = np.memmap(path, dtype=np.float32, mode='r', shape=(os.path.getsize(path) // (4 * dim), dim))
+                self._mmaps[model, input_type] = mmap
+            return mmap
+
+    def put_dense(self, model: str, input_type: str, texts: Sequence[str], vectors: np.ndarray) -> None:
+        """Stores the dense vectors (one row per text)."""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        conn = self._connection()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE') # serialises writers (across processes) while appending to the vector file
+            row = conn.execute('SELECT dim, rows FROM dense_files WHERE model=? AND input_type=?', (model, input_type)).fetchone()
+            dim, start = row if row is not None else (vectors.shape[1], 0)
+            assert dim == vectors.shape[1], f'expected {dim}-dimensional vectors, got {vectors.shape[1]}'
+            with open(self._dense_file(model, input_type), 'ab') as fout:
+                fout.truncate(start * dim * 4) # drop any rows from an interrupted write
+                fout.write(vectors.tobytes())
+            conn.execute('INSERT OR REPLACE INTO dense_files VALUES (?, ?, ?, ?)', (model, input_type, dim, start + len(vectors)))
+            conn.executemany('INSERT OR REPLACE INTO dense VALUES (?, ?, ?, ?)',
+                [(model, input_type, _hash(t), start + i) for i, t in enumerate(texts)])
+
+    def get_sparse(self, model: str, input_type: str, texts: Sequence[str]) -> List[Optional[Dict[str, float]]]:
+        """Returns the cached sparse vector (token -> weight) for each text (None for misses)."""
+        hashes = [_hash(t) for t in texts]
+        found = self._lookup('SELECT text_hash, tokens, vals FROM sparse WHERE model=? AND input_type=? AND text_hash IN ({})', (model, input_type), hashes)
+        self._count(sum(h in found for h in hashes), len(hashes))
+        res = []
+        for h in hashes:
+            if h in found:
+                tokens, vals = found[h]
+                tokens = tokens.split('\n') if tokens else []
+                # weights are float64, so they match the API's; entries written by older versions hold float32
+                dtype = np.float32 if len(vals) == 4 * len(tokens) else np.float64
+                res.append(dict(zip(tokens, np.frombuffer(vals, dtype=dtype).tolist())))
+            else:
+                res.append(None)
+        return res
+
+    def put_sparse(self, model: str, input_type: str, texts: Sequence[str], vectors: Sequence[Dict[str, float]]) -> None:
+        """Stores the sparse vectors (token -> weight), one per text."""
+        conn = self._connection()
+        with conn:
+            conn.executemany('INSERT OR REPLACE INTO sparse VALUES (?, ?, ?, ?, ?)', [
+                (model, input_type, _hash(t), '\n'.join(v.keys()), np.array(list(v.values()), dtype=np.float64).tobytes())
+                for t, v in zip(texts, vectors)
+            ])
+
+    def get_rerank(self, model: str, query: str, docs: Sequence[str]) -> List[Optional[float]]:
+        """Returns the cached re-ranking score of each document for the query (None for misses)."""
+        hashes = [_hash(d) for d in docs]
+        found = self._lookup('SELECT doc_hash, score FROM rerank WHERE model=? AND query_hash=? AND doc_hash IN ({})', (model, _hash(query)), hashes)
+        self._count(sum(h in found for h in hashes), len(hashes))
+        return [found[h][0] if h in found else None for h in hashes]
+
+    def put_rerank(self, model: str, query: str, docs: Sequence[str], scores: Sequence[float]) -> None:
+        """Stores the re-ranking score of each document for the query."""
+        query_hash = _hash(query)
+        conn = self._connection()
+        with conn:
+            conn.executemany('INSERT OR REPLACE INTO rerank VALUES (?, ?, ?, ?)',
+                [(model, query_hash, _hash(d), float(s)) for d, s in zip(docs, scores)])
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the number of hits and misses of this cache object."""
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def __repr__(self):
+        return f'InferenceCache({self.path!r})'
@@ -0,0 +1,250 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+
+class _Request:
+    """Records the outcome of a single request (see :meth:`Metrics.request`)."""
+    __slots__ = ('status_code', 'nbytes')
+
+    def __init__(self):
+        self.status_code = None
+        self.nbytes = 0
+
+    def observe(self, status_code: int, nbytes: int = 0) -> None:
+        """Records the response status and the size of the response body (in bytes)."""
+        self.status_code = status_code
+        self.nbytes = nbytes
+
+
+class _Endpoint:
+    def __init__(self, buckets):
+        self.requests = 0
+        self.errors = 0
+        self.statuses = {}
+        self.latency_counts = [0] * (len(buckets) + 1)
+        self.latency_sum = 0.
+        self.bytes = 0
+        self.retries = 0
+        self.cooldown = 0.
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+
+class Metrics:
+    """Collects request metrics and stage timings for an API object.
+
+    Every API object records to its own ``metrics`` (a new instance by default), which can also be shared by several
+    API objects. For each endpoint (e.g., ``semantic_scholar/paper/search``), it counts requests (by status code),
+    failed requests, bytes received, retries, seconds spent in cooldowns before retrying and cache hits/misses, and
+    keeps a histogram of request latencies. It also accumulates the time spent in each stage of processing (e.g.,
+    ``request``, ``decode``, ``parse`` and ``assemble``), and keeps a breakdown of these stages for the most recent
+    transformer calls.
+
+    Metrics can be exported with :meth:`snapshot` (everything, as plain values) or :meth:`stats` (totals), or forwarded
+    to another monitoring system as they are recorded by registering ``listeners``.
+
+    Example::
+
+        s2 = SemanticScholarApi()
+        s2.retriever()(topics)
+        s2.metrics.stats()
+        # {'requests': 50, 'errors': 0, 'bytes': 1843270, 'retries': 2, 'cooldown': 4.0, 'cache_hits': 0, 'cache_misses': 0}
+        s2.metrics.snapshot()['calls'][-1]
+        # {'name': 'SemanticScholarRetriever', 'seconds': 9.1, 'stages': {'request': 6.8, 'cooldown': 4.0, ...}}
+    """
+
+    LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10., 30.)
+
+    def __init__(self,
+        *,
+        listeners: Optional[List[Callable[[str, str, float], None]]] = None,
+        history: int = 100,
+    ):
+        """
+        Args:
+            listeners: Functions called as ``listener(event, name, value)`` for every recorded value, where ``event`` is
+                one of ``request`` (value: latency in seconds), ``bytes``, ``error``, ``retry`` (value: cooldown in
+                seconds), ``cache_hit``, ``cache_miss``, ``stage`` (value: seconds) or ``call`` (value: duration in
+                seconds), and ``name`` is the endpoint, stage or transformer call. Defaults to None (no listeners).
+            history: The number of recent transformer calls to keep a stage breakdown of. Defaults to 100.
+        """
+        self.listeners = list(listeners or [])
+        self.history = history
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        """Clears all the recorded metrics."""
+        with self._lock:
+            self._endpoints = {}
+            self._stages = {}
+            self._calls = deque(maxlen=self.history)
+
+    def _endpoint(self, endpoint: str) -> _Endpoint:
+        # must be called while holding the lock
+        ep = self._endpoints.get(endpoint)
+        if ep is None:
+            ep = self._endpoints[endpoint] = _Endpoint(self.LATENCY_BUCKETS)
+        return ep
+
+    def _notify(self, event: str, name: str, value: float) -> None:
+        for listener in self.listeners:
+            listener(event, name, value)
+
+    @contextmanager
+    def request(self, endpoint: str):
+        """Times a request to ``endpoint``, yielding an object to record the response with (``req.observe(status_code,
+        nbytes)``). Requests that raise, or are not observed, are counted as errors."""
+        req = _Request()
+        start = time.perf_counter()
+        try:
+            yield req
+        finally:
+            latency = time.perf_counter() - start
+            failed = req.status_code is None or req.status_code >= 400
+            with self._lock:
+                ep = self._endpoint(endpoint)
+                ep.requests += 1
+                ep.errors += int(failed)
+                if req.status_code is not None:
+                    ep.statuses[req.status_code] = ep.statuses.get(req.status_code, 0) + 1
+                ep.latency_counts[bisect_left(self.LATENCY_BUCKETS, latency)] += 1
+                ep.latency_sum += latency
+                ep.bytes += req.nbytes
+                self._stages['request'] = self._stages.get('request', 0.) + latency
+            if self.listeners:
+                self._notify('request', endpoint, latency)
+                self._notify('bytes', endpoint, req.nbytes)
+                if failed:
+                    self._notify('error', endpoint, 1)
+
+    def record_retry(self, endpoint: str, cooldown: float) -> None:
+        """Records a retry of a request to ``endpoint`` after waiting ``cooldown`` seconds."""
+        with self._lock:
+            ep = self._endpoint(endpoint)
+            ep.retries += 1
+            ep.cooldown += cooldown
+            self._stages['cooldown'] = self._stages.get('cooldown', 0.) + cooldown
+        if self.listeners:
+            self._notify('retry', endpoint, cooldown)
+
+    def record_cache(self, endpoint: str, hits: int = 0, misses: int = 0) -> None:
+        """Records cache hits and misses for requests to ``endpoint``."""
+        with self._lock:
+            ep = self._endpoint(endpoint)
+            ep.cache_hits += hits
+            ep.cache_misses += misses
+        if self.listeners:
+            if hits:
+                self._notify('cache_hit', endpoint, hits)
+            if misses:
+                self._notify('cache_miss', endpoint, misses)
+
+    def add_time(self, stage: str, seconds: float) -> None:
+        """Adds ``seconds`` to the time spent in ``stage``."""
+        with self._lock:
+            self._stages[stage] = self._stages.get(stage, 0.) + seconds
+        if self.listeners:
+            self._notify('stage', stage, seconds)
+
+    @contextmanager
+    def timer(self, stage: str):
+        """Adds the time spent in the ``with`` block to ``stage``."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start)
+
+    @contextmanager
+    def call(self, name: str):
+        """Records the duration of a transformer call, along with the time spent in each stage during the call.
+
+        Stage times are summed over all the threads working on the call (so they can exceed its duration), and also
+        include any other work recorded to these metrics while the call is running.
+        """
+        with self._lock:
+            before = dict(self._stages)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                stages = {k: v - before.get(k, 0.) for k, v in self._stages.items() if v != before.get(k, 0.)}
+                self._calls.append({'name': name, 'seconds': seconds, 'stages': stages})
+            if self.listeners:
+                self._notify('call', name, seconds)
+
+    def call_iter(self, name: str, it: Iterable) -> Iterator:
+        """Yields the items of ``it``, recording a transformer call (see :meth:`call`) that lasts while it is consumed."""
+        with self.call(name):
+            yield from it
+
+    def get_or_fetch(self, cache, endpoint: str, service: str, cache_endpoint: str, params: Dict[str, Any], fetch: Callable[[], Any]) -> Any:
+        """Calls ``fetch()`` through ``cache`` (see :meth:`ResponseCache.get_or_fetch`), if provided, recording whether
+        the response came from the cache."""
+        if cache is None:
+            return fetch()
+        fetched = []
+        def wrapped():
+            fetched.append(True)
+            return fetch()
+        res = cache.get_or_fetch(service, cache_endpoint, params, wrapped)
+        self.record_cache(endpoint, hits=int(not fetched), misses=int(bool(fetched)))
+        return res
+
+    async def async_get_or_fetch(self, cache, endpoint: str, service: str, cache_endpoint: str, params: Dict[str, Any], fetch) -> Any:
+        """Async version of :meth:`get_or_fetch`, where ``fetch`` is a coroutine function."""
+        if cache is None:
+            return await fetch()
+        fetched = []
+        async def wrapped():
+            fetched.append(True)
+            return await fetch()
+        res = await cache.async_get_or_fetch(service, cache_endpoint, params, wrapped)
+        self.record_cache(endpoint, hits=int(not fetched), misses=int(bool(fetched)))
+        return res
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Returns all the recorded metrics as plain values (safe to serialise as JSON).
+
+        ``endpoints`` maps each endpoint to its counters and latency histogram (the number of requests that took up to
+        each of ``latency.buckets`` seconds, with a final count of slower requests); ``stages`` maps each stage to the
+        total number of seconds spent in it; and ``calls`` lists the breakdown of the most recent transformer calls.
+        """
+        with self._lock:
+            return {
+                'endpoints': {name: {
+                    'requests': ep.requests,
+                    'errors': ep.errors,
+                    'statuses': {str(k): v for k, v in sorted(ep.statuses.items())},
+                    'bytes': ep.bytes,
+                    'retries': ep.retries,
+                    'cooldown': ep.cooldown,
+                    'cache_hits': ep.cache_hits,
+                    'cache_misses': ep.cache_misses,
+                    'latency': {
+                        'buckets': list(self.LATENCY_BUCKETS),
+                        'counts': list(ep.latency_counts),
+                        'sum': ep.latency_sum,
+                        'mean': ep.latency_sum / ep.requests if ep.requests else None,
+                    },
+                } for name, ep in self._endpoints.items()},
+                'stages': dict(self._stages),
+                'calls': [{**c, 'stages': dict(c['stages'])} for c in self._calls],
+            }
+
+    def stats(self) -> Dict[str, float]:
+        """Returns the number of requests, errors, bytes received, retries, cooldown seconds and cache hits/misses,
+        summed over all endpoints."""
+        keys = ['requests', 'errors', 'bytes', 'retries', 'cooldown', 'cache_hits', 'cache_misses']
+        with self._lock:
+            return {k: sum(getattr(ep, k) for ep in self._endpoints.values()) for k in keys}
+
+    def __repr__(self):
+        return f'Metrics(endpoints={len(self._endpoints)})'
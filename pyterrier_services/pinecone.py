@@ -1,8 +1,12 @@
-from typing import Optional, Literal
+from typing import Optional, Literal, List, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import pandas as pd
 import pyterrier as pt
 import pyterrier_alpha as pta
+from .inference_cache import InferenceCache
+from .sparse import SparseVectors
+from .metrics import Metrics
 
 class PineconeApi:
     """Represents a reference to the Pinecone API.
@@ -10,40 +14,139 @@ class PineconeApi:
     This class wraps :class:`pinecone.Pinecone`.
     """
 
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(self, api_key: Optional[str] = None, *, host: Optional[str] = None, metrics: Optional[Metrics] = None):
         """
         Args:
             api_key (str, optional): The Pinecone API key. Defaults to the value from ``PINECONE_API_KEY``.
+            host (str, optional): The URL of the API (e.g., a proxy or a local stand-in). Defaults to Pinecone's API.
+            metrics (Metrics, optional): The metrics to record requests and timings to. Defaults to a new instance of :class:`~pyterrier_services.Metrics`.
         """
         from pinecone import Pinecone
         self.api_key = api_key
-        self.pc = Pinecone(api_key=self.api_key)
+        self.host = host
+        self.metrics = metrics or Metrics()
+        self.pc = Pinecone(api_key=self.api_key, host=self.host)
         self._embed = self.pc.inference.embed
         self._rerank = self.pc.inference.rerank
 
-    def dense_model(self, model_name: str = 'multilingual-e5-large') -> 'PineconeDenseModel':
+    def dense_model(self, model_name: str = 'multilingual-e5-large', **kwargs) -> 'PineconeDenseModel':
         """Creates a :class:`PineconeDenseModel` instance.
 
         Args:
             model_name (str): The name of the model. See the `list of supported models <https://docs.pinecone.io/models>`__.
+            **kwargs: Additional arguments passed to :class:`PineconeDenseModel` (e.g., ``batch_size``).
         """
-        return PineconeDenseModel(model_name, api=self)
+        return PineconeDenseModel(model_name, api=self, **kwargs)
 
-    def sparse_model(self, model_name: str = 'pinecone-sparse-english-v0') -> 'PineconeSparseModel':
+    def sparse_model(self, model_name: str = 'pinecone-sparse-english-v0', **kwargs) -> 'PineconeSparseModel':
         """Creates a :class:`PineconeSparseModel` instance.
 
         Args:
             model_name (str): The name of the model. See the `list of supported models <https://docs.pinecone.io/models>`__.
+            **kwargs: Additional arguments passed to :class:`PineconeSparseModel` (e.g., ``batch_size``).
         """
-        return PineconeSparseModel(model_name, api=self)
+        return PineconeSparseModel(model_name, api=self, **kwargs)
 
-    def reranker(self, model_name: str = 'pinecone-rerank-v0') -> 'PineconeReranker':
+    def reranker(self, model_name: str = 'pinecone-rerank-v0', **kwargs) -> 'PineconeReranker':
         """Creates a :class:`PineconeReranker` instance.
 
         Args:
             model_name (str): The name of the model. See the `list of supported models <https://docs.pinecone.io/models>`__.
+            **kwargs: Additional arguments passed to :class:`PineconeReranker` (e.g., ``cache``).
         """
-        return PineconeReranker(model_name, api=self)
+        return PineconeReranker(model_name, api=self, **kwargs)
+
+
+def _estimate_tokens(text: str) -> int:
+    # A rough estimate (~4 characters per token); it only needs to keep batches under the request limits
+    return len(text) // 4 + 1
+
+
+def _pack_batches(texts: List[str], batch_size: int, batch_tokens: int) -> List[Tuple[int, int]]:
+    """Packs consecutive texts into ``[start, end)`` batches limited by item count and estimated token count."""
+    batches = []
+    start, tokens = 0, 0
+    for i, text in enumerate(texts):
+        t = _estimate_tokens(text)
+        if i > start and (i - start >= batch_size or tokens + t > batch_tokens):
+            batches.append((start, i))
+            start, tokens = i, 0
+        tokens += t
+    if start < len(texts):
+        batches.append((start, len(texts)))
+    return batches
+
+
+def _embed_batched(model, texts: List[str], parameters: dict, vector_type: str, desc: str) -> list:
+    """Embeds texts in batches (several in flight at once), returning the embeddings in input order."""
+    def embed(batch):
+        start, end = batch
+        with model.api.metrics.request('pinecone/embed') as req:
+            embeddings = model.api._embed(model=model.model_name, inputs=texts[start:end], parameters=parameters)
+            req.observe(200)
+        assert embeddings.vector_type == vector_type
+        return embeddings.data
+
+    batches = _pack_batches(texts, model.batch_size, model.batch_tokens)
+    with ThreadPoolExecutor(max_workers=max(model.max_workers, 1)) as pool:
+        it = pool.map(embed, batches) # map preserves the batch order
+        if model.verbose:
+            it = pt.tqdm(it, desc=desc, unit='batch', total=len(batches))
+        return [e for data in it for e in data]
+
+
+def _encode(model, texts: List[str], input_type: str, parameters: dict, vector_type: str, desc: str, vocab: Optional[SparseVectors] = None, sparse_dtype=np.float32) -> Union[np.ndarray, SparseVectors]:
+    """Encodes texts with the model, only sending unique texts that are not in the model's cache to the API.
+
+    Dense vectors are returned as a single ``(len(texts), dim)`` float32 matrix, and sparse vectors as a
+    :class:`~pyterrier_services.SparseVectors` batch (sharing the vocabulary of ``vocab``, if provided) with
+    ``sparse_dtype`` weights.
+    """
+    cache = model.cache
+    unique = list(dict.fromkeys(texts))
+    if cache is None:
+        found = [None] * len(unique)
+    elif vector_type == 'dense':
+        found = cache.get_dense(model.model_name, input_type, unique)
+    else:
+        found = [(list(f.keys()), list(f.values())) if f is not None else None for f in cache.get_sparse(model.model_name, input_type, unique)]
+    missing = [t for t, f in zip(unique, found) if f is None]
+    if cache is not None:
+        model.api.metrics.record_cache('pinecone/embed', hits=len(unique) - len(missing), misses=len(missing))
+    if missing:
+        embeddings = _embed_batched(model, missing, parameters, vector_type, desc)
+        if vector_type == 'dense':
+            encoded = [np.array(v.values, dtype=np.float32) for v in embeddings]
+            if cache is not None:
+                cache.put_dense(model.model_name, input_type, missing, np.stack(encoded))
+        else:
+            encoded = [(v.sparse_tokens, v.sparse_values) for v in embeddings]
+            if cache is not None:
+                cache.put_sparse(model.model_name, input_type, missing, [dict(zip(toks, vals)) for toks, vals in encoded])
+        encoded = iter(encoded)
+        found = [next(encoded) if f is None else f for f in found]
+    index = {t: i for i, t in enumerate(unique)}
+    inverse = np.array([index[t] for t in texts], dtype=np.int64)
+    if vector_type == 'dense':
+        return np.stack(found)[inverse] if found else np.empty((0, 0), dtype=np.float32)
+    if vocab is not None:
+        return SparseVectors.from_pairs(found, vocab=vocab.vocab, tokens=vocab.tokens, dtype=sparse_dtype).take(inverse)
+    return SparseVectors.from_pairs(found, dtype=sparse_dtype).take(inverse)
+
+
+def _query_groups(inp: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the query index of each row (in order of first appearance) and the first row of each query."""
+    qid_codes, _ = pd.factorize(inp['qid'])
+    _, first_rows = np.unique(qid_codes, return_index=True)
+    return qid_codes, first_rows
+
+
+def _rank_by_query(inp: pd.DataFrame, qid_codes: np.ndarray, scores: np.ndarray) -> pd.DataFrame:
+    """Sorts the results by score within each query (keeping the order of the queries), and assigns ranks."""
+    order = np.lexsort((-scores, qid_codes))
+    res = inp.iloc[order].assign(score=scores[order]).reset_index(drop=True)
+    pt.model.add_ranks(res)
+    return res
 
 
 class PineconeSparseModel(pt.Transformer):
@@ -52,14 +155,34 @@ class PineconeSparseModel(pt.Transformer):
         model_name: str = 'pinecone-sparse-english-v0',
         *,
         api: Optional[PineconeApi] = None,
+        batch_size: int = 96,
+        batch_tokens: int = 50_000,
+        max_workers: int = 4,
+        verbose: bool = False,
+        cache: Optional[InferenceCache] = None,
+        sparse_format: Literal['dict', 'csr'] = 'dict',
     ):
         """
         Args:
             model_name (str): The name of the model. See the `list of supported models <https://docs.pinecone.io/models>`__.
             api (PineconeApi, optional): The Pinecone API object. Defaults to a new instance.
+            batch_size (int): The maximum number of inputs sent per request. Defaults to 96.
+            batch_tokens (int): The maximum (estimated) number of tokens sent per request. Defaults to 50,000.
+            max_workers (int): The number of requests in flight at once. Defaults to 4.
+            verbose (bool): Whether to show a progress bar over the batches. Defaults to False.
+            cache (InferenceCache, optional): A cache of embeddings; only cache misses are sent to the API. Defaults to None.
+            sparse_format (str): The format of the encoded vectors: ``'dict'`` (a ``dict`` per row) or ``'csr'`` (a
+                read-only mapping per row, backed by a :class:`~pyterrier_services.SparseVectors` batch with a shared
+                vocabulary, which uses far less memory). Defaults to ``'dict'``.
         """
         self.model_name = model_name
         self.api = api or PineconeApi()
+        self.batch_size = batch_size
+        self.batch_tokens = batch_tokens
+        self.max_workers = max_workers
+        self.verbose = verbose
+        self.cache = cache
+        self.sparse_format = sparse_format
 
     def transform(self, inp: pd.DataFrame) -> pd.DataFrame:
         """Encodes either queries or documents using this model (based on input columns)"""
@@ -91,89 +214,161 @@ class PineconeSparseEncoder(pt.Transformer):
         self.input_type = input_type
 
     def transform(self, inp: pd.DataFrame) -> pd.DataFrame:
-        if self.input_type == 'passage':
-            pta.validate.document_frame(inp, extra_columns=['text'])
-            text = inp['text'].tolist()
-            toks_field = 'toks'
-        elif self.input_type == 'query':
-            pta.validate.query_frame(inp, extra_columns=['query'])
-            text = inp['query'].tolist()
-            toks_field = 'query_toks'
-
-        embeddings = self.sparse_model.api._embed(
-            model=self.sparse_model.model_name,
-            inputs=text,
-            parameters={"input_type": self.input_type, "return_tokens": True}
-        )
-        assert embeddings.vector_type == 'sparse'
-        toks = [dict(zip(v.sparse_tokens, v.sparse_values)) for v in embeddings.data]
-        return inp.assign(**{toks_field: toks})
+        with self.sparse_model.api.metrics.call(repr(self)):
+            if self.input_type == 'passage':
+                pta.validate.document_frame(inp, extra_columns=['text'])
+                text = inp['text'].tolist()
+                toks_field = 'toks'
+            elif self.input_type == 'query':
+                pta.validate.query_frame(inp, extra_columns=['query'])
+                text = inp['query'].tolist()
+                toks_field = 'query_toks'
+
+            toks = _encode(
+                self.sparse_model,
+                text,
+                self.input_type,
+                parameters={"input_type": self.input_type, "return_tokens": True},
+                vector_type='sparse',
+                desc=repr(self),
+                sparse_dtype=np.float32 if self.sparse_model.sparse_format == 'csr' else np.float64, # dicts keep the weights from the API
+            )
+            if self.sparse_model.sparse_format == 'csr':
+                return inp.assign(**{toks_field: [toks[i] for i in range(len(toks))]})
+            return inp.assign(**{toks_field: toks.to_dicts()})
 
     def __repr__(self):
         return f"PineconeSparseEncoder({self.sparse_model!r}, input_type={self.input_type!r})"
 
 
-def _sparse_dot(qt, dt):
-    return sum(qt[t] * dt[t] for t in qt.keys() & dt.keys())
-
-
 class PineconeSparseScorer(pt.Transformer):
     def __init__(self, sparse_model: PineconeSparseModel):
         self.sparse_model = sparse_model
 
     def transform(self, inp: pd.DataFrame) -> pd.DataFrame:
-        pta.validate.document_frame(inp, extra_columns=['query', 'text'])
-        query_toks = self.sparse_model.query_encoder(inp[['qid', 'query']])['query_toks']
-        doc_toks = self.sparse_model.doc_encoder(inp[['docno', 'text']])['toks']
-
-        scores = [_sparse_dot(qt, dt) for qt, dt in zip(query_toks, doc_toks)]
-
-        res = inp.assign(score=scores).sort_values('score', ascending=False).reset_index(drop=True)
-        pt.model.add_ranks(res)
-        return res
+        with self.sparse_model.api.metrics.call(repr(self)):
+            pta.validate.result_frame(inp, extra_columns=['query', 'text'])
+            qid_codes, first_rows = _query_groups(inp)
+            query_toks = _encode(
+                self.sparse_model,
+                inp['query'].iloc[first_rows].tolist(), # each query is only encoded once
+                'query',
+                parameters={"input_type": "query", "return_tokens": True},
+                vector_type='sparse',
+                desc=repr(self),
+            )
+            doc_toks = _encode(
+                self.sparse_model,
+                inp['text'].tolist(),
+                'passage',
+                parameters={"input_type": "passage", "return_tokens": True},
+                vector_type='sparse',
+                desc=repr(self),
+                vocab=query_toks,
+            )
+
+            scores = doc_toks.rowwise_dot(query_toks.take(qid_codes))
+
+            return _rank_by_query(inp, qid_codes, scores)
 
     def __repr__(self):
         return f"PineconeSparseScorer({self.sparse_model!r})"
 
 
 class PineconeReranker(pt.Transformer):
-    """A PyTerrier transformer that provies access to a Pinecone reranker model."""
+    """A PyTerrier transformer that provies access to a Pinecone reranker model.
+
+    Candidate lists longer than ``batch_size`` are split into chunks that are scored separately and merged, and the
+    chunks of all queries are scored concurrently (up to ``max_workers`` requests in flight).
+    """
 
     def __init__(self,
         model_name: str = 'pinecone-rerank-v0',
         *,
         api: Optional[PineconeApi] = None,
+        cache: Optional[InferenceCache] = None,
+        batch_size: int = 100,
+        max_workers: int = 4,
+        top_n: Optional[int] = None,
+        verbose: bool = False,
     ):
         """
         Args:
             model_name (str): The name of the model. See the `list of supported models <https://docs.pinecone.io/models>`__.
             api (PineconeApi, optional): The Pinecone API object. Defaults to a new instance.
+            cache (InferenceCache, optional): A cache of scores; only cache misses are sent to the API. Defaults to None.
+            batch_size (int): The maximum number of documents sent in a single request (the model's per-request limit). Defaults to 100.
+            max_workers (int): The maximum number of requests in flight at once. Defaults to 4.
+            top_n (int, optional): Only return the ``top_n`` highest-scoring documents of each query. Defaults to None (all documents).
+            verbose (bool): Whether to show a progress bar. Defaults to False.
         """
         self.model_name = model_name
         self.api = api or PineconeApi()
+        self.cache = cache
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.top_n = top_n
+        self.verbose = verbose
+
+    def _score_chunk(self, query: str, documents: List[str]) -> List[Tuple[int, float]]:
+        kwargs = {}
+        if self.top_n is not None and self.top_n < len(documents):
+            kwargs['top_n'] = self.top_n # no other document of the chunk can make it into the top_n of the query
+        with self.api.metrics.request('pinecone/rerank') as req:
+            results = self.api._rerank(
+                model=self.model_name,
+                query=query,
+                documents=documents,
+                return_documents=False,
+                parameters= {
+                    "truncate": "END"
+                },
+                **kwargs,
+            )
+            req.observe(200)
+        return [(r.index, r.score) for r in results.data]
 
-    @pta.transform.by_query()
     def transform(self, inp: pd.DataFrame) -> pd.DataFrame:
-        inp = inp.reset_index(drop=True)
-        pta.validate.result_frame(inp, extra_columns=['query', 'text'])
-        query = inp['query'].iloc[0]
-        documents = inp['text'].tolist()
-        results = self.api._rerank(
-            model=self.model_name,
-            query=query,
-            documents=documents,
-            return_documents=False,
-            parameters= {
-                "truncate": "END"
-            }
-        )
-        res = inp.assign(score=pd.Series(
-            [r.score for r in results.data],
-            [r.index for r in results.data],
-        ))
-        res = res.sort_values('score', ascending=False).reset_index(drop=True)
-        res = res.assign(rank=np.arange(len(res)))
-        return res
+        with self.api.metrics.call(repr(self)):
+            pta.validate.result_frame(inp, extra_columns=['query', 'text'])
+            inp = inp.reset_index(drop=True)
+            qid_codes, first_rows = _query_groups(inp)
+            texts = inp['text'].tolist()
+            queries = inp['query'].iloc[first_rows].tolist()
+            scores = np.full(len(inp), np.nan)
+
+            chunks = [] # (query index, rows to score)
+            order = np.argsort(qid_codes, kind='stable')
+            for q, rows in enumerate(np.split(order, np.cumsum(np.bincount(qid_codes, minlength=len(first_rows)))[:-1])):
+                if len(rows) == 0:
+                    continue # np.split yields a single empty group for an empty input (which has no queries)
+                if self.cache is not None:
+                    cached = self.cache.get_rerank(self.model_name, queries[q], [texts[i] for i in rows])
+                    hit = np.array([s is not None for s in cached], dtype=bool)
+                    self.api.metrics.record_cache('pinecone/rerank', hits=int(hit.sum()), misses=int((~hit).sum()))
+                    scores[rows[hit]] = [s for s in cached if s is not None]
+                    rows = rows[~hit]
+                chunks.extend((q, rows[i:i+self.batch_size]) for i in range(0, len(rows), self.batch_size))
+
+            def score(chunk):
+                q, rows = chunk
+                return q, rows, self._score_chunk(queries[q], [texts[i] for i in rows])
+
+            with ThreadPoolExecutor(max_workers=max(self.max_workers, 1)) as pool:
+                it = pool.map(score, chunks)
+                if self.verbose:
+                    it = pt.tqdm(it, desc=repr(self), unit='batch', total=len(chunks))
+                for q, rows, results in it:
+                    scored = np.array([rows[i] for i, _ in results], dtype=np.int64)
+                    scores[scored] = [s for _, s in results]
+                    if self.cache is not None:
+                        self.cache.put_rerank(self.model_name, queries[q], [texts[i] for i in scored], [s for _, s in results])
+
+            keep = ~np.isnan(scores) # with top_n, documents that were not returned by their chunk are dropped
+            res = _rank_by_query(inp[keep], qid_codes[keep], scores[keep])
+            if self.top_n is not None:
+                res = res[res['rank'] < self.top_n].reset_index(drop=True)
+            return res
 
     def __repr__(self):
         return f"PineconeReranker({self.model_name!r})"
@@ -185,14 +380,29 @@ class PineconeDenseModel(pt.Transformer):
         model_name: str = 'multilingual-e5-large',
         *,
         api: Optional[PineconeApi] = None,
+        batch_size: int = 96,
+        batch_tokens: int = 50_000,
+        max_workers: int = 4,
+        verbose: bool = False,
+        cache: Optional[InferenceCache] = None,
     ):
         """
         Args:
             model_name (str): The name of the model. See the `list of supported models <https://docs.pinecone.io/models>`__.
             api (PineconeApi, optional): The Pinecone API object. Defaults to a new instance.
+            batch_size (int): The maximum number of inputs sent per request. Defaults to 96.
+            batch_tokens (int): The maximum (estimated) number of tokens sent per request. Defaults to 50,000.
+            max_workers (int): The number of requests in flight at once. Defaults to 4.
+            verbose (bool): Whether to show a progress bar over the batches. Defaults to False.
+            cache (InferenceCache, optional): A cache of embeddings; only cache misses are sent to the API. Defaults to None.
         """
         self.model_name = model_name
         self.api = api or PineconeApi()
+        self.batch_size = batch_size
+        self.batch_tokens = batch_tokens
+        self.max_workers = max_workers
+        self.verbose = verbose
+        self.cache = cache
 
     def transform(self, inp: pd.DataFrame) -> pd.DataFrame:
         """Encodes either queries or documents using this model (based on input columns)"""
@@ -224,23 +434,25 @@ class PineconeDenseEncoder(pt.Transformer):
         self.input_type = input_type
 
     def transform(self, inp: pd.DataFrame) -> pd.DataFrame:
-        if self.input_type == 'passage':
-            pta.validate.document_frame(inp, extra_columns=['text'])
-            text = inp['text'].tolist()
-            vecs_field = 'doc_vec'
-        elif self.input_type == 'query':
-            pta.validate.query_frame(inp, extra_columns=['query'])
-            text = inp['query'].tolist()
-            vecs_field = 'query_vec'
-
-        embeddings = self.dense_model.api._embed(
-            model=self.dense_model.model_name,
-            inputs=text,
-            parameters={"input_type": self.input_type, "truncate": "END"}
-        )
-        assert embeddings.vector_type == 'dense'
-        vecs = [np.array(v.values) for v in embeddings.data]
-        return inp.assign(**{vecs_field: vecs})
+        with self.dense_model.api.metrics.call(repr(self)):
+            if self.input_type == 'passage':
+                pta.validate.document_frame(inp, extra_columns=['text'])
+                text = inp['text'].tolist()
+                vecs_field = 'doc_vec'
+            elif self.input_type == 'query':
+                pta.validate.query_frame(inp, extra_columns=['query'])
+                text = inp['query'].tolist()
+                vecs_field = 'query_vec'
+
+            vecs = _encode(
+                self.dense_model,
+                text,
+                self.input_type,
+                parameters={"input_type": self.input_type, "truncate": "END"},
+                vector_type='dense',
+                desc=repr(self),
+            )
+            return inp.assign(**{vecs_field: list(vecs)})
 
     def __repr__(self):
         return f"PineconeDenseEncoder({self.dense_model!r}, input_type={self.input_type!r})"
@@ -251,15 +463,29 @@ class PineconeDenseScorer(pt.Transformer):
         self.dense_model = dense_model
 
     def transform(self, inp: pd.DataFrame) -> pd.DataFrame:
-        pta.validate.document_frame(inp, extra_columns=['query', 'text'])
-        query_vecs = self.dense_model.query_encoder(inp[['qid', 'query']])['query_vec']
-        doc_vecs = self.dense_model.doc_encoder(inp[['docno', 'text']])['doc_vec']
-
-        scores = [np.dot(qv, dv) for qv, dv in zip(query_vecs, doc_vecs)]
-
-        res = inp.assign(score=scores).sort_values('score', ascending=False).reset_index(drop=True)
-        pt.model.add_ranks(res)
-        return res
+        with self.dense_model.api.metrics.call(repr(self)):
+            pta.validate.result_frame(inp, extra_columns=['query', 'text'])
+            qid_codes, first_rows = _query_groups(inp)
+            query_vecs = _encode(
+                self.dense_model,
+                inp['query'].iloc[first_rows].tolist(), # each query is only encoded once
+                'query',
+                parameters={"input_type": "query", "truncate": "END"},
+                vector_type='dense',
+                desc=repr(self),
+            )
+            doc_vecs = _encode(
+                self.dense_model,
+                inp['text'].tolist(),
+                'passage',
+                parameters={"input_type": "passage", "truncate": "END"},
+                vector_type='dense',
+                desc=repr(self),
+            )
+
+            scores = np.einsum('ij,ij->i', doc_vecs, query_vecs[qid_codes]) if len(inp) else np.empty(0, dtype=np.float32)
+
+            return _rank_by_query(inp, qid_codes, scores)
 
     def __repr__(self):
         return f"PineconeDenseScorer({self.dense_model!r})"
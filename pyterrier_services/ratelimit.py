@@ -0,0 +1,240 @@
+import asyncio
+import importlib.util
+import os
+import struct
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+
+
+def retry_after(headers) -> Optional[float]:
+    """Parses the ``Retry-After`` header (in either delay-seconds or HTTP-date form) as a number of seconds."""
+    value = headers.get('Retry-After', headers.get('retry-after')) if headers is not None else None
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.)
+    except (TypeError, ValueError):
+        return None
+
+
+def _wake(future: asyncio.Future) -> None:
+    if not future.done(): # the waiting coroutine may have been cancelled
+        future.set_result(None)
+
+
+class _Permit:
+    """Records the outcome of a single rate-limited request."""
+    def __init__(self):
+        self.throttled = False
+        self.retry_after = None
+
+    def observe(self, status_code: int, headers=None) -> None:
+        """Records the response status (and ``Retry-After`` header) of the request."""
+        if status_code == 429:
+            self.throttled = True
+            self.retry_after = retry_after(headers)
+
+
+class RateLimiter:
+    """A client-side token-bucket rate limiter with adaptive (AIMD) concurrency.
+
+    Requests draw tokens from a bucket that refills at ``rate`` tokens per second (up to ``burst`` tokens). A limiter
+    object can be shared by several threads and API objects. When a ``path`` is provided, the bucket is stored in that
+    file (guarded by an advisory file lock), so that it is also shared by all processes on the host that use the same
+    path.
+
+    The number of requests in flight is adapted to the observed rate of ``429 Too Many Requests`` responses: it grows
+    by one for every ``concurrency`` successful requests (additive increase) and is multiplied by ``decrease`` on each
+    throttled request (multiplicative decrease). A ``Retry-After`` header on a throttled response pauses the bucket
+    for the requested duration.
+    """
+
+    def __init__(self,
+        rate: float,
+        *,
+        burst: float = 1.,
+        max_concurrency: int = 16,
+        min_concurrency: int = 1,
+        decrease: float = 0.5,
+        path: Optional[str] = None,
+    ):
+        """
+        Args:
+            rate: The sustained number of requests per second.
+            burst: The maximum number of requests that can be issued at once after a quiet period. Defaults to 1.
+            max_concurrency: The maximum number of requests in flight at once. Defaults to 16.
+            min_concurrency: The minimum number of requests in flight at once. Defaults to 1.
+            decrease: The factor the concurrency is multiplied by when a request is throttled. Defaults to 0.5.
+            path: A file to keep the token bucket in, shared across processes. Defaults to None (in-process only).
+        """
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.decrease = decrease
+        self.path = path
+        self.concurrency = float(max_concurrency)
+        self.requests = 0
+        self.throttled = 0
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        self._async_waiters = [] # (loop, future) of coroutines waiting for a slot, woken (like _cond) by _exit
+        self._lock = threading.Lock()
+        self._fd = None
+        self._state = (float(burst), time.time(), 0.) # tokens, last refill, paused until
+        if path is not None:
+            if importlib.util.find_spec('fcntl') is None:
+                raise ModuleNotFoundError('RateLimiter(path=...) needs fcntl file locks, which are only available on POSIX systems')
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    @classmethod
+    def semantic_scholar(cls, keyed: bool = True, **kwargs) -> 'RateLimiter':
+        """The published Semantic Scholar limits: 1 request/sec with an API key, or 100 requests/5min without."""
+        if keyed:
+            return cls(1., **{'burst': 1., **kwargs})
+        return cls(100 / 300, **{'burst': 10., **kwargs})
+
+    @classmethod
+    def dblp(cls, **kwargs) -> 'RateLimiter':
+        """A conservative limit for the dblp.org APIs (2 requests/sec), which do not publish a limit."""
+        return cls(2., **{'burst': 5., **kwargs})
+
+    @classmethod
+    def google_cse(cls, **kwargs) -> 'RateLimiter':
+        """The published Google Custom Search JSON API limit: 100 queries/min per user."""
+        return cls(100 / 60, **{'burst': 10., **kwargs})
+
+    def _take_token(self) -> float:
+        # Takes a token if available, otherwise returns the number of seconds to wait before trying again
+        with self._lock, self._bucket() as state:
+            tokens, last, paused_until = state
+            now = time.time()
+            tokens = min(self.burst, tokens + max(now - last, 0.) * self.rate)
+            if now >= paused_until and tokens >= 1.:
+                self._save((tokens - 1., now, paused_until))
+                return 0.
+            self._save((tokens, now, paused_until))
+            return max(paused_until - now, (1. - tokens) / self.rate)
+
+    async def _async_take_token(self) -> float:
+        if self.path is None:
+            return self._take_token() # only holds the in-process lock for the bucket arithmetic
+        return await asyncio.get_running_loop().run_in_executor(None, self._take_token) # may block on the file lock
+
+    @contextmanager
+    def _bucket(self):
+        if self.path is None:
+            yield self._state
+            return
+        import fcntl
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            data = os.pread(fd, 24, 0)
+            self._fd = fd
+            yield struct.unpack('ddd', data) if len(data) == 24 else (float(self.burst), time.time(), 0.)
+        finally:
+            self._fd = None
+            os.close(fd) # also releases the lock
+
+    def _save(self, state) -> None:
+        if self.path is None:
+            self._state = state
+        else:
+            os.pwrite(self._fd, struct.pack('ddd', *state), 0)
+
+    def pause(self, seconds: float) -> None:
+        """Stops all requests (across every thread and process sharing the bucket) for the given number of seconds."""
+        with self._lock, self._bucket() as state:
+            tokens, last, paused_until = state
+            self._save((tokens, last, max(paused_until, time.time() + seconds)))
+
+    def _try_enter(self) -> bool:
+        if self._in_flight < max(int(self.concurrency), self.min_concurrency):
+            self._in_flight += 1
+            return True
+        return False
+
+    def _exit(self, permit: _Permit) -> None:
+        with self._cond:
+            self._in_flight -= 1
+            self.requests += 1
+            if permit.throttled:
+                self.throttled += 1
+                self.concurrency = max(float(self.min_concurrency), self.concurrency * self.decrease)
+            else:
+                self.concurrency = min(float(self.max_concurrency), self.concurrency + 1. / self.concurrency)
+            self._cond.notify_all()
+            waiters, self._async_waiters = self._async_waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_wake, future)
+
+    @contextmanager
+    def limit(self):
+        """Blocks until a request may be issued. Use the yielded permit to record the response status.
+
+        Example::
+
+            with limiter.limit() as permit:
+                res = requests.get(url)
+                permit.observe(res.status_code, res.headers)
+        """
+        with self._cond:
+            while not self._try_enter():
+                self._cond.wait()
+        permit = _Permit()
+        try:
+            wait = self._take_token()
+            while wait > 0:
+                time.sleep(wait)
+                wait = self._take_token()
+            yield permit
+        finally:
+            self._exit(permit)
+            if permit.retry_after:
+                self.pause(permit.retry_after)
+
+    @asynccontextmanager
+    async def async_limit(self):
+        """Async version of :meth:`limit`.
+
+        Waiting for a slot does not block the event loop. When the bucket is kept in a file, the file lock is taken in
+        the loop's default executor, so that a slow holder in another process does not stall the loop either.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._cond:
+                if self._try_enter():
+                    break
+                future = loop.create_future()
+                self._async_waiters.append((loop, future))
+            await future
+        permit = _Permit()
+        try:
+            wait = await self._async_take_token()
+            while wait > 0:
+                await asyncio.sleep(wait)
+                wait = await self._async_take_token()
+            yield permit
+        finally:
+            self._exit(permit)
+            if permit.retry_after:
+                if self.path is None:
+                    self.pause(permit.retry_after)
+                else:
+                    await loop.run_in_executor(None, self.pause, permit.retry_after)
+
+    def stats(self) -> Dict[str, float]:
+        """Returns the number of requests issued and throttled, and the current concurrency limit."""
+        return {'requests': self.requests, 'throttled': self.throttled, 'concurrency': int(self.concurrency)}
+
+    def __repr__(self):
+        return f'RateLimiter({self.rate!r}, burst={self.burst!r})'
@@ -0,0 +1,306 @@
+import asyncio
+import json
+import threading
+import time
+from collections import deque
+from queue import SimpleQueue
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Optional
+import numpy as np
+
+
+class CircuitOpenError(Exception):
+    """Raised when a request is rejected because the circuit for its endpoint is open."""
+
+
+class CircuitBreaker:
+    """A per-endpoint circuit breaker that fails fast after repeated failures.
+
+    After ``failure_threshold`` consecutive failures on an endpoint, the circuit opens and further requests to the
+    endpoint raise :class:`CircuitOpenError` without being sent. Once ``reset_timeout`` seconds have passed, a single
+    trial request is let through: the circuit closes again if it succeeds, and re-opens if it fails.
+
+    With :func:`~pyterrier_services.http_error_retry`, only 5xx responses, timeouts and connection errors count as
+    failures. Other client errors (e.g., a 404 for an unknown id) count as successes, and 429 responses are ignored.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.):
+        """
+        Args:
+            failure_threshold: The number of consecutive failures that open the circuit. Defaults to 5.
+            reset_timeout: The number of seconds to wait before letting a trial request through. Defaults to 30.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.opened = 0
+        self.rejected = 0
+        self._failures = {}
+        self._opened_at = {}
+        self._trial = set()
+        self._lock = threading.Lock()
+
+    def check(self, endpoint: str) -> None:
+        """Raises :class:`CircuitOpenError` if requests to ``endpoint`` should not be sent right now."""
+        with self._lock:
+            opened_at = self._opened_at.get(endpoint)
+            if opened_at is None:
+                return
+            if time.monotonic() - opened_at >= self.reset_timeout and endpoint not in self._trial:
+                self._trial.add(endpoint) # half-open: let a single request through
+                return
+            self.rejected += 1
+        raise CircuitOpenError(f'circuit open for {endpoint!r} after {self.failure_threshold} consecutive failures')
+
+    def record_success(self, endpoint: str) -> None:
+        with self._lock:
+            self._failures.pop(endpoint, None)
+            self._opened_at.pop(endpoint, None)
+            self._trial.discard(endpoint)
+
+    def record_failure(self, endpoint: str) -> None:
+        with self._lock:
+            self._failures[endpoint] = self._failures.get(endpoint, 0) + 1
+            if endpoint in self._trial or (endpoint not in self._opened_at and self._failures[endpoint] >= self.failure_threshold):
+                self._opened_at[endpoint] = time.monotonic()
+                self._trial.discard(endpoint)
+                self.opened += 1
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the number of times a circuit opened, the number of rejected requests and the open circuits."""
+        with self._lock:
+            return {'opened': self.opened, 'rejected': self.rejected, 'open': len(self._opened_at)}
+
+    def __repr__(self):
+        return f'CircuitBreaker(failure_threshold={self.failure_threshold!r}, reset_timeout={self.reset_timeout!r})'
+
+
+class HedgePolicy:
+    """Sends a duplicate (hedged) request when the original is slower than usual, and takes whichever finishes first.
+
+    A request is hedged once it has been running longer than the ``percentile`` of the latencies of the last ``window``
+    requests. No hedging happens until ``min_samples`` latencies have been observed.
+    """
+
+    def __init__(self,
+        percentile: float = 95.,
+        *,
+        min_samples: int = 20,
+        window: int = 200,
+        max_workers: int = 16,
+    ):
+        """
+        Args:
+            percentile: The latency percentile after which a duplicate request is sent. Defaults to 95.
+            min_samples: The number of observed latencies needed before hedging. Defaults to 20.
+            window: The number of recent latencies considered. Defaults to 200.
+            max_workers: The size of the thread pool used to run (synchronous) requests. Each call to :meth:`run` uses
+                up to two workers, so this should be twice the number of threads calling :meth:`run` at once (e.g.,
+                the ``max_workers`` of the transformers using this policy). Defaults to 16.
+        """
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.max_workers = max_workers
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def _get_pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='hedge')
+            return self._pool
+
+    def close(self) -> None:
+        """Shuts down the thread pool (without waiting for the slower attempts still running). The pool is re-created
+        if the policy is used again."""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+    def delay(self) -> Optional[float]:
+        """Returns the number of seconds after which a request is hedged, or None if not enough latencies are known."""
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            return float(np.percentile(self._latencies, self.percentile))
+
+    def _observe(self, latency: float, hedged: bool, hedge_won: bool) -> None:
+        with self._lock:
+            self._latencies.append(latency)
+            self.requests += 1
+            self.hedged += int(hedged)
+            self.hedge_wins += int(hedge_won)
+
+    def _timed(self, fn, args, kwargs, started=None):
+        start = time.monotonic()
+        if started is not None:
+            started.put(start)
+        res = fn(*args, **kwargs)
+        return res, time.monotonic() - start
+
+    def run(self, fn, *args, **kwargs):
+        """Calls ``fn(*args, **kwargs)``, hedging it with a second call if it is slow."""
+        delay = self.delay()
+        if delay is None:
+            res, latency = self._timed(fn, args, kwargs)
+            self._observe(latency, False, False)
+            return res
+        pool = self._get_pool()
+        started = SimpleQueue()
+        original = pool.submit(self._timed, fn, args, kwargs, started)
+        start = started.get() # the delay counts from when the original starts, not from when it was queued
+        done, _ = wait([original], timeout=max(start + delay - time.monotonic(), 0.))
+        if done:
+            res, latency = original.result()
+            self._observe(latency, False, False)
+            return res
+        hedge = pool.submit(self._timed, fn, args, kwargs)
+        pending = {original, hedge}
+        while True:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in sorted(done, key=lambda f: f.exception() is not None):
+                if future.exception() is None or not pending:
+                    self._observe(time.monotonic() - start, True, future is hedge)
+                    return future.result()[0] # raises if both attempts failed
+
+    async def async_run(self, fn, *args, **kwargs):
+        """Async version of :meth:`run`, where ``fn`` is a coroutine function. The slower attempt is cancelled."""
+        delay = self.delay()
+        start = time.monotonic()
+        original = asyncio.ensure_future(fn(*args, **kwargs))
+        done, _ = await asyncio.wait({original}, timeout=delay)
+        if done:
+            self._observe(time.monotonic() - start, False, False)
+            return original.result()
+        hedge = asyncio.ensure_future(fn(*args, **kwargs))
+        pending = {original, hedge}
+        try:
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in sorted(done, key=lambda t: t.exception() is not None):
+                    if task.exception() is None or not pending:
+                        self._observe(time.monotonic() - start, True, task is hedge)
+                        return task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the number of requests, how many were hedged, and how many times the hedge finished first."""
+        with self._lock:
+            return {'requests': self.requests, 'hedged': self.hedged, 'hedge_wins': self.hedge_wins}
+
+    def __repr__(self):
+        return f'HedgePolicy({self.percentile!r})'
+
+
+class _Flight:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces identical calls that are in flight at the same time into a single call.
+
+    The first call for a key runs; calls for the same key made while it is running wait for it and receive its result
+    (or exception) instead of running themselves. Nothing is kept once a call finishes, so this only saves requests
+    that overlap in time (e.g., the same query under several qids, or overlapping pipelines), without a cache.
+    A :class:`SingleFlight` can be shared by several threads and API objects.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def run(self, key: Any, fn: Callable, *args, **kwargs) -> Any:
+        """Calls ``fn(*args, **kwargs)``, unless a call with the same ``key`` is already running (in which case, waits for
+        it and returns its result)."""
+        with self._lock:
+            self.calls += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self.coalesced += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = fn(*args, **kwargs)
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    async def async_run(self, key: Any, fn: Callable, *args, **kwargs) -> Any:
+        """Async version of :meth:`run`, where ``fn`` is a coroutine function. Only calls on the same event loop are
+        coalesced."""
+        loop = asyncio.get_running_loop()
+        key = (loop, key)
+        with self._lock:
+            self.calls += 1
+            future = self._flights.get(key)
+            leader = future is None
+            if leader:
+                future = self._flights[key] = loop.create_future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            return await asyncio.shield(future)
+        try:
+            res = await fn(*args, **kwargs)
+            future.set_result(res)
+            return res
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception() # retrieved here, so that it is not reported when no other call was waiting
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+
+    @staticmethod
+    def key(name: Any, *args, **kwargs) -> str:
+        """Returns the key of a call to ``name`` with the provided arguments."""
+        return json.dumps([name, args, sorted(kwargs.items())], default=str)
+
+    def wrap(self, fn: Callable, name: Any) -> Callable:
+        """Wraps ``fn`` so that concurrent calls with the same arguments are coalesced. ``name`` identifies ``fn``
+        (including any arguments already bound to it) in the keys."""
+        def wrapped(*args, **kwargs):
+            return self.run(self.key(name, *args, **kwargs), fn, *args, **kwargs)
+        return wrapped
+
+    def async_wrap(self, fn: Callable, name: Any) -> Callable:
+        """Async version of :meth:`wrap`, for wrapping coroutine functions."""
+        async def wrapped(*args, **kwargs):
+            return await self.async_run(self.key(name, *args, **kwargs), fn, *args, **kwargs)
+        return wrapped
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the number of calls, and how many of them were coalesced into a call already in flight."""
+        with self._lock:
+            return {'calls': self.calls, 'coalesced': self.coalesced}
+
+    def __repr__(self):
+        return 'SingleFlight()'
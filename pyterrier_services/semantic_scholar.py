@@ -1,27 +1,69 @@
 import os
-from typing import List, Optional, Union, Tuple
+import asyncio
+from typing import Any, Dict, List, Optional, Union, Tuple
 from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
-import requests
 import pyterrier as pt
-from . import http_error_retry, paginated_search, multi_query
+import pyterrier_alpha as pta
+from .core import http_error_retry, paginated_search, multi_query, multi_query_iter, _take_factorized
+from .core import async_http_error_retry, async_paginated_search, async_multi_query
+from .cache import ResponseCache
+from .transport import HttpTransport, json_loads
+from .ratelimit import RateLimiter
+from .resilience import HedgePolicy, CircuitBreaker, SingleFlight
+from .metrics import Metrics
 
 class SemanticScholarApi:
     """Represents a reference to the Semantic Scholar search API."""
     API_BASE_URL = 'https://api.semanticscholar.org/graph/v1'
+    DEFAULT_MAX_WORKERS = 1 # S2 allows 1 request/sec with a key, and 100 requests/5min without (see RateLimiter.semantic_scholar)
+    MAX_PAGE_SIZE = 100
+    MAX_SEARCH_RESULTS = 1000 # /paper/search only serves the first 1,000 results of a query
+    MAX_BATCH_SIZE = 500 # the maximum number of IDs per /paper/batch request
 
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(self,
+        api_key: Optional[str] = None,
+        *,
+        cache: Optional[ResponseCache] = None,
+        transport: Optional[HttpTransport] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        hedge: Optional[HedgePolicy] = None,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        single_flight: Optional[SingleFlight] = None,
+        metrics: Optional[Metrics] = None,
+    ):
         """
         Args:
             api_key: The API key for Semantic Scholar. If not provided, it will fall back on using the value from the ``S2_API_KEY`` env variable, and if that is not available, the API will be used without authentication.
+            cache: A cache for API responses. Defaults to None (no caching).
+            transport: The HTTP transport to send requests over. Defaults to a new instance of :class:`~pyterrier_services.HttpTransport`.
+            rate_limiter: The client-side rate limiter for requests. Defaults to ``RateLimiter.semantic_scholar(keyed=...)``.
+            hedge: A policy for hedging slow requests. Defaults to None (no hedging).
+            circuit_breaker: A circuit breaker that fails fast on endpoints that keep failing. Defaults to None.
+            single_flight: Coalesces identical requests that are in flight at the same time. Defaults to a new instance of :class:`~pyterrier_services.SingleFlight`.
+            metrics: The metrics to record requests and timings to. Defaults to a new instance of :class:`~pyterrier_services.Metrics`.
         """
         self.api_key = api_key or os.environ.get('S2_API_KEY')
+        self.cache = cache
+        self.transport = transport or HttpTransport()
+        self.rate_limiter = rate_limiter or RateLimiter.semantic_scholar(keyed=self.api_key is not None)
+        self.hedge = hedge
+        self.circuit_breaker = circuit_breaker
+        self.single_flight = single_flight or SingleFlight()
+        self.metrics = metrics or Metrics()
 
     def retriever(self,
         *,
         num_results: int = 100,
         fields: List[str] = ['title', 'abstract'],
-        verbose: bool = True
+        verbose: bool = True,
+        max_workers: Optional[int] = None,
+        page_workers: int = 1,
+        bulk: Optional[bool] = None,
+        sort: Optional[str] = None,
+        filters: Optional[Dict[str, Any]] = None,
     ) -> pt.Transformer:
         """Returns a :class:`~pyterrier.Transformer` that retrieves articles from Semantic Scholar.
 
@@ -29,8 +71,28 @@ class SemanticScholarApi:
             num_results: The number of results to retrieve. Defaults to 100.
             fields: The fields to include in the retrieved results. Defaults to ['title', 'abstract'].
             verbose: Whether to log the progress. Defaults to True.
+            max_workers: The number of queries to run concurrently. Defaults to ``SemanticScholarApi.DEFAULT_MAX_WORKERS``.
+            page_workers: The number of result pages of a query to fetch concurrently. Defaults to 1 (one after another).
+            bulk: Whether to use the bulk search endpoint (see :meth:`bulk_search`). Defaults to None (only when ``num_results`` exceeds ``MAX_SEARCH_RESULTS`` or a ``sort`` is given).
+            sort: The order of bulk search results (e.g., ``'citationCount:desc'``); cannot be combined with ``bulk=False``. Defaults to None.
+            filters: Additional filter parameters (e.g., ``{'year': '2020-', 'minCitationCount': 10}``). Defaults to None.
+        """
+        return SemanticScholarRetriever(api=self, num_results=num_results, fields=fields, verbose=verbose, max_workers=max_workers, page_workers=page_workers, bulk=bulk, sort=sort, filters=filters)
+
+    def loader(self,
+        *,
+        fields: List[str] = ['title', 'abstract'],
+        verbose: bool = True,
+        max_workers: Optional[int] = None,
+    ) -> pt.Transformer:
+        """Returns a :class:`~pyterrier.Transformer` that loads paper details from Semantic Scholar by ``docno``.
+
+        Args:
+            fields: The fields to load. Defaults to ['title', 'abstract'].
+            verbose: Whether to log the progress. Defaults to True.
+            max_workers: The number of batch requests to run concurrently. Defaults to ``SemanticScholarApi.DEFAULT_MAX_WORKERS``.
         """
-        return SemanticScholarRetriever(api=self, num_results=num_results, fields=fields, verbose=verbose)
+        return SemanticScholarLoader(api=self, fields=fields, verbose=verbose, max_workers=max_workers)
 
     def search(self,
         query: str,
@@ -38,6 +100,7 @@ class SemanticScholarApi:
         offset: int = 0,
         limit: int = 100,
         fields: List[str] = ['title', 'abstract'],
+        filters: Optional[Dict[str, Any]] = None,
         return_next: bool = False,
         return_total: bool = False
     ) -> Union[pd.DataFrame, Tuple[pd.DataFrame, int], Tuple[pd.DataFrame, int, int]]:
@@ -48,27 +111,244 @@ class SemanticScholarApi:
             offset: The offset of the first result to retrieve. Defaults to 0.
             limit: The maximum number of results to retrieve. Defaults to 100.
             fields: The fields to include in the retrieved results. Defaults to ['title', 'abstract'].
+            filters: Additional filter parameters (e.g., ``year``, ``venue``, ``fieldsOfStudy`` or ``minCitationCount``). Defaults to None.
             return_next: Whether to return the next query URL. Defaults to False.
             return_total: Whether to return the total number of results. Defaults to False.
         """
+        endpoint, params, headers = self._search_request(query, offset=offset, limit=limit, fields=fields, filters=filters)
+        http_res = self._get(endpoint, params=params, headers=headers)
+        with self.metrics.timer('parse'):
+            return self._parse_search(http_res, fields=fields, return_next=return_next, return_total=return_total)
+
+    async def async_search(self,
+        query: str,
+        *,
+        offset: int = 0,
+        limit: int = 100,
+        fields: List[str] = ['title', 'abstract'],
+        filters: Optional[Dict[str, Any]] = None,
+        return_next: bool = False,
+        return_total: bool = False
+    ) -> Union[pd.DataFrame, Tuple[pd.DataFrame, int], Tuple[pd.DataFrame, int, int]]:
+        """Async version of :meth:`search`. Requires the ``httpx`` package."""
+        endpoint, params, headers = self._search_request(query, offset=offset, limit=limit, fields=fields, filters=filters)
+        http_res = await self._async_get(endpoint, params=params, headers=headers)
+        with self.metrics.timer('parse'):
+            return self._parse_search(http_res, fields=fields, return_next=return_next, return_total=return_total)
+
+    def bulk_search(self,
+        query: str,
+        *,
+        token: Optional[str] = None,
+        limit: int = 1000,
+        fields: List[str] = ['title', 'abstract'],
+        sort: Optional[str] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        return_next: bool = False,
+        return_total: bool = False
+    ) -> Union[pd.DataFrame, Tuple[pd.DataFrame, Optional[str]], Tuple[pd.DataFrame, Optional[str], int]]:
+        """Searches for papers with the bulk search endpoint.
+
+        Unlike :meth:`search`, bulk search is not limited to the first 1,000 results, returns up to 1,000 results per
+        page (linked by continuation tokens), and supports boolean query syntax and sorting. However, results are not
+        ranked by relevance: they are in the order given by ``sort``, or in no particular order. The ranks of each page
+        start at 0.
+
+        Args:
+            query: The search query.
+            token: The continuation token of the page to retrieve (from ``return_next``). Defaults to None (the first page).
+            limit: The maximum number of results to return from the page. Defaults to 1000.
+            fields: The fields to include in the retrieved results. Defaults to ['title', 'abstract'].
+            sort: The field and direction to sort by (e.g., ``'citationCount:desc'`` or ``'publicationDate:asc'``). Defaults to None.
+            filters: Additional filter parameters (e.g., ``year``, ``venue``, ``fieldsOfStudy`` or ``minCitationCount``). Defaults to None.
+            return_next: Whether to return the continuation token of the next page (None after the last page). Defaults to False.
+            return_total: Whether to return the total number of results. Defaults to False.
+        """
+        endpoint, params, headers = self._bulk_search_request(query, token=token, fields=fields, sort=sort, filters=filters)
+        http_res = self._get(endpoint, params=params, headers=headers)
+        with self.metrics.timer('parse'):
+            return self._parse_bulk_search(http_res, limit=limit, fields=fields, return_next=return_next, return_total=return_total)
+
+    async def async_bulk_search(self,
+        query: str,
+        *,
+        token: Optional[str] = None,
+        limit: int = 1000,
+        fields: List[str] = ['title', 'abstract'],
+        sort: Optional[str] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        return_next: bool = False,
+        return_total: bool = False
+    ) -> Union[pd.DataFrame, Tuple[pd.DataFrame, Optional[str]], Tuple[pd.DataFrame, Optional[str], int]]:
+        """Async version of :meth:`bulk_search`. Requires the ``httpx`` package."""
+        endpoint, params, headers = self._bulk_search_request(query, token=token, fields=fields, sort=sort, filters=filters)
+        http_res = await self._async_get(endpoint, params=params, headers=headers)
+        with self.metrics.timer('parse'):
+            return self._parse_bulk_search(http_res, limit=limit, fields=fields, return_next=return_next, return_total=return_total)
+
+    def batch(self,
+        docnos: List[str],
+        *,
+        fields: List[str] = ['title', 'abstract'],
+        max_workers: Optional[int] = None,
+        verbose: bool = False,
+    ) -> pd.DataFrame:
+        """Loads the details of papers using the paper batch endpoint.
+
+        The IDs are sent in chunks of up to ``MAX_BATCH_SIZE``, with up to ``max_workers`` requests in flight at once.
+
+        Args:
+            docnos: The IDs of the papers: Semantic Scholar paper IDs, or prefixed external IDs (e.g., ``DOI:...``).
+            fields: The fields to load. Defaults to ['title', 'abstract'].
+            max_workers: The number of requests to run concurrently. Defaults to ``SemanticScholarApi.DEFAULT_MAX_WORKERS``.
+            verbose: Whether to log the progress. Defaults to False.
+
+        Returns:
+            A DataFrame with a row for each ID (in order), with a ``docno`` column and a column for each (top-level)
+            field. Fields are None for papers that were not found.
+        """
+        chunks = [docnos[i:i+self.MAX_BATCH_SIZE] for i in range(0, len(docnos), self.MAX_BATCH_SIZE)]
+        load = http_error_retry(
+            partial(self._batch_chunk, fields=fields),
+            hedge=self.hedge,
+            circuit_breaker=self.circuit_breaker,
+            endpoint='semantic_scholar/paper/batch',
+            metrics=self.metrics,
+            rate_limiter=self.rate_limiter,
+        )
+        with ThreadPoolExecutor(max_workers=max(max_workers or self.DEFAULT_MAX_WORKERS, 1)) as pool:
+            it = pool.map(load, chunks) # map preserves the chunk order
+            if verbose:
+                it = pt.tqdm(it, desc='SemanticScholarApi.batch', unit='batch', total=len(chunks))
+            papers = [paper for chunk in it for paper in chunk]
+        with self.metrics.timer('parse'):
+            return self._parse_batch(docnos, papers, fields=fields)
+
+    async def async_batch(self,
+        docnos: List[str],
+        *,
+        fields: List[str] = ['title', 'abstract'],
+    ) -> pd.DataFrame:
+        """Async version of :meth:`batch`, which sends all the chunks at once (paced by the rate limiter)."""
+        chunks = [docnos[i:i+self.MAX_BATCH_SIZE] for i in range(0, len(docnos), self.MAX_BATCH_SIZE)]
+        load = async_http_error_retry(
+            partial(self._async_batch_chunk, fields=fields),
+            hedge=self.hedge,
+            circuit_breaker=self.circuit_breaker,
+            endpoint='semantic_scholar/paper/batch',
+            metrics=self.metrics,
+            rate_limiter=self.rate_limiter,
+        )
+        results = await asyncio.gather(*[load(chunk) for chunk in chunks])
+        with self.metrics.timer('parse'):
+            return self._parse_batch(docnos, [paper for chunk in results for paper in chunk], fields=fields)
+
+    def _batch_chunk(self, docnos, *, fields):
+        endpoint, params, body, headers = self._batch_request(docnos, fields=fields)
+        return self._post(endpoint, params=params, body=body, headers=headers)
+
+    async def _async_batch_chunk(self, docnos, *, fields):
+        endpoint, params, body, headers = self._batch_request(docnos, fields=fields)
+        return await self._async_post(endpoint, params=params, body=body, headers=headers)
+
+    async def aclose(self):
+        """Closes the async HTTP client used by the running event loop."""
+        await self.transport.aclose()
+
+    def _get(self, endpoint, *, params, headers):
+        name = 'semantic_scholar' + endpoint
+        def fetch():
+            with self.rate_limiter.limit() as permit, self.metrics.request(name) as req:
+                http_res = self.transport.get(SemanticScholarApi.API_BASE_URL + endpoint, params=params, headers=headers)
+                req.observe(http_res.status_code, len(http_res.content))
+                permit.observe(http_res.status_code, http_res.headers)
+            http_res.raise_for_status()
+            with self.metrics.timer('decode'):
+                return json_loads(http_res.content)
+        return self.metrics.get_or_fetch(self.cache, name, 'semantic_scholar', endpoint, params, fetch)
+
+    async def _async_get(self, endpoint, *, params, headers):
+        name = 'semantic_scholar' + endpoint
+        async def fetch():
+            async with self.rate_limiter.async_limit() as permit:
+                with self.metrics.request(name) as req:
+                    http_res = await self.transport.async_get(SemanticScholarApi.API_BASE_URL + endpoint, params=params, headers=headers)
+                    req.observe(http_res.status_code, len(http_res.content))
+                permit.observe(http_res.status_code, http_res.headers)
+            http_res.raise_for_status()
+            with self.metrics.timer('decode'):
+                return json_loads(http_res.content)
+        return await self.metrics.async_get_or_fetch(self.cache, name, 'semantic_scholar', endpoint, params, fetch)
+
+    def _post(self, endpoint, *, params, body, headers):
+        name = 'semantic_scholar' + endpoint
+        def fetch():
+            with self.rate_limiter.limit() as permit, self.metrics.request(name) as req:
+                http_res = self.transport.post(SemanticScholarApi.API_BASE_URL + endpoint, params=params, json=body, headers=headers)
+                req.observe(http_res.status_code, len(http_res.content))
+                permit.observe(http_res.status_code, http_res.headers)
+            http_res.raise_for_status()
+            with self.metrics.timer('decode'):
+                return json_loads(http_res.content)
+        return self.metrics.get_or_fetch(self.cache, name, 'semantic_scholar', endpoint, {**params, **body}, fetch)
+
+    async def _async_post(self, endpoint, *, params, body, headers):
+        name = 'semantic_scholar' + endpoint
+        async def fetch():
+            async with self.rate_limiter.async_limit() as permit:
+                with self.metrics.request(name) as req:
+                    http_res = await self.transport.async_post(SemanticScholarApi.API_BASE_URL + endpoint, params=params, json=body, headers=headers)
+                    req.observe(http_res.status_code, len(http_res.content))
+                permit.observe(http_res.status_code, http_res.headers)
+            http_res.raise_for_status()
+            with self.metrics.timer('decode'):
+                return json_loads(http_res.content)
+        return await self.metrics.async_get_or_fetch(self.cache, name, 'semantic_scholar', endpoint, {**params, **body}, fetch)
+
+    def _search_request(self, query, *, offset, limit, fields, filters=None):
         params = {
             'query': query,
             'offset': offset,
             'fields': ','.join(fields),
-            'limit': max(min(limit, 100), 1),
+            'limit': max(min(limit, self.MAX_PAGE_SIZE), 1),
+            **(filters or {}),
+        }
+        headers = {'x-api-key': self.api_key} if self.api_key else {}
+        return '/paper/search', params, headers
+
+    def _bulk_search_request(self, query, *, token, fields, sort, filters):
+        params = {
+            'query': query,
+            'fields': ','.join(fields),
+            'token': token,
+            'sort': sort,
+            **(filters or {}),
         }
         headers = {'x-api-key': self.api_key} if self.api_key else {}
-        http_res = requests.get(SemanticScholarApi.API_BASE_URL + '/paper/search', params=params, headers=headers)
-        http_res.raise_for_status()
-        http_res = http_res.json()
+        return '/paper/search/bulk', {k: v for k, v in params.items() if v is not None}, headers
+
+    def _batch_request(self, docnos, *, fields):
+        headers = {'x-api-key': self.api_key} if self.api_key else {}
+        return '/paper/batch', {'fields': ','.join(fields)}, {'ids': list(docnos)}, headers
+
+    def _parse_batch(self, docnos, papers, *, fields):
+        columns = list(dict.fromkeys(f.split('.')[0] for f in fields)) # e.g., authors.name is returned under authors
+        rows = [[docno, *[(paper or {}).get(c) for c in columns]] for docno, paper in zip(docnos, papers)]
+        return pd.DataFrame(rows, columns=['docno', *columns])
+
+    def _parse_bulk_search(self, http_res, *, limit, fields, return_next, return_total):
+        data = (http_res.get('data') or [])[:max(limit, 0)]
+        return self._parse_search({**http_res, 'data': data, 'offset': 0, 'next': http_res.get('token')}, fields=fields, return_next=return_next, return_total=return_total)
 
-        if len(http_res['data']) == 0:
+    def _parse_search(self, http_res, *, fields, return_next, return_total):
+        data = http_res['data']
+        if len(data) == 0:
             result_df = pd.DataFrame(columns=['docno', *[str(f) for f in fields], 'rank', 'score'])
         else:
-            result_df = pd.DataFrame(http_res['data'])
-            result_df.rename(columns={'paperId': 'docno'}, inplace=True)
-            result_df['rank'] = range(http_res['offset'], http_res['offset']+len(result_df))
-            result_df['score'] = -result_df['rank']
+            keys = dict.fromkeys(k for paper in data for k in paper) # in order of first appearance
+            columns = {('docno' if k == 'paperId' else k): [paper.get(k) for paper in data] for k in keys}
+            ranks = np.arange(http_res['offset'], http_res['offset'] + len(data))
+            result_df = pd.DataFrame({**columns, 'rank': ranks, 'score': -ranks})
 
         res = [result_df]
         if return_next:
@@ -81,13 +361,23 @@ class SemanticScholarApi:
 
 
 class SemanticScholarRetriever(pt.Transformer):
-    """A :class:`~pyterrier.Transformer` retriever that queries the Semantic Scholar search API."""
+    """A :class:`~pyterrier.Transformer` retriever that queries the Semantic Scholar search API.
+
+    Queries are run against the relevance search endpoint, or against the bulk search endpoint (see
+    :meth:`SemanticScholarApi.bulk_search`) when more than ``api.MAX_SEARCH_RESULTS`` results or a ``sort`` order are
+    requested.
+    """
     def __init__(self,
         *,
         api: Optional[SemanticScholarApi] = None,
         num_results: int = 100,
         fields: List[str] = ['title', 'abstract'],
-        verbose: bool = True
+        verbose: bool = True,
+        max_workers: Optional[int] = None,
+        page_workers: int = 1,
+        bulk: Optional[bool] = None,
+        sort: Optional[str] = None,
+        filters: Optional[Dict[str, Any]] = None,
     ):
         """
         Args:
@@ -95,24 +385,145 @@ class SemanticScholarRetriever(pt.Transformer):
             num_results: The number of results to retrieve per query. Defaults to 100.
             fields: The fields to include in the retrieved results. Defaults to ['title', 'abstract'].
             verbose: Whether to log the progress. Defaults to True.
+            max_workers: The number of queries to run concurrently. Defaults to ``api.DEFAULT_MAX_WORKERS``.
+            page_workers: The number of result pages of a query to fetch concurrently (not used by bulk search). Defaults to 1 (one after another).
+            bulk: Whether to use the bulk search endpoint. Defaults to None (only when ``num_results`` exceeds ``api.MAX_SEARCH_RESULTS`` or a ``sort`` is given).
+            sort: The order of bulk search results (e.g., ``'citationCount:desc'``); only supported by bulk search, so it
+                cannot be combined with ``bulk=False``. Defaults to None.
+            filters: Additional filter parameters (e.g., ``{'year': '2020-', 'minCitationCount': 10}``). Defaults to None.
         """
+        if sort is not None and bulk is False:
+            raise ValueError('sort is only supported by bulk search; it cannot be used with bulk=False')
         self.api = api or SemanticScholarApi()
         self.num_results = num_results
         self.fields = fields
         self.verbose = verbose
+        self.max_workers = max_workers or self.api.DEFAULT_MAX_WORKERS
+        self.page_workers = page_workers
+        self.bulk = bulk if bulk is not None else (num_results > self.api.MAX_SEARCH_RESULTS or sort is not None)
+        self.sort = sort
+        self.filters = filters
 
-    def transform(self, inp: pd.DataFrame) -> pd.DataFrame:
-        return multi_query(
-            paginated_search(
-                http_error_retry(
-                    partial(self.api.search, fields=self.fields)
-                ),
+    def _search_fn(self):
+        if self.bulk:
+            return paginated_search(
+                self.api.single_flight.wrap(http_error_retry(
+                    partial(self.api.bulk_search, fields=self.fields, sort=self.sort, filters=self.filters),
+                    hedge=self.api.hedge,
+                    circuit_breaker=self.api.circuit_breaker,
+                    endpoint='semantic_scholar/paper/search/bulk',
+                    metrics=self.api.metrics,
+                    rate_limiter=self.api.rate_limiter,
+                ), ('semantic_scholar/paper/search/bulk', self.fields, self.sort, self.filters)),
                 num_results=self.num_results,
-            ),
+                token=True,
+            )
+        return paginated_search(
+            self.api.single_flight.wrap(http_error_retry(
+                partial(self.api.search, fields=self.fields, filters=self.filters),
+                hedge=self.api.hedge,
+                circuit_breaker=self.api.circuit_breaker,
+                endpoint='semantic_scholar/paper/search',
+                metrics=self.api.metrics,
+                rate_limiter=self.api.rate_limiter,
+            ), ('semantic_scholar/paper/search', self.fields, self.filters)),
+            num_results=self.num_results,
+            page_size=self.api.MAX_PAGE_SIZE,
+            max_workers=self.page_workers,
+        )
+
+    def _async_search_fn(self):
+        if self.bulk:
+            return async_paginated_search(
+                self.api.single_flight.async_wrap(async_http_error_retry(
+                    partial(self.api.async_bulk_search, fields=self.fields, sort=self.sort, filters=self.filters),
+                    hedge=self.api.hedge,
+                    circuit_breaker=self.api.circuit_breaker,
+                    endpoint='semantic_scholar/paper/search/bulk',
+                    metrics=self.api.metrics,
+                    rate_limiter=self.api.rate_limiter,
+                ), ('semantic_scholar/paper/search/bulk', self.fields, self.sort, self.filters)),
+                num_results=self.num_results,
+                token=True,
+            )
+        return async_paginated_search(
+            self.api.single_flight.async_wrap(async_http_error_retry(
+                partial(self.api.async_search, fields=self.fields, filters=self.filters),
+                hedge=self.api.hedge,
+                circuit_breaker=self.api.circuit_breaker,
+                endpoint='semantic_scholar/paper/search',
+                metrics=self.api.metrics,
+                rate_limiter=self.api.rate_limiter,
+            ), ('semantic_scholar/paper/search', self.fields, self.filters)),
+            num_results=self.num_results,
+            page_size=self.api.MAX_PAGE_SIZE,
+            max_workers=self.page_workers,
+        )
+
+    def transform(self, inp: pd.DataFrame) -> pd.DataFrame:
+        with self.api.metrics.call('SemanticScholarRetriever'):
+            return multi_query(
+                self._search_fn(),
+                verbose=self.verbose,
+                verbose_desc='SemanticScholarRetriever',
+                max_workers=self.max_workers,
+                metrics=self.api.metrics,
+            )(inp)
+
+    def transform_iter(self, inp: pt.model.IterDict) -> pt.model.IterDict:
+        """Streaming version of :meth:`transform`, which yields the results of each query as soon as they arrive."""
+        return self.api.metrics.call_iter('SemanticScholarRetriever', multi_query_iter(
+            self._search_fn(),
             verbose=self.verbose,
             verbose_desc='SemanticScholarRetriever',
-        )(inp)
+            max_workers=self.max_workers,
+        )(inp))
+
+    async def async_transform(self, inp: pd.DataFrame) -> pd.DataFrame:
+        """Async version of :meth:`transform`, which runs the queries on the current event loop."""
+        with self.api.metrics.call('SemanticScholarRetriever'):
+            return await async_multi_query(
+                self._async_search_fn(),
+                verbose=self.verbose,
+                verbose_desc='SemanticScholarRetriever',
+                max_concurrency=self.max_workers,
+                metrics=self.api.metrics,
+            )(inp)
 
     def fuse_rank_cutoff(self, k: int) -> Optional['SemanticScholarRetriever']:
         if k < self.num_results:
-            return SemanticScholarRetriever(api=self.api, num_results=k, fields=self.fields, verbose=self.verbose)
+            return SemanticScholarRetriever(api=self.api, num_results=k, fields=self.fields, verbose=self.verbose, max_workers=self.max_workers,
+                page_workers=self.page_workers, bulk=self.bulk, sort=self.sort, filters=self.filters)
+
+
+class SemanticScholarLoader(pt.Transformer):
+    """A :class:`~pyterrier.Transformer` that loads paper details from Semantic Scholar by ``docno``.
+
+    Each distinct ``docno`` is only loaded once, using the paper batch endpoint (up to 500 papers per request).
+    """
+    def __init__(self,
+        *,
+        api: Optional[SemanticScholarApi] = None,
+        fields: List[str] = ['title', 'abstract'],
+        verbose: bool = True,
+        max_workers: Optional[int] = None,
+    ):
+        """
+        Args:
+            api: The Semantic Scholar api service. Defaults to a new instance of :class:`~pyterrier_services.SemanticScholarApi`.
+            fields: The fields to load (e.g., ``authors``, ``year``, ``citationCount`` or ``externalIds``). Defaults to ['title', 'abstract'].
+            verbose: Whether to log the progress. Defaults to True.
+            max_workers: The number of batch requests to run concurrently. Defaults to ``api.DEFAULT_MAX_WORKERS``.
+        """
+        self.api = api or SemanticScholarApi()
+        self.fields = fields
+        self.verbose = verbose
+        self.max_workers = max_workers or self.api.DEFAULT_MAX_WORKERS
+
+    def transform(self, inp: pd.DataFrame) -> pd.DataFrame:
+        pta.validate.columns(inp, includes=['docno'])
+        with self.api.metrics.call('SemanticScholarLoader'):
+            codes, docnos = pd.factorize(inp['docno'])
+            papers = self.api.batch(list(docnos), fields=self.fields, max_workers=self.max_workers, verbose=self.verbose)
+            with self.api.metrics.timer('assemble'):
+                return inp.assign(**{c: _take_factorized(papers[c].to_numpy(dtype=object), codes) for c in papers.columns if c != 'docno'}) # NaN for missing docnos
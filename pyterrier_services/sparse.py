@@ -0,0 +1,136 @@
+from collections.abc import Mapping
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+
+
+class SparseVectors:
+    """A batch of sparse vectors in CSR form over a shared token vocabulary.
+
+    Row ``i`` has the token ids ``indices[offsets[i]:offsets[i+1]]`` (into ``tokens``) with weights
+    ``values[offsets[i]:offsets[i+1]]``. Indexing a batch returns a :class:`SparseVector`, a read-only ``Mapping``
+    from token to weight that is backed by the batch's arrays.
+    """
+
+    def __init__(self, tokens: List[str], indices: np.ndarray, values: np.ndarray, offsets: np.ndarray, vocab: Optional[Dict[str, int]] = None):
+        """
+        Args:
+            tokens: The vocabulary, mapping token id to token.
+            indices: The token ids of all rows (int32).
+            values: The weights of all rows (float32, unless built with another ``dtype``).
+            offsets: The start offset of each row, followed by the total number of entries (int64).
+            vocab: The inverse of ``tokens``. Built from ``tokens`` if not provided.
+        """
+        self.tokens = tokens
+        self.vocab = vocab if vocab is not None else {t: i for i, t in enumerate(tokens)}
+        self.indices = indices
+        self.values = values
+        self.offsets = offsets
+
+    @classmethod
+    def from_pairs(cls, pairs: Iterable[Tuple[Sequence[str], Sequence[float]]], vocab: Optional[Dict[str, int]] = None, tokens: Optional[List[str]] = None, dtype=np.float32) -> 'SparseVectors':
+        """Builds a batch from ``(tokens, weights)`` pairs, adding new tokens to ``vocab``/``tokens`` (if provided).
+
+        The weights are stored as ``dtype`` (float32 by default); use ``np.float64`` to keep the weights exactly."""
+        vocab = {} if vocab is None else vocab
+        tokens = [] if tokens is None else tokens
+        indices, values, offsets = [], [], [0]
+        for toks, vals in pairs:
+            for tok in toks:
+                idx = vocab.get(tok)
+                if idx is None:
+                    idx = vocab[tok] = len(tokens)
+                    tokens.append(tok)
+                indices.append(idx)
+            values.extend(vals)
+            offsets.append(len(indices))
+        return cls(
+            tokens,
+            np.array(indices, dtype=np.int32),
+            np.array(values, dtype=dtype),
+            np.array(offsets, dtype=np.int64),
+            vocab=vocab,
+        )
+
+    @classmethod
+    def from_dicts(cls, dicts: Iterable[Dict[str, float]], vocab: Optional[Dict[str, int]] = None, tokens: Optional[List[str]] = None, dtype=np.float32) -> 'SparseVectors':
+        """Builds a batch from ``token -> weight`` dicts."""
+        return cls.from_pairs(((d.keys(), d.values()) for d in dicts), vocab=vocab, tokens=tokens, dtype=dtype)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row: int) -> 'SparseVector':
+        return SparseVector(self, row)
+
+    def lengths(self) -> np.ndarray:
+        """Returns the number of entries in each row."""
+        return np.diff(self.offsets)
+
+    def take(self, rows: np.ndarray) -> 'SparseVectors':
+        """Returns a new batch made up of the given rows (which may repeat)."""
+        rows = np.asarray(rows, dtype=np.int64)
+        lengths = self.lengths()[rows]
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        # source position of each output entry: the start of its row in the source + its position within the row
+        src = np.repeat(self.offsets[rows] - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return SparseVectors(self.tokens, self.indices[src], self.values[src], offsets, vocab=self.vocab)
+
+    def to_scipy(self):
+        """Returns the batch as a ``scipy.sparse.csr_matrix`` of shape ``(len(self), len(self.tokens))``."""
+        from scipy.sparse import csr_matrix
+        return csr_matrix((self.values, self.indices, self.offsets), shape=(len(self), len(self.tokens)))
+
+    def to_dicts(self) -> List[Dict[str, float]]:
+        """Returns the rows as ``token -> weight`` dicts."""
+        tokens, indices, values = self.tokens, self.indices.tolist(), self.values.tolist()
+        offsets = self.offsets.tolist()
+        return [{tokens[indices[j]]: values[j] for j in range(offsets[i], offsets[i+1])} for i in range(len(self))]
+
+    def rowwise_dot(self, other: 'SparseVectors') -> np.ndarray:
+        """Returns the dot product of each row with the corresponding row of ``other`` (which shares the vocabulary)."""
+        assert len(self) == len(other) and self.tokens is other.tokens, 'batches must have the same length and vocabulary'
+        if len(self) == 0:
+            return np.empty(0, dtype=np.float32)
+        return np.asarray(self.to_scipy().multiply(other.to_scipy()).sum(axis=1), dtype=np.float32).ravel()
+
+    def __repr__(self):
+        return f'SparseVectors(rows={len(self)}, vocab={len(self.tokens)}, nnz={len(self.indices)})'
+
+
+class SparseVector(Mapping):
+    """A read-only ``token -> weight`` view of a single row of a :class:`SparseVectors` batch."""
+    __slots__ = ('_vectors', '_row')
+
+    def __init__(self, vectors: SparseVectors, row: int):
+        self._vectors = vectors
+        self._row = row
+
+    def _slice(self) -> slice:
+        return slice(self._vectors.offsets[self._row], self._vectors.offsets[self._row + 1])
+
+    def __getitem__(self, token: str) -> float:
+        idx = self._vectors.vocab.get(token)
+        if idx is not None:
+            found = np.flatnonzero(self._vectors.indices[self._slice()] == idx)
+            if len(found):
+                return float(self._vectors.values[self._slice()][found[0]])
+        raise KeyError(token)
+
+    def __iter__(self) -> Iterator[str]:
+        tokens = self._vectors.tokens
+        return (tokens[i] for i in self._vectors.indices[self._slice()].tolist())
+
+    def __len__(self) -> int:
+        return int(self._vectors.offsets[self._row + 1] - self._vectors.offsets[self._row])
+
+    def items(self):
+        tokens = self._vectors.tokens
+        s = self._slice()
+        return list(zip((tokens[i] for i in self._vectors.indices[s].tolist()), self._vectors.values[s].tolist()))
+
+    def to_dict(self) -> Dict[str, float]:
+        return dict(self.items())
+
+    def __repr__(self):
+        return f'SparseVector({self.to_dict()!r})'
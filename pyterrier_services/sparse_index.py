@@ -0,0 +1,461 @@
+import contextlib
+import json
+import os
+import shutil
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+import pyterrier as pt
+import pyterrier_alpha as pta
+from .dense_index import _mmap, _Strings
+from .metrics import Metrics
+
+
+def _ranges(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Returns the concatenation of ``range(start, end)`` for each start and end."""
+    lengths = ends - starts
+    return np.arange(lengths.sum()) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+
+
+def _vbyte_encode(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Variable-byte encodes non-negative integers (below 2^35), returning the bytes and the length of each value.
+
+    Each byte holds 7 bits of the value (least significant first), with the high bit set on all but the last byte."""
+    values = values.astype(np.int64, copy=False)
+    lengths = np.ones(len(values), dtype=np.int64)
+    for shift in (7, 14, 21, 28):
+        lengths += values >= (1 << shift)
+    positions = np.cumsum(lengths) - lengths
+    res = np.empty(lengths.sum(), dtype=np.uint8)
+    for i in range(int(lengths.max(initial=0))):
+        mask = lengths > i
+        byte = (values[mask] >> (7 * i)) & 0x7f
+        res[positions[mask] + i] = byte | np.where(lengths[mask] > i + 1, 0x80, 0)
+    return res, lengths
+
+
+def _vbyte_decode(data: np.ndarray) -> np.ndarray:
+    """Decodes the values encoded by :func:`_vbyte_encode`."""
+    if len(data) == 0:
+        return np.empty(0, dtype=np.int64)
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    shifts = 7 * (np.arange(len(data)) - np.repeat(starts, ends - starts + 1))
+    return np.add.reduceat((data & 0x7f).astype(np.int64) << shifts, starts)
+
+
+class SparseIndex:
+    """A local, compressed inverted index of learned sparse vectors (e.g., ``toks`` from :class:`PineconeSparseEncoder`).
+
+    The index is written by :meth:`indexer`, which streams the ``toks`` of a corpus into an inverted index. Term weights
+    are quantised to 8-bit impacts (with a single scale over the index), and each posting list is split into blocks of
+    :attr:`BLOCK_SIZE` postings, with the doc id gaps of each block compressed with variable-byte codes. The maximum
+    impact of each term (and of each block) is stored alongside the postings.
+
+    :meth:`retriever` scores the ``query_toks`` of each query with MaxScore dynamic pruning: terms are processed in
+    decreasing order of their maximum score, and once the remaining terms cannot lift a new document into the top
+    results, they are only looked up for the current candidates, decoding just the blocks that contain them.
+
+    Example::
+
+        model = PineconeSparseModel()
+        index = SparseIndex('sparse-index/')
+        (model.doc_encoder() >> index.indexer()).index(dataset.get_corpus_iter())
+        retriever = model.query_encoder() >> index.retriever(num_results=100)
+    """
+
+    BLOCK_SIZE = 128 # postings per block
+
+    def __init__(self, path: str, *, metrics: Optional[Metrics] = None):
+        """
+        Args:
+            path: The directory of the index.
+            metrics: The metrics to record timings to. Defaults to a new instance of :class:`~pyterrier_services.Metrics`.
+        """
+        self.path = path
+        self.metrics = metrics or Metrics()
+        self._meta = None
+
+    def built(self) -> bool:
+        """Returns whether the index has been written."""
+        return os.path.exists(os.path.join(self.path, 'meta.json'))
+
+    @property
+    def meta(self) -> dict:
+        """The metadata of the index (its size, the scale of the impacts and the block size)."""
+        return self._load()
+
+    def _load(self) -> dict:
+        # opens the files of the index on first use (as it may be written after this object is created)
+        if self._meta is None:
+            with open(os.path.join(self.path, 'meta.json'), 'rt') as fin:
+                meta = json.load(fin)
+            def file(name, dtype):
+                return _mmap(os.path.join(self.path, name), dtype)
+            self._docnos = _Strings(os.path.join(self.path, 'docnos'))
+            self._terms = _Strings(os.path.join(self.path, 'terms'))
+            self._vocab = None
+            self._term_blocks = file('terms.blocks', np.int64)
+            self._term_max = file('terms.max', np.uint8)
+            self._block_offsets = file('blocks.offsets', np.int64)
+            self._block_postings = file('blocks.postings', np.int64)
+            self._block_last = file('blocks.last', np.int64)
+            self._block_max = file('blocks.max', np.uint8)
+            self._docids = file('postings.docids', np.uint8)
+            self._impacts = file('postings.impacts', np.uint8)
+            self._meta = meta
+        return self._meta
+
+    def _reset(self) -> None:
+        self._meta = None
+
+    def __len__(self) -> int:
+        return self.meta['count']
+
+    @property
+    def vocab(self) -> Dict[str, int]:
+        """Maps each term in the index to its (0-based) id."""
+        return self._load_vocab()
+
+    def _load_vocab(self) -> Dict[str, int]:
+        # opens the index and builds its vocabulary on first use
+        self._load()
+        if self._vocab is None:
+            self._vocab = {self._terms[i]: i for i in range(len(self._terms))}
+        return self._vocab
+
+    def docnos(self, docids: np.ndarray) -> List[str]:
+        """Returns the docnos of the documents with the provided (0-based) ids."""
+        self._load()
+        return self._docnos.take(np.asarray(docids))
+
+    def postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns the doc ids and quantised impacts of the documents containing ``term`` (empty if it is not indexed)."""
+        termid = self.vocab.get(term)
+        if termid is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint8)
+        return self._decode(termid, np.arange(self._term_blocks[termid], self._term_blocks[termid+1]))
+
+    def _decode(self, termid: int, blocks: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # decodes the (sorted) blocks of termid, returning their doc ids and impacts
+        gaps = _vbyte_decode(self._docids[_ranges(self._block_offsets[blocks], self._block_offsets[blocks+1])])
+        counts = self._block_postings[blocks+1] - self._block_postings[blocks]
+        bases = np.where(blocks == self._term_blocks[termid], -1, self._block_last[blocks-1]) # gaps continue from the previous block
+        sums = np.cumsum(gaps)
+        starts = np.cumsum(counts) - counts
+        before = np.where(starts > 0, sums[starts-1], 0)
+        docids = sums + np.repeat(bases - before, counts)
+        return docids, self._impacts[_ranges(self._block_postings[blocks], self._block_postings[blocks+1])]
+
+    def indexer(self, *, overwrite: bool = False, run_size: int = 10_000_000, verbose: bool = True) -> 'SparseIndexer':
+        """Returns an indexer that writes the ``toks`` of each document to this index.
+
+        Args:
+            overwrite: Whether to replace an existing index. Defaults to False (raises an error if the index exists).
+            run_size: The number of postings buffered in memory before they are written to a temporary run. Defaults
+                to 10M.
+            verbose: Whether to log the progress. Defaults to True.
+        """
+        return SparseIndexer(self, overwrite=overwrite, run_size=run_size, verbose=verbose)
+
+    def retriever(self, *, num_results: int = 1000, max_workers: Optional[int] = None, verbose: bool = False) -> 'SparseRetriever':
+        """Returns a retriever that scores the ``query_toks`` of each query against this index.
+
+        Args:
+            num_results: The number of results to retrieve per query. Defaults to 1000.
+            max_workers: The number of threads processing queries. Each thread keeps a score accumulator over the
+                documents of the index (8 bytes per document). Defaults to the number of CPUs.
+            verbose: Whether to log the progress over the queries. Defaults to False.
+        """
+        return SparseRetriever(self, num_results=num_results, max_workers=max_workers, verbose=verbose)
+
+    def __repr__(self):
+        return f'SparseIndex({self.path!r})'
+
+
+class SparseIndexer(pt.Indexer):
+    """Writes the ``toks`` of each document to a :class:`SparseIndex`.
+
+    Postings are buffered in memory and written to sorted temporary runs every ``run_size`` postings, which are merged
+    (a group of terms at a time) into the index once all the documents have been read."""
+
+    def __init__(self, index: SparseIndex, *, overwrite: bool = False, run_size: int = 10_000_000, verbose: bool = True):
+        """
+        Args:
+            index: The index to write to.
+            overwrite: Whether to replace an existing index. Defaults to False (raises an error if the index exists).
+            run_size: The number of postings buffered in memory before they are written to a temporary run. Defaults
+                to 10M.
+            verbose: Whether to log the progress. Defaults to True.
+        """
+        self.index_ = index
+        self.overwrite = overwrite
+        self.run_size = run_size
+        self.verbose = verbose
+
+    def index(self, inp: pt.model.IterDict) -> SparseIndex:
+        """Writes the documents (with ``docno`` and ``toks``) to the index, returning it."""
+        path = self.index_.path
+        if self.index_.built():
+            if not self.overwrite:
+                raise FileExistsError(f'{path!r} already contains an index (pass overwrite=True to replace it)')
+            for name in os.listdir(path):
+                if name == 'meta.json' or name.startswith(('docnos', 'terms', 'blocks.', 'postings.')):
+                    os.remove(os.path.join(path, name))
+        runs_path = os.path.join(path, 'runs')
+        os.makedirs(runs_path, exist_ok=True)
+        self.index_._reset()
+        try:
+            with self.index_.metrics.call(repr(self)):
+                if self.verbose:
+                    inp = pt.tqdm(inp, desc=repr(self), unit='d')
+                count, vocab, runs, max_weight = self._invert(inp, path, runs_path)
+                with self.index_.metrics.timer('merge'):
+                    meta = self._merge(path, count, vocab, runs, max_weight)
+                with open(os.path.join(path, 'meta.json'), 'wt') as fout:
+                    json.dump(meta, fout)
+        finally:
+            shutil.rmtree(runs_path, ignore_errors=True)
+        return self.index_
+
+    def _invert(self, inp: pt.model.IterDict, path: str, runs_path: str):
+        vocab = {}
+        runs = []
+        max_weight = 0.
+        termids, docids, weights = array('q'), array('q'), array('f')
+
+        def flush():
+            # sorts the buffered postings by term (they are already in doc id order) and writes them as a run
+            nonlocal max_weight, termids, docids, weights
+            run = [np.frombuffer(termids, dtype=np.int64), np.frombuffer(docids, dtype=np.int64), np.frombuffer(weights, dtype=np.float32)]
+            if (run[2] < 0).any():
+                raise ValueError('toks must have non-negative weights')
+            max_weight = max(max_weight, float(run[2].max(initial=0.)))
+            order = np.argsort(run[0], kind='stable')
+            prefix = os.path.join(runs_path, str(len(runs)))
+            for arr, ext in zip(run, ['termids', 'docids', 'weights']):
+                with open(f'{prefix}.{ext}', 'wb') as fout:
+                    fout.write(arr[order].tobytes())
+            runs.append(prefix)
+            termids, docids, weights = array('q'), array('q'), array('f')
+
+        count = 0
+        docno_offset = 0
+        with open(os.path.join(path, 'docnos'), 'wb') as f_docnos, open(os.path.join(path, 'docnos.offsets'), 'wb') as f_offsets:
+            f_offsets.write(array('q', [0]).tobytes())
+            for doc in inp:
+                docno = str(doc['docno']).encode()
+                f_docnos.write(docno)
+                docno_offset += len(docno)
+                f_offsets.write(array('q', [docno_offset]).tobytes())
+                toks = doc['toks']
+                if 0 in toks.values():
+                    toks = {tok: weight for tok, weight in toks.items() if weight != 0}
+                termids.extend([vocab.setdefault(tok, len(vocab)) for tok in toks])
+                docids.extend([count] * len(toks))
+                weights.extend(toks.values())
+                count += 1
+                if len(termids) >= self.run_size:
+                    flush()
+        if len(termids) or not runs:
+            flush()
+        return count, vocab, runs, max_weight
+
+    def _merge(self, path: str, count: int, vocab: Dict[str, int], runs: List[str], max_weight: float) -> dict:
+        block_size = SparseIndex.BLOCK_SIZE
+        scale = max_weight / 255 if max_weight > 0 else 1.
+        n_terms = len(vocab)
+        runs = [(_mmap(f'{prefix}.termids', np.int64), _mmap(f'{prefix}.docids', np.int64), _mmap(f'{prefix}.weights', np.float32)) for prefix in runs]
+        run_offsets = [np.searchsorted(termids, np.arange(n_terms + 1)) for termids, _, _ in runs]
+        term_offsets = np.sum(run_offsets, axis=0)
+
+        with open(os.path.join(path, 'terms'), 'wb') as fout:
+            fout.write(''.join(vocab).encode())
+        lengths = np.array([len(term.encode()) for term in vocab], dtype=np.int64)
+        with open(os.path.join(path, 'terms.offsets'), 'wb') as fout:
+            fout.write(np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64).tobytes())
+
+        names = ['terms.blocks', 'terms.max', 'blocks.offsets', 'blocks.postings', 'blocks.last', 'blocks.max', 'postings.docids', 'postings.impacts']
+        with contextlib.ExitStack() as stack:
+            files = {name: stack.enter_context(open(os.path.join(path, name), 'wb')) for name in names}
+            files['terms.blocks'].write(array('q', [0]).tobytes())
+            files['blocks.offsets'].write(array('q', [0]).tobytes())
+            files['blocks.postings'].write(array('q', [0]).tobytes())
+            n_blocks = n_bytes = n_postings = 0
+            start = 0
+            while start < n_terms:
+                # merge a group of terms with about run_size postings (or a single term with more)
+                end = max(int(np.searchsorted(term_offsets, term_offsets[start] + self.run_size, side='right')) - 1, start + 1)
+                group = [(t[o[start]:o[end]], d[o[start]:o[end]], w[o[start]:o[end]]) for (t, d, w), o in zip(runs, run_offsets)]
+                termids = np.concatenate([g[0] for g in group])
+                order = np.argsort(termids, kind='stable') # runs are in doc id order, so this gives (term, doc id) order
+                termids = termids[order]
+                docids = np.concatenate([g[1] for g in group])[order]
+                impacts = np.clip(np.rint(np.concatenate([g[2] for g in group])[order] / scale), 1, 255).astype(np.uint8)
+
+                n = len(termids)
+                term_starts = np.flatnonzero(np.concatenate([[True], termids[1:] != termids[:-1]]))
+                term_lengths = np.diff(np.append(term_starts, n))
+                positions = np.arange(n) - np.repeat(term_starts, term_lengths) # position of each posting in its term
+                block_starts = np.flatnonzero(positions % block_size == 0)
+                block_ends = np.append(block_starts[1:], n)
+                gaps = docids - np.where(positions == 0, -1, np.roll(docids, 1))
+                data, gap_lengths = _vbyte_encode(gaps)
+
+                byte_lengths = np.add.reduceat(gap_lengths, block_starts)
+                files['blocks.offsets'].write((n_bytes + np.cumsum(byte_lengths)).astype(np.int64).tobytes())
+                files['blocks.postings'].write((n_postings + block_ends).astype(np.int64).tobytes())
+                files['blocks.last'].write(docids[block_ends - 1].astype(np.int64).tobytes())
+                files['blocks.max'].write(np.maximum.reduceat(impacts, block_starts).tobytes())
+                term_n_blocks = -(-term_lengths // block_size)
+                files['terms.blocks'].write((n_blocks + np.cumsum(term_n_blocks)).astype(np.int64).tobytes())
+                files['terms.max'].write(np.maximum.reduceat(impacts, term_starts).tobytes())
+                files['postings.docids'].write(data.tobytes())
+                files['postings.impacts'].write(impacts.tobytes())
+                n_blocks += len(block_starts)
+                n_bytes += len(data)
+                n_postings += n
+                start = end
+        return {'count': count, 'terms': n_terms, 'postings': n_postings, 'blocks': n_blocks, 'scale': scale, 'block_size': block_size}
+
+    def __repr__(self):
+        return f'SparseIndexer({self.index_!r})'
+
+
+class SparseRetriever(pt.Transformer):
+    """Retrieves the documents of a :class:`SparseIndex` with the highest score for each ``query_toks``, where the score
+    is the sum of the query weight times the (quantised) document weight of each term, using MaxScore dynamic pruning."""
+
+    def __init__(self,
+        index: SparseIndex,
+        *,
+        num_results: int = 1000,
+        max_workers: Optional[int] = None,
+        verbose: bool = False,
+    ):
+        """
+        Args:
+            index: The index to retrieve from.
+            num_results: The number of results to retrieve per query. Defaults to 1000.
+            max_workers: The number of threads processing queries. Each thread keeps a score accumulator over the
+                documents of the index (8 bytes per document). Defaults to the number of CPUs.
+            verbose: Whether to log the progress over the queries. Defaults to False.
+        """
+        self.index = index
+        self.num_results = num_results
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.verbose = verbose
+        self._local = threading.local()
+
+    def _accumulator(self) -> np.ndarray:
+        # a zeroed score per document, reused by the queries of each thread (only the entries a query touched are reset)
+        acc = getattr(self._local, 'acc', None)
+        if acc is None or len(acc) != len(self.index):
+            acc = self._local.acc = np.zeros(len(self.index), dtype=np.float64)
+        return acc
+
+    def _search(self, query_toks) -> Tuple[np.ndarray, np.ndarray]:
+        index = self.index
+        index._load()
+        scale = index.meta['scale']
+        terms = []
+        for tok, weight in query_toks.items():
+            termid = index.vocab.get(tok)
+            if termid is not None and weight > 0:
+                terms.append((termid, weight * scale, weight * scale * float(index._term_max[termid])))
+        terms.sort(key=lambda t: -t[2])
+        # remaining[i]: the maximum score still to be added by terms i onwards (summed from the end, so the last is exactly 0)
+        remaining = np.append(np.cumsum([t[2] for t in terms[::-1]])[::-1], 0.)
+        k = self.num_results
+        threshold = -np.inf
+        acc = self._accumulator()
+        touched = []
+        i = 0
+        try:
+            # essential terms: documents without any of the previous terms can still reach the top results, so all the
+            # postings are scored (term at a time, into the accumulator)
+            top = np.empty(0, dtype=np.int64) # the documents scoring at least the threshold
+            while i < len(terms) and remaining[i] >= threshold:
+                termid, weight, _ = terms[i]
+                term_docids, impacts = index._decode(termid, np.arange(index._term_blocks[termid], index._term_blocks[termid+1]))
+                acc[term_docids] += weight * impacts
+                touched.append(term_docids)
+                # the other documents have not changed, so the top results are among the previous ones and this term's
+                positions = np.minimum(np.searchsorted(term_docids, top), len(term_docids) - 1)
+                top = np.concatenate([top[term_docids[positions] != top], term_docids])
+                if len(top) >= k:
+                    top_scores = acc[top]
+                    threshold = np.partition(top_scores, len(top) - k)[len(top) - k]
+                    top = top[top_scores >= threshold]
+                i += 1
+            # candidates: the (touched) documents that can still reach the threshold; when many documents were touched,
+            # scanning the accumulator is cheaper than de-duplicating them
+            if sum(len(d) for d in touched) > len(acc) // 16:
+                docids = np.flatnonzero((acc > 0) & (acc + remaining[i] >= threshold))
+            elif touched:
+                docids = np.unique(np.concatenate([d[acc[d] + remaining[i] >= threshold] for d in touched]))
+            else:
+                docids = np.empty(0, dtype=np.int64)
+            scores = acc[docids]
+        finally:
+            for d in touched:
+                acc[d] = 0.
+
+        # non-essential terms: only the candidates are scored, decoding just the blocks that contain them
+        for j in range(i, len(terms)):
+            termid, weight, _ = terms[j]
+            blocks = np.arange(index._term_blocks[termid], index._term_blocks[termid+1])
+            candidate_blocks = np.searchsorted(index._block_last[blocks], docids)
+            in_term = candidate_blocks < len(blocks)
+            candidate_blocks = blocks[np.minimum(candidate_blocks, len(blocks) - 1)]
+            # drop the candidates that cannot reach the threshold, even with the maximum impact of their block
+            bounds = scores + remaining[j+1] + np.where(in_term, weight * index._block_max[candidate_blocks], 0.)
+            keep = bounds >= threshold
+            docids, scores = docids[keep], scores[keep]
+            blocks = np.unique(candidate_blocks[keep & in_term])
+            if len(blocks):
+                term_docids, impacts = index._decode(termid, blocks)
+                positions = np.minimum(np.searchsorted(term_docids, docids), len(term_docids) - 1)
+                found = term_docids[positions] == docids
+                scores[found] += weight * impacts[positions[found]]
+            threshold = np.partition(scores, len(scores) - k)[len(scores) - k]
+            keep = scores + remaining[j+1] >= threshold
+            docids, scores = docids[keep], scores[keep]
+        order = np.lexsort((docids, -scores))[:k]
+        return docids[order], scores[order]
+
+    def transform(self, inp: pd.DataFrame) -> pd.DataFrame:
+        pta.validate.query_frame(inp, extra_columns=['query_toks'])
+        with self.index.metrics.call(repr(self)):
+            queries = inp['query_toks'].tolist()
+            self.index._load_vocab() # opens the index before the workers start
+            with self.index.metrics.timer('search'):
+                if self.max_workers > 1 and len(queries) > 1:
+                    with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                        it = pool.map(self._search, queries)
+                        if self.verbose:
+                            it = pt.tqdm(it, desc=repr(self), unit='q', total=len(queries))
+                        res = list(it)
+                else:
+                    it = pt.tqdm(queries, desc=repr(self), unit='q') if self.verbose else queries
+                    res = [self._search(q) for q in it]
+            with self.index.metrics.timer('assemble'):
+                lengths = np.array([len(docids) for docids, _ in res], dtype=np.int64)
+                docids = np.concatenate([docids for docids, _ in res]) if res else np.empty(0, dtype=np.int64)
+                scores = np.concatenate([scores for _, scores in res]) if res else np.empty(0, dtype=np.float64)
+                rows = np.repeat(np.arange(len(inp)), lengths)
+                return inp.iloc[rows].reset_index(drop=True).assign(
+                    docno=self.index.docnos(docids),
+                    score=scores,
+                    rank=np.arange(len(rows)) - np.repeat(np.cumsum(lengths) - lengths, lengths),
+                )
+
+    def fuse_rank_cutoff(self, k: int) -> Optional['SparseRetriever']:
+        if k < self.num_results:
+            return SparseRetriever(self.index, num_results=k, max_workers=self.max_workers, verbose=self.verbose)
+
+    def __repr__(self):
+        return f'SparseRetriever({self.index!r}, num_results={self.num_results!r})'
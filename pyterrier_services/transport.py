@@ -0,0 +1,120 @@
+import asyncio
+import importlib.util
+import json
+import weakref
+from typing import Any, Dict, Optional
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import orjson as _orjson
+except ModuleNotFoundError:
+    _orjson = None
+
+
+def json_loads(data: bytes) -> Any:
+    """Decodes JSON, using ``orjson`` (which is several times faster) when it is installed."""
+    if _orjson is not None:
+        return _orjson.loads(data)
+    return json.loads(data)
+
+
+def json_dumps(value: Any) -> bytes:
+    """Encodes a value as JSON (UTF-8), using ``orjson`` when it is installed."""
+    if _orjson is not None:
+        return _orjson.dumps(value)
+    return json.dumps(value).encode()
+
+
+def _accept_encoding() -> str:
+    # Only advertise brotli when a decoder is available (urllib3 and httpx both pick it up automatically)
+    if importlib.util.find_spec('brotli') is None and importlib.util.find_spec('brotlicffi') is None:
+        return 'gzip, deflate'
+    return 'gzip, deflate, br'
+
+
+class HttpTransport:
+    """A pooled HTTP transport with keep-alive connections, shared by API objects.
+
+    Each API object creates its own transport by default. A single transport can also be passed to several API objects
+    so that they share a connection pool.
+
+    Example::
+
+        transport = HttpTransport(pool_size=32)
+        s2 = SemanticScholarApi(transport=transport)
+        dblp = DblpApi(transport=transport)
+    """
+
+    def __init__(self,
+        *,
+        pool_size: int = 10,
+        connect_timeout: float = 5.,
+        read_timeout: float = 30.,
+        headers: Optional[Dict[str, str]] = None,
+    ):
+        """
+        Args:
+            pool_size: The maximum number of connections kept alive per host. Defaults to 10.
+            connect_timeout: The number of seconds to wait when establishing a connection. Defaults to 5.
+            read_timeout: The number of seconds to wait for the server to send data. Defaults to 30.
+            headers: Additional headers to send with every request.
+        """
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.headers = {'Accept-Encoding': _accept_encoding(), 'Connection': 'keep-alive', **(headers or {})}
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def get(self, url: str, *, params: Optional[Dict] = None, headers: Optional[Dict[str, str]] = None) -> requests.Response:
+        """Performs a GET request over the pooled session."""
+        return self.session.get(url, params=params, headers=headers, timeout=(self.connect_timeout, self.read_timeout))
+
+    def post(self, url: str, *, params: Optional[Dict] = None, json=None, headers: Optional[Dict[str, str]] = None) -> requests.Response:
+        """Performs a POST request (with a JSON body) over the pooled session."""
+        return self.session.post(url, params=params, json=json, headers=headers, timeout=(self.connect_timeout, self.read_timeout))
+
+    def async_client(self):
+        """Returns the ``httpx.AsyncClient`` for the running event loop, creating it if needed.
+
+        httpx clients hold a connection pool that is bound to the loop it was first used on, so one client is kept per
+        event loop. Requires the ``httpx`` package.
+        """
+        try:
+            import httpx
+        except ModuleNotFoundError as mnfe:
+            raise ImportError("You need to pip install httpx") from mnfe
+        loop = asyncio.get_running_loop()
+        if loop not in self._async_clients:
+            self._async_clients[loop] = httpx.AsyncClient(
+                headers=self.headers,
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+                timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+            )
+        return self._async_clients[loop]
+
+    async def async_get(self, url: str, *, params: Optional[Dict] = None, headers: Optional[Dict[str, str]] = None):
+        """Async version of :meth:`get`, returning an ``httpx.Response``."""
+        return await self.async_client().get(url, params=params, headers=headers)
+
+    async def async_post(self, url: str, *, params: Optional[Dict] = None, json=None, headers: Optional[Dict[str, str]] = None):
+        """Async version of :meth:`post`, returning an ``httpx.Response``."""
+        return await self.async_client().post(url, params=params, json=json, headers=headers)
+
+    def close(self) -> None:
+        """Closes the pooled connections of the synchronous session."""
+        self.session.close()
+
+    async def aclose(self) -> None:
+        """Closes the async client bound to the running event loop (if any)."""
+        client = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+    def __repr__(self):
+        return f'HttpTransport(pool_size={self.pool_size!r})'
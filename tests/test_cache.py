@@ -0,0 +1,73 @@
+import os
+import tempfile
+import time
+import unittest
+import pandas as pd
+from pyterrier_services import ResponseCache, DblpApi
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'cache.sqlite')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_get_put(self):
+        cache = ResponseCache(self.path)
+        self.assertIsNone(cache.get('svc', '/a', {'q': 'x', 'f': 0}))
+        cache.put('svc', '/a', {'q': 'x', 'f': 0}, {'value': [1, 2]})
+        # parameters are normalised: order and int vs str don't matter
+        self.assertEqual(cache.get('svc', '/a', {'f': '0', 'q': 'x'}), {'value': [1, 2]})
+        self.assertIsNone(cache.get('svc', '/b', {'q': 'x', 'f': 0}))
+        self.assertIsNone(cache.get('other', '/a', {'q': 'x', 'f': 0}))
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 3)
+        # persisted across instances
+        self.assertEqual(ResponseCache(self.path).get('svc', '/a', {'q': 'x', 'f': 0}), {'value': [1, 2]})
+
+    def test_ttl(self):
+        cache = ResponseCache(self.path, ttl=0.05)
+        cache.put('svc', '/a', {'q': 'x'}, 'value')
+        self.assertEqual(cache.get('svc', '/a', {'q': 'x'}), 'value')
+        time.sleep(0.1)
+        self.assertIsNone(cache.get('svc', '/a', {'q': 'x'}))
+
+    def test_lru_eviction(self):
+        cache = ResponseCache(self.path, max_bytes=2000, compress_level=0)
+        for i in range(3):
+            cache.put('svc', '/a', {'i': i}, 'x' * 800)
+            time.sleep(0.01)
+        self.assertIsNone(cache.get('svc', '/a', {'i': 0}))
+        self.assertIsNotNone(cache.get('svc', '/a', {'i': 1}))
+        time.sleep(0.01)
+        cache.put('svc', '/a', {'i': 3}, 'x' * 800) # i=2 is now the least recently used
+        self.assertIsNone(cache.get('svc', '/a', {'i': 2}))
+        self.assertIsNotNone(cache.get('svc', '/a', {'i': 1}))
+        self.assertLessEqual(cache.stats()['bytes'], 2000)
+
+    def test_get_or_fetch_null(self):
+        cache = ResponseCache(self.path)
+        fetches = []
+        def fetch():
+            fetches.append(True)
+            return None
+        for _ in range(2):
+            self.assertIsNone(cache.get_or_fetch('svc', '/a', {'q': 'x'}, fetch))
+        self.assertEqual(len(fetches), 1) # a cached null response is a hit
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_dblp_from_cache(self):
+        cache = ResponseCache(self.path)
+        cache.put('dblp', '/search/publ/api', {'q': 'pyterrier', 'format': 'json', 'f': 0, 'c': 2}, {'result': {'hits': {
+            '@first': '0', '@sent': '2', '@total': '2', 'hit': [
+                {'info': {'key': 'conf/a/1', 'title': 'A.', 'authors': {'author': {'text': 'X'}}, 'year': '2021', 'type': 'T'}},
+                {'info': {'key': 'conf/b/2', 'title': 'B.', 'authors': {'author': [{'text': 'Y'}, {'text': 'Z'}]}, 'year': '2020', 'type': 'T'}},
+            ]}}})
+        res = DblpApi(cache=cache).retriever(num_results=2, verbose=False)(pd.DataFrame([{'qid': '1', 'query': 'pyterrier'}]))
+        self.assertEqual(res['docno'].tolist(), ['conf/a/1', 'conf/b/2'])
+        self.assertEqual(res['authors'].tolist(), [['X'], ['Y', 'Z']])
+        self.assertEqual(cache.hits, 1)
+        res = DblpApi(cache=cache).retriever(num_results=2, verbose=False)([{'qid': '1', 'query': 'pyterrier'}]) # transform_iter
+        self.assertEqual([(r['qid'], r['docno'], r['rank']) for r in res], [('1', 'conf/a/1', 0), ('1', 'conf/b/2', 1)])
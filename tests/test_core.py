@@ -0,0 +1,128 @@
+import asyncio
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from pyterrier_services import multi_query, multi_query_iter, paginated_search, async_multi_query, async_paginated_search, async_http_error_retry
+
+
+def _fake_search(query):
+    time.sleep(0.05 if query == 'slow' else 0.)
+    return pd.DataFrame({'docno': [f'{query}-0', f'{query}-1'], 'rank': [0, 1], 'score': [0., -1.]})
+
+
+class _FakePagedApi:
+    """Serves ``total`` results in pages of at most ``page_size``, recording the requested (offset, limit) pairs."""
+    def __init__(self, total, page_size):
+        self.total = total
+        self.page_size = page_size
+        self.calls = []
+
+    def _page(self, query, offset, limit):
+        self.calls.append((offset, limit))
+        time.sleep(0.01)
+        n = max(min(limit, self.page_size, self.total - offset), 0)
+        return pd.DataFrame({'docno': [f'{query}-{offset+i}' for i in range(n)], 'rank': list(range(offset, offset+n))})
+
+    def search(self, query, *, offset=0, limit=100, return_next=False, return_total=False):
+        page = self._page(query, offset, limit)
+        return (page, offset + len(page), self.total) if return_total else (page, offset + len(page))
+
+    async def async_search(self, query, *, offset=0, limit=100, return_next=False, return_total=False):
+        return self.search(query, offset=offset, limit=limit, return_next=return_next, return_total=return_total)
+
+
+class TestCore(unittest.TestCase):
+    def test_multi_query_order(self):
+        inp = pd.DataFrame({'qid': ['1', '2', '3'], 'query': ['slow', 'b', 'c']})
+        for max_workers in [None, 1, 3]:
+            with self.subTest(max_workers=max_workers):
+                res = multi_query(_fake_search, verbose=False, max_workers=max_workers)(inp)
+                self.assertEqual(list(res.columns), ['qid', 'query', 'docno', 'score', 'rank'])
+                self.assertEqual(res['qid'].tolist(), ['1', '1', '2', '2', '3', '3'])
+                self.assertEqual(res['docno'].tolist(), ['slow-0', 'slow-1', 'b-0', 'b-1', 'c-0', 'c-1'])
+
+    def test_multi_query_extra_columns(self):
+        def search(query):
+            return _fake_search(query).iloc[:0 if query == 'none' else 2].assign(title='t')
+        inp = pd.DataFrame({'qid': ['1', '2', '3'], 'query': ['a', 'none', 'c'], 'title': ['x', 'y', 'z'], 'topic': [7, 8, 9]}, index=[5, 5, 6])
+        res = multi_query(search, verbose=False)(inp)
+        self.assertEqual(list(res.columns), ['qid', 'query', 'docno', 'score', 'rank', 'title', 'topic'])
+        self.assertEqual(res['qid'].tolist(), ['1', '1', '3', '3'])
+        self.assertEqual(res['title'].tolist(), ['t'] * 4) # result columns take precedence over query columns
+        self.assertEqual(res['topic'].tolist(), [7, 7, 9, 9])
+        self.assertEqual(res['topic'].dtype, inp['topic'].dtype)
+
+    def test_multi_query_duplicates(self):
+        calls = []
+        def search(query):
+            calls.append(query)
+            return _fake_search(query)
+        inp = pd.DataFrame({'qid': ['1', '2', '3', '4'], 'query': ['a', 'b', 'a', 'a']})
+        res = multi_query(search, verbose=False, max_workers=2)(inp)
+        self.assertEqual(sorted(calls), ['a', 'b']) # each query string is only run once
+        self.assertEqual(res['qid'].tolist(), ['1', '1', '2', '2', '3', '3', '4', '4'])
+        self.assertEqual(res['docno'].tolist(), ['a-0', 'a-1', 'b-0', 'b-1'] + ['a-0', 'a-1'] * 2)
+
+    def test_multi_query_executor(self):
+        inp = pd.DataFrame({'qid': ['1', '2'], 'query': ['a', 'b']})
+        with ThreadPoolExecutor(2) as executor:
+            res = multi_query(_fake_search, verbose=False, executor=executor)(inp)
+            self.assertEqual(res['docno'].tolist(), ['a-0', 'a-1', 'b-0', 'b-1'])
+            executor.submit(lambda: None).result() # still usable afterwards
+
+    def test_multi_query_iter(self):
+        for max_workers in [None, 3]:
+            with self.subTest(max_workers=max_workers):
+                started = []
+                def search(query):
+                    started.append(query)
+                    return _fake_search(query)
+                queries = ({'qid': str(i), 'query': 'slow' if i == 0 else f'q{i}'} for i in range(100))
+                it = multi_query_iter(search, verbose=False, max_workers=max_workers)(queries)
+                first = next(it)
+                self.assertEqual(list(first.keys()), ['qid', 'query', 'docno', 'score', 'rank'])
+                self.assertEqual(first['docno'], 'slow-0')
+                self.assertLessEqual(len(started), max_workers or 1) # queries are only run as results are consumed
+                res = [first, *it]
+                self.assertEqual(len(res), 200)
+                self.assertEqual([r['qid'] for r in res[:4]], ['0', '0', '1', '1'])
+                self.assertEqual(res[-1]['docno'], 'q99-1')
+
+    def test_async_multi_query(self):
+        async def fake_search(query, offset=0, limit=100, return_next=False):
+            await asyncio.sleep(0.05 if query == 'slow' else 0.)
+            n = min(limit, 2, 3 - offset)
+            page = pd.DataFrame({'docno': [f'{query}-{offset+i}' for i in range(n)], 'rank': list(range(offset, offset+n)), 'score': [-float(offset+i) for i in range(n)]})
+            return page, offset + n
+
+        inp = pd.DataFrame({'qid': ['1', '2'], 'query': ['slow', 'b']})
+        fn = async_multi_query(async_paginated_search(async_http_error_retry(fake_search), num_results=5), verbose=False)
+        res = asyncio.run(fn(inp))
+        self.assertEqual(res['qid'].tolist(), ['1', '1', '1', '2', '2', '2'])
+        self.assertEqual(res['docno'].tolist(), ['slow-0', 'slow-1', 'slow-2', 'b-0', 'b-1', 'b-2'])
+
+    def test_paginated_search_prefetch(self):
+        for total, num_results, use_total in [(1000, 450, True), (1000, 450, False), (230, 450, True), (230, 450, False), (50, 450, True), (0, 450, False)]:
+            with self.subTest(total=total, num_results=num_results, use_total=use_total):
+                api = _FakePagedApi(total, page_size=100)
+                res = paginated_search(api.search, num_results, page_size=100, max_workers=3, use_total=use_total)('q')
+                expected = min(total, num_results)
+                self.assertEqual(res['rank'].tolist(), list(range(expected)))
+                self.assertEqual(api.calls[0], (0, 100))
+                if use_total:
+                    self.assertEqual(len(api.calls), max((expected + 99) // 100, 1)) # no requests past the total
+                if total == 1000:
+                    self.assertEqual(sorted(api.calls), [(0, 100), (100, 100), (200, 100), (300, 100), (400, 50)])
+
+                async_api = _FakePagedApi(total, page_size=100)
+                res = asyncio.run(async_paginated_search(async_api.async_search, num_results, page_size=100, max_workers=3, use_total=use_total)('q'))
+                self.assertEqual(res['rank'].tolist(), list(range(expected)))
+                self.assertEqual(sorted(async_api.calls), sorted(api.calls))
+
+    def test_paginated_search_prefetch_concurrent(self):
+        api = _FakePagedApi(1000, page_size=100)
+        start = time.monotonic()
+        res = paginated_search(api.search, 1000, page_size=100, max_workers=9)('q')
+        self.assertLess(time.monotonic() - start, 0.05) # two round-trips (the first page, then the other nine at once)
+        self.assertEqual(res['docno'].tolist(), [f'q-{i}' for i in range(1000)])
@@ -1,6 +1,9 @@
+import threading
+import time
 import pandas as pd
+import requests
 import unittest
-from pyterrier_services import DblpApi
+from pyterrier_services import DblpApi, DblpBibtexLoader
 
 class TestDblp(unittest.TestCase):
     def test_retriever(self):
@@ -18,3 +21,48 @@ class TestDblp(unittest.TestCase):
         self.assertIsInstance(res, pd.DataFrame)
         self.assertEqual(len(res), 1)
         self.assertEqual(set(res.columns), {'docno', 'bibtex'})
+
+
+class _FakeBibtexDblpApi(DblpApi):
+    def __init__(self):
+        super().__init__()
+        self.requests = []
+        self.failures = {'conf/b/2': 1}
+        self.in_flight = self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def _get(self, endpoint, *, params, name, text=False):
+        docno = endpoint[len('/rec/'):-len('.bib')]
+        with self._lock:
+            self.requests.append(docno)
+            fail = self.failures.get(docno, 0) > 0
+            if fail:
+                self.failures[docno] -= 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(0.05)
+        with self._lock:
+            self.in_flight -= 1
+        if fail:
+            raise requests.exceptions.ConnectionError('connection reset')
+        return f'@inproceedings{{DBLP:{docno}, param={params["param"]}}}'
+
+
+class TestDblpOffline(unittest.TestCase):
+    def test_bibtex_loader_dedupe(self):
+        api = _FakeBibtexDblpApi()
+        inp = pd.DataFrame({'qid': ['1', '1', '2', '2', '2'], 'docno': ['conf/a/1', 'conf/b/2', 'conf/b/2', 'conf/c/3', 'conf/a/1']})
+        res = DblpBibtexLoader(api=api, verbose=False, max_workers=3)(inp)
+        self.assertEqual(sorted(api.requests), ['conf/a/1', 'conf/b/2', 'conf/b/2', 'conf/c/3']) # conf/b/2 is retried once
+        self.assertGreater(api.max_in_flight, 1)
+        self.assertEqual(api.metrics.snapshot()['endpoints']['dblp/rec']['retries'], 1)
+        self.assertEqual(res['qid'].tolist(), inp['qid'].tolist())
+        self.assertEqual(res['bibtex'].tolist(), [f'@inproceedings{{DBLP:{d}, param=1}}' for d in inp['docno']])
+
+    def test_bibtex_loader_missing_docno(self):
+        api = _FakeBibtexDblpApi()
+        inp = pd.DataFrame({'qid': '1', 'docno': ['conf/a/1', None]})
+        res = DblpBibtexLoader(api=api, verbose=False)(inp)
+        self.assertEqual(api.requests, ['conf/a/1'])
+        self.assertEqual(res['bibtex'].iloc[0], '@inproceedings{DBLP:conf/a/1, param=1}')
+        self.assertTrue(pd.isna(res['bibtex'].iloc[1]))
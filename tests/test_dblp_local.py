@@ -0,0 +1,119 @@
+import gzip
+import os
+import tempfile
+import unittest
+import pandas as pd
+from pyterrier_services import DblpApi, DblpLocalApi, DblpRetriever, DblpBibtexLoader
+
+SAMPLE_DUMP = '''<?xml version="1.0" encoding="ISO-8859-1"?>
+<!DOCTYPE dblp SYSTEM "dblp.dtd">
+<dblp>
+<inproceedings mdate="2021-11-02" key="conf/cikm/MacdonaldTMO21">
+<author>Craig Macdonald</author>
+<author>Nicola Tonellotto</author>
+<author>Sean MacAvaney</author>
+<author>Iadh Ounis</author>
+<title>PyTerrier: Declarative Experimentation in Python from <i>BM25</i> to Dense Retrieval.</title>
+<pages>4526-4529</pages>
+<year>2021</year>
+<booktitle>CIKM</booktitle>
+<ee>https://doi.org/10.1145/3459637.3482013</ee>
+<crossref>conf/cikm/2021</crossref>
+<url>db/conf/cikm/cikm2021.html#MacdonaldTMO21</url>
+</inproceedings>
+<proceedings mdate="2021-11-02" key="conf/cikm/2021">
+<editor>Gianluca Demartini</editor>
+<title>CIKM '21: The 30th ACM International Conference on Information and Knowledge Management.</title>
+<booktitle>CIKM</booktitle>
+<publisher>ACM</publisher>
+<year>2021</year>
+</proceedings>
+<article mdate="2020-01-01" key="journals/tois/Muller20">
+<author>J&uuml;rgen M&uuml;ller</author>
+<title>Dense Retrieval Revisited.</title>
+<pages>1-20</pages>
+<year>2020</year>
+<volume>38</volume>
+<journal>ACM Trans. Inf. Syst.</journal>
+<ee>https://doi.org/10.1145/1234</ee>
+</article>
+<article mdate="2022-01-01" key="journals/corr/abs-2201-00001" publtype="informal">
+<author>Sean MacAvaney</author>
+<title>Retrieval Pipelines.</title>
+<year>2022</year>
+<journal>CoRR</journal>
+<volume>abs/2201.00001</volume>
+</article>
+<www mdate="2020-01-01" key="homepages/m/CraigMacdonald">
+<author>Craig Macdonald</author>
+<title>Home Page</title>
+</www>
+<www mdate="2020-01-01" key="homepages/117/9341">
+<author>J&uuml;rgen M&uuml;ller</author>
+<title>Home Page</title>
+</www>
+</dblp>
+'''
+
+
+class TestDblpLocal(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        source = os.path.join(cls.tmp.name, 'dblp.xml.gz')
+        with gzip.open(source, 'wb') as fout:
+            fout.write(SAMPLE_DUMP.encode('iso-8859-1'))
+        cls.api = DblpLocalApi.build(source, os.path.join(cls.tmp.name, 'index'), verbose=False, spill_size=5) # forces several runs
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def test_search_publications(self):
+        res = self.api.search('retrieval')
+        self.assertEqual(list(res.columns), ['docno', 'rank', 'score', 'title', 'authors', 'year', 'type'])
+        self.assertEqual(res['docno'].tolist(), ['journals/corr/abs-2201-00001', 'conf/cikm/MacdonaldTMO21', 'journals/tois/Muller20'])
+        self.assertEqual(res['rank'].tolist(), [0, 1, 2])
+        self.assertEqual(res['type'].tolist(), ['Informal and Other Publications', 'Conference and Workshop Papers', 'Journal Articles'])
+        self.assertEqual(res['title'].iloc[1], 'PyTerrier: Declarative Experimentation in Python from BM25 to Dense Retrieval')
+        self.assertEqual(res['authors'].iloc[2], ['Jürgen Müller'])
+
+        res, next_offset, total = self.api.search('dense retr', offset=1, limit=1, return_next=True, return_total=True)
+        self.assertEqual(res['rank'].tolist(), [1])
+        self.assertEqual((next_offset, total), (2, 2))
+        self.assertEqual(self.api.search('muller 2020')['docno'].tolist(), ['journals/tois/Muller20']) # diacritics are folded
+        self.assertEqual(len(self.api.search('retriev$')), 0) # exact match
+        self.assertEqual(len(self.api.search('nothing')), 0)
+
+    def test_search_authors_venues(self):
+        res = self.api.search('macdonald', entity_type='author')
+        self.assertEqual(res['docno'].tolist(), ['m/CraigMacdonald'])
+        self.assertEqual(res['author'].tolist(), ['Craig Macdonald'])
+        res = self.api.search('cikm', entity_type='venue')
+        self.assertEqual(res[['docno', 'venue', 'acronym', 'type']].values.tolist(), [['conf/cikm', 'CIKM', 'CIKM', 'Conference or Workshop']])
+        res = self.api.search('trans inf', entity_type='venue')
+        self.assertEqual(res['docno'].tolist(), ['journals/tois'])
+
+    def test_load_bibtex(self):
+        bib = self.api.load_bibtex('conf/cikm/MacdonaldTMO21')
+        self.assertTrue(bib.startswith('@inproceedings{DBLP:conf/cikm/MacdonaldTMO21,\n'))
+        self.assertIn("  booktitle    = {CIKM '21: The 30th ACM International Conference on Information and Knowledge Management}", bib)
+        self.assertIn('  editor       = {Gianluca Demartini}', bib)
+        self.assertIn('  pages        = {4526--4529}', bib)
+        self.assertIn('  doi          = {10.1145/3459637.3482013}', bib)
+        condensed = self.api.load_bibtex('conf/cikm/MacdonaldTMO21', bib_type='condensed')
+        self.assertIn('  booktitle    = {CIKM}', condensed)
+        self.assertNotIn('biburl', condensed)
+        crossref = self.api.load_bibtex('conf/cikm/MacdonaldTMO21', bib_type='with_crossref')
+        self.assertIn('  crossref     = {DBLP:conf/cikm/2021}', crossref)
+        self.assertIn('@proceedings{DBLP:conf/cikm/2021,', crossref)
+        with self.assertRaises(KeyError):
+            self.api.load_bibtex('conf/missing/X')
+
+    def test_transformers(self):
+        self.assertLessEqual(set(vars(DblpApi())), set(vars(self.api))) # shares the state of the live API
+        res = DblpRetriever(api=self.api, num_results=2, verbose=False)(pd.DataFrame([{'qid': '1', 'query': 'retrieval'}, {'qid': '2', 'query': 'pyterrier'}]))
+        self.assertEqual(res['qid'].tolist(), ['1', '1', '2'])
+        self.assertEqual(res['docno'].tolist(), ['journals/corr/abs-2201-00001', 'conf/cikm/MacdonaldTMO21', 'conf/cikm/MacdonaldTMO21'])
+        res = DblpBibtexLoader(api=self.api, verbose=False)(res)
+        self.assertTrue(res['bibtex'].iloc[2].startswith('@inproceedings{DBLP:conf/cikm/MacdonaldTMO21,'))
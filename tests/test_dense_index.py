@@ -0,0 +1,86 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+import pyterrier as pt
+from pyterrier_services import DenseIndex
+
+
+class TestDenseIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'index')
+        rng = np.random.default_rng(0)
+        self.doc_vecs = rng.standard_normal((1000, 16)).astype(np.float32)
+        self.query_vecs = rng.standard_normal((20, 16)).astype(np.float32)
+        self.topics = pd.DataFrame({'qid': [str(i) for i in range(20)], 'query_vec': list(self.query_vecs)})
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _index(self, **kwargs):
+        index = DenseIndex(self.path)
+        index.indexer(verbose=False, **kwargs).index({'docno': f'd{i}', 'doc_vec': v} for i, v in enumerate(self.doc_vecs))
+        return index
+
+    def _expected(self, num_results):
+        scores = self.query_vecs @ self.doc_vecs.T
+        top = np.argsort(-scores, axis=1, kind='stable')[:, :num_results]
+        return [[f'd{i}' for i in row] for row in top], np.take_along_axis(scores, top, axis=1)
+
+    def test_indexer(self):
+        index = self._index(shard_size=300)
+        self.assertEqual(index.meta['shards'], [300, 300, 300, 100])
+        self.assertEqual((len(index), index.dim), (1000, 16))
+        self.assertEqual(index.docnos([0, 999, 301]), ['d0', 'd999', 'd301'])
+        np.testing.assert_array_equal(index.vectors([999, 0, 301]), self.doc_vecs[[999, 0, 301]])
+        indexer = index.indexer(verbose=False, overwrite=True, shard_size=300)
+        indexer.CHUNK_SIZE = 128 # shards written over several chunks
+        indexer.index({'docno': f'd{i}', 'doc_vec': v} for i, v in enumerate(self.doc_vecs))
+        self.assertEqual(index.meta['shards'], [300, 300, 300, 100])
+        np.testing.assert_array_equal(index.vectors([999, 0, 301, 555]), self.doc_vecs[[999, 0, 301, 555]])
+        with self.assertRaises(FileExistsError):
+            index.indexer(verbose=False).index([])
+        index.indexer(verbose=False, overwrite=True).index([{'docno': 'x', 'doc_vec': [1., 0.]}, {'docno': 'y', 'doc_vec': [0., 1.]}])
+        self.assertEqual((len(index), index.dim), (2, 2))
+        with self.assertRaises(ValueError):
+            index.indexer(verbose=False, overwrite=True).index([{'docno': 'x', 'doc_vec': [1., 0.]}, {'docno': 'y', 'doc_vec': [0., 1., 0.]}])
+
+    def test_pipeline(self):
+        index = DenseIndex(self.path)
+        encoder = pt.apply.doc_vec(lambda row: self.doc_vecs[int(row['docno'][1:])])
+        (encoder >> index.indexer(verbose=False)).index({'docno': f'd{i}'} for i in range(len(self.doc_vecs)))
+        self.assertEqual(len(index), 1000)
+        np.testing.assert_array_equal(index.vectors([5]), self.doc_vecs[[5]])
+
+    def test_retriever(self):
+        index = self._index(shard_size=300)
+        expected_docnos, expected_scores = self._expected(10)
+        for kwargs in [{}, {'batch_size': 3, 'block_size': 128, 'max_workers': 3}]:
+            with self.subTest(**kwargs):
+                res = index.retriever(num_results=10, **kwargs)(self.topics)
+                self.assertEqual(list(res.columns), ['qid', 'query_vec', 'docno', 'score', 'rank'])
+                self.assertEqual(res['qid'].tolist(), [str(i) for i in range(20) for _ in range(10)])
+                self.assertEqual(res['rank'].tolist(), list(range(10)) * 20)
+                self.assertEqual(res['docno'].tolist(), [d for row in expected_docnos for d in row])
+                np.testing.assert_allclose(res['score'].to_numpy(), expected_scores.ravel(), rtol=1e-5)
+        self.assertEqual(len(index.retriever(num_results=5000)(self.topics)), 20 * 1000)
+        self.assertEqual(len(index.retriever()(self.topics.iloc[:0])), 0)
+        self.assertEqual(index.retriever(num_results=10).fuse_rank_cutoff(5).num_results, 5)
+
+    def test_ivf(self):
+        index = self._index()
+        with self.assertRaises(ValueError):
+            index.retriever(nprobe=2)(self.topics)
+        index.build_ivf(16, verbose=False)
+        self.assertEqual(index.meta['ivf']['n_lists'], 16)
+        exact = index.retriever(num_results=10)(self.topics)
+        res = DenseIndex(self.path).retriever(num_results=10, nprobe=16, block_size=16)(self.topics) # probing every cluster is exact
+        self.assertEqual(res['docno'].tolist(), exact['docno'].tolist())
+        np.testing.assert_allclose(res['score'].to_numpy(), exact['score'].to_numpy(), rtol=1e-5)
+        res = index.retriever(num_results=10, nprobe=2)(self.topics)
+        self.assertTrue(set(res['qid']) == set(self.topics['qid']))
+        self.assertTrue((res.groupby('qid')['score'].diff().dropna() <= 0).all()) # ranked by score
+        overlap = len(set(zip(res['qid'], res['docno'])) & set(zip(exact['qid'], exact['docno'])))
+        self.assertGreater(overlap, 0)
@@ -1,7 +1,11 @@
+import json
 import os
+import threading
+import time
 import unittest
+from urllib.parse import urlsplit, parse_qs
 import pandas as pd
-from pyterrier_services import GoogleApi
+from pyterrier_services import GoogleApi, RateLimiter
 
 class TestGoogle(unittest.TestCase):
     @unittest.skipIf('GOOGLE_API_KEY' not in os.environ, 'GOOGLE_API_KEY not set')
@@ -12,3 +16,68 @@ class TestGoogle(unittest.TestCase):
         self.assertIsInstance(res, pd.DataFrame)
         self.assertEqual(len(res), 15)
         self.assertEqual(set(res.columns), {'qid', 'query', 'docno', 'score', 'rank', 'url', 'title', 'snippet'})
+
+
+class _FakeHttp:
+    """Serves ``total`` results like the CSE API (answering the first request with a 429), recording the (start, num)
+    of each request and the most requests in flight at once."""
+    def __init__(self, total):
+        self.total = total
+        self.requests = []
+        self.in_flight = self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        import httplib2
+        params = {k: v[0] for k, v in parse_qs(urlsplit(uri).query).items()}
+        start, num = int(params['start']), int(params['num'])
+        with self.lock:
+            self.requests.append((start, num))
+            if len(self.requests) == 1:
+                return httplib2.Response({'status': 429, 'retry-after': '0'}), b'{"error": {"code": 429, "message": "quota"}}'
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(0.05)
+        with self.lock:
+            self.in_flight -= 1
+        if num > 10 or start + num > 100:
+            return httplib2.Response({'status': 400}), b'{"error": {"code": 400, "message": "invalid argument"}}'
+        items = [{'link': f'https://example.com/{i}', 'title': f't{i}', 'snippet': f's{i}'} for i in range(start - 1, min(start - 1 + num, self.total))]
+        return httplib2.Response({'status': 200}), json.dumps({'searchInformation': {'totalResults': str(self.total)}, 'items': items}).encode()
+
+
+class TestGoogleOffline(unittest.TestCase):
+    def setUp(self):
+        try:
+            import googleapiclient # noqa: F401
+        except ModuleNotFoundError:
+            self.skipTest('google-api-python-client not installed')
+
+    def _api(self, total):
+        api = GoogleApi(api_key='test', rate_limiter=RateLimiter(1000., burst=1000.))
+        api.http = _FakeHttp(total)
+        api._http = lambda: api.http
+        return api
+
+    def test_retriever(self):
+        api = self._api(1000)
+        topics = pd.DataFrame({'qid': ['1'], 'query': ['q']})
+        res = api.retriever('cx', num_results=200)(topics)
+        self.assertGreater(api.http.max_in_flight, 1) # the first page (retried once), then the other nine at once
+        self.assertEqual(res['rank'].tolist(), list(range(GoogleApi.MAX_RESULTS)))
+        self.assertEqual(res['docno'].tolist(), [f'https://example.com/{i}' for i in range(GoogleApi.MAX_RESULTS)])
+        self.assertEqual(sorted(api.http.requests), [(1, 10)] + [(s, 10) for s in range(1, 91, 10)] + [(91, 9)])
+        self.assertEqual(api.metrics.snapshot()['endpoints']['google/customsearch']['retries'], 1)
+
+    def test_shared_service(self):
+        api = self._api(15)
+        builds = []
+        build = api._build
+        api._build = lambda *args, **kwargs: builds.append(kwargs) or build(*args, **kwargs)
+        retr = api.retriever('cx', num_results=50)
+        res = retr(pd.DataFrame({'qid': ['1', '2'], 'query': ['a', 'b']}))
+        self.assertEqual(res['rank'].tolist(), list(range(15)) * 2) # no requests past the total
+        self.assertEqual(len(retr.fuse_rank_cutoff(5)(pd.DataFrame({'qid': ['1'], 'query': ['a']}))), 5)
+        self.assertEqual(len(builds), 1)
+        self.assertTrue(builds[0]['static_discovery'])
+        self.assertIs(retr.fuse_rank_cutoff(5).cse_service, retr.cse_service)
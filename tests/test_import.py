@@ -0,0 +1,37 @@
+import json
+import subprocess
+import sys
+import unittest
+import pyterrier_services
+
+
+def _run(code):
+    """Runs ``code`` in a fresh interpreter (so that nothing is imported yet), returning its JSON output."""
+    res = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    return json.loads(res.stdout)
+
+
+class TestImport(unittest.TestCase):
+    def test_lazy_imports(self):
+        loaded = _run('import sys, json, pyterrier_services; print(json.dumps(sorted(sys.modules)))')
+        for module in ['pyterrier', 'pandas', 'requests', 'pyterrier_services.core', 'pyterrier_services.dblp']:
+            self.assertNotIn(module, loaded)
+
+        loaded = _run('import sys, json; from pyterrier_services import DblpApi; print(json.dumps(sorted(sys.modules)))')
+        self.assertIn('pyterrier_services.dblp', loaded)
+        for module in ['pyterrier_services.semantic_scholar', 'pyterrier_services.pinecone', 'pyterrier_services.google', 'pinecone', 'googleapiclient']:
+            self.assertNotIn(module, loaded)
+
+    def test_import_time(self):
+        # cumulative import time of the package itself (in microseconds), as reported by -X importtime
+        res = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import pyterrier_services'], capture_output=True, text=True, check=True)
+        times = [int(line.split('|')[1]) for line in res.stderr.splitlines() if line.split('|')[-1].strip() == 'pyterrier_services']
+        self.assertEqual(len(times), 1)
+        self.assertLess(times[0], 50_000) # well under the ~1s it takes to import pyterrier and pandas
+
+    def test_attributes(self):
+        for name in pyterrier_services.__all__:
+            self.assertIs(getattr(pyterrier_services, name), getattr(sys.modules[getattr(pyterrier_services, name).__module__], name))
+        self.assertTrue(set(pyterrier_services.__all__) <= set(dir(pyterrier_services)))
+        with self.assertRaises(AttributeError):
+            getattr(pyterrier_services, 'NotAThing')
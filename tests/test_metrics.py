@@ -0,0 +1,58 @@
+import tempfile
+import unittest
+from pyterrier_services import Metrics, ResponseCache
+
+
+class TestMetrics(unittest.TestCase):
+    def test_request(self):
+        events = []
+        metrics = Metrics(listeners=[lambda event, name, value: events.append((event, name))])
+        with metrics.request('svc/a') as req:
+            req.observe(200, 10)
+        with metrics.request('svc/a') as req:
+            req.observe(429)
+        with self.assertRaises(ValueError):
+            with metrics.request('svc/b'):
+                raise ValueError()
+        endpoints = metrics.snapshot()['endpoints']
+        self.assertEqual(endpoints['svc/a']['requests'], 2)
+        self.assertEqual(endpoints['svc/a']['errors'], 1)
+        self.assertEqual(endpoints['svc/a']['statuses'], {'200': 1, '429': 1})
+        self.assertEqual(endpoints['svc/a']['bytes'], 10)
+        self.assertEqual(sum(endpoints['svc/a']['latency']['counts']), 2)
+        self.assertEqual(len(endpoints['svc/a']['latency']['counts']), len(Metrics.LATENCY_BUCKETS) + 1)
+        self.assertEqual(endpoints['svc/b']['errors'], 1) # raised before observing
+        self.assertEqual(events.count(('error', 'svc/a')), 1)
+        self.assertEqual(events.count(('request', 'svc/b')), 1)
+
+    def test_retry_and_cache(self):
+        metrics = Metrics()
+        metrics.record_retry('svc/a', 1.5)
+        metrics.record_retry('svc/a', 0.5)
+        with tempfile.TemporaryDirectory() as d:
+            cache = ResponseCache(f'{d}/cache.sqlite')
+            fetches = []
+            for _ in range(3):
+                res = metrics.get_or_fetch(cache, 'svc/a', 'svc', 'a', {'q': 1}, lambda: fetches.append(1) or {'ok': True})
+                self.assertEqual(res, {'ok': True})
+            self.assertEqual(len(fetches), 1)
+            metrics.get_or_fetch(None, 'svc/a', 'svc', 'a', {'q': 1}, lambda: fetches.append(1))
+            self.assertEqual(len(fetches), 2) # no cache: always fetched, nothing recorded
+        self.assertEqual(metrics.stats(), {'requests': 0, 'errors': 0, 'bytes': 0, 'retries': 2, 'cooldown': 2., 'cache_hits': 2, 'cache_misses': 1})
+        self.assertEqual(metrics.snapshot()['stages'], {'cooldown': 2.})
+
+    def test_call(self):
+        metrics = Metrics(history=2)
+        metrics.add_time('parse', 1.)
+        for i in range(3):
+            with metrics.call(f'call{i}'):
+                metrics.add_time('parse', 0.25)
+                with metrics.timer('assemble'):
+                    pass
+        calls = metrics.snapshot()['calls']
+        self.assertEqual([c['name'] for c in calls], ['call1', 'call2'])
+        self.assertEqual(calls[-1]['stages']['parse'], 0.25) # only the time spent during the call
+        self.assertIn('assemble', calls[-1]['stages'])
+        self.assertEqual(metrics.snapshot()['stages']['parse'], 1.75)
+        metrics.reset()
+        self.assertEqual(metrics.snapshot(), {'endpoints': {}, 'stages': {}, 'calls': []})
@@ -1,7 +1,35 @@
 import os
+import tempfile
+import threading
 import unittest
+from types import SimpleNamespace
 import pandas as pd
-from pyterrier_services import PineconeApi
+from pyterrier_services import PineconeApi, PineconeDenseModel, PineconeSparseModel, PineconeReranker, InferenceCache, Metrics
+
+
+class FakePineconeApi:
+    """Stands in for PineconeApi, with deterministic embeddings derived from the input text."""
+    def __init__(self):
+        self.embed_calls = []
+        self.rerank_calls = []
+        self.metrics = Metrics()
+        self._lock = threading.Lock()
+
+    def _embed(self, model, inputs, parameters):
+        with self._lock:
+            self.embed_calls.append(list(inputs))
+        if 'sparse' in model:
+            data = [SimpleNamespace(sparse_tokens=sorted(set(text.lower().split())), sparse_values=[1.] * len(set(text.lower().split()))) for text in inputs]
+            return SimpleNamespace(vector_type='sparse', data=data)
+        data = [SimpleNamespace(values=[float(len(text)), float(text.count('a')), 1.]) for text in inputs]
+        return SimpleNamespace(vector_type='dense', data=data)
+
+    def _rerank(self, model, query, documents, return_documents, parameters, top_n=None):
+        with self._lock:
+            self.rerank_calls.append(list(documents))
+        scores = [float(sum(doc.split().count(q) for q in query.split())) for doc in documents]
+        order = sorted(range(len(documents)), key=lambda i: -scores[i])[:top_n]
+        return SimpleNamespace(data=[SimpleNamespace(index=i, score=scores[i]) for i in order])
 
 class TestPinecone(unittest.TestCase):
     @unittest.skipIf('PINECONE_API_KEY' not in os.environ, 'PINECONE_API_KEY not set')
@@ -33,3 +61,133 @@ class TestPinecone(unittest.TestCase):
         self.assertIsInstance(res, pd.DataFrame)
         self.assertEqual(len(res), 2)
         self.assertEqual(set(res.columns), {'qid', 'query', 'docno', 'text', 'rank', 'score'})
+
+
+class TestPineconeOffline(unittest.TestCase):
+    def test_dense_batching(self):
+        api = FakePineconeApi()
+        model = PineconeDenseModel(api=api, batch_size=3, batch_tokens=1000, max_workers=2)
+        docs = pd.DataFrame({'docno': [str(i) for i in range(10)], 'text': ['a' * i for i in range(10)]})
+        res = model.doc_encoder()(docs)
+        self.assertEqual([len(batch) for batch in api.embed_calls], [3, 3, 3, 1])
+        self.assertEqual([v[0] for v in res['doc_vec']], list(range(10))) # input order preserved
+
+    def test_token_batching(self):
+        api = FakePineconeApi()
+        model = PineconeSparseModel(api=api, batch_size=96, batch_tokens=30)
+        docs = pd.DataFrame({'docno': ['1', '2', '3'], 'text': ['x ' * 40, 'y', 'z ' * 20]}) # ~21, 1 and 11 tokens
+        res = model.doc_encoder()(docs)
+        self.assertEqual([len(batch) for batch in api.embed_calls], [2, 1])
+        self.assertEqual(res['toks'].tolist(), [{'x': 1.}, {'y': 1.}, {'z': 1.}])
+
+    def test_cache(self):
+        with tempfile.TemporaryDirectory() as d:
+            api = FakePineconeApi()
+            cache = InferenceCache(d)
+            dense = PineconeDenseModel(api=api, cache=cache)
+            sparse = PineconeSparseModel('pinecone-sparse-english-v0', api=api, cache=cache)
+            docs = pd.DataFrame({'docno': ['1', '2', '3'], 'text': ['aa b', 'c', 'aa b']})
+            res1 = dense.doc_encoder()(docs)
+            self.assertEqual(api.embed_calls, [['aa b', 'c']]) # duplicates only encoded once
+            res2 = dense.doc_encoder()(pd.concat([docs, pd.DataFrame({'docno': ['4'], 'text': ['d']})]))
+            self.assertEqual(api.embed_calls, [['aa b', 'c'], ['d']]) # only misses encoded
+            self.assertEqual([v.tolist() for v in res1['doc_vec']], [v.tolist() for v in res2['doc_vec'].iloc[:3]])
+            self.assertEqual(res2['doc_vec'].iloc[3].tolist(), [1., 0., 1.])
+            dense.query_encoder()(pd.DataFrame({'qid': ['1'], 'query': ['aa b']}))
+            self.assertEqual(api.embed_calls[-1], ['aa b']) # keyed by input type
+
+            sparse.doc_encoder()(docs)
+            res = sparse.doc_encoder()(docs)
+            self.assertEqual(api.embed_calls[-1], ['aa b', 'c'])
+            self.assertEqual(res['toks'].tolist(), [{'aa': 1., 'b': 1.}, {'c': 1.}, {'aa': 1., 'b': 1.}])
+
+            reranker = PineconeReranker(api=api, cache=cache)
+            inp = pd.DataFrame({'qid': ['1', '1'], 'query': ['b', 'b'], 'docno': ['1', '2'], 'text': ['aa b', 'c']})
+            reranker(inp)
+            res = reranker(pd.concat([inp, pd.DataFrame({'qid': ['1'], 'query': ['b'], 'docno': ['3'], 'text': ['b b']})]))
+            self.assertEqual(api.rerank_calls, [['aa b', 'c'], ['b b']])
+            self.assertEqual(res['docno'].tolist(), ['3', '1', '2'])
+            self.assertEqual(res['score'].tolist(), [2., 1., 0.])
+            self.assertEqual(InferenceCache(d).get_rerank('pinecone-rerank-v0', 'b', ['c']), [0.]) # persisted
+
+            res = reranker(inp.iloc[:0])
+            self.assertEqual(len(res), 0)
+            self.assertEqual(len(api.rerank_calls), 2)
+
+            endpoints = api.metrics.snapshot()['endpoints']
+            self.assertEqual({k: endpoints['pinecone/embed'][k] for k in ['requests', 'cache_hits', 'cache_misses']}, {'requests': len(api.embed_calls), 'cache_hits': 4, 'cache_misses': 6})
+            self.assertEqual({k: endpoints['pinecone/rerank'][k] for k in ['requests', 'cache_hits', 'cache_misses']}, {'requests': 2, 'cache_hits': 2, 'cache_misses': 3})
+
+            # non-integer weights are the same whether they come from the API or the cache
+            api._embed = lambda model, inputs, parameters: SimpleNamespace(vector_type='sparse', data=[SimpleNamespace(sparse_tokens=['a'], sparse_values=[0.1]) for _ in inputs])
+            queries = pd.DataFrame({'qid': ['1'], 'query': ['e']})
+            cold = sparse.query_encoder()(queries)
+            warm = sparse.query_encoder()(queries)
+            self.assertEqual(cold['query_toks'].tolist(), [{'a': 0.1}])
+            self.assertEqual(warm['query_toks'].tolist(), cold['query_toks'].tolist())
+
+    def test_reranker_chunks(self):
+        api = FakePineconeApi()
+        inp = pd.DataFrame({
+            'qid': ['2', '1', '2', '1', '2', '2', '1'],
+            'query': ['b', 'a', 'b', 'a', 'b', 'b', 'a'],
+            'docno': ['1', '2', '3', '4', '5', '6', '7'],
+            'text': ['b', 'a a', 'c', 'a', 'b b b', 'b b', 'c'],
+        })
+        res = PineconeReranker(api=api, batch_size=2, max_workers=3)(inp)
+        self.assertEqual(sorted(len(c) for c in api.rerank_calls), [1, 2, 2, 2])
+        self.assertEqual(res['qid'].tolist(), ['2', '2', '2', '2', '1', '1', '1'])
+        self.assertEqual(res['docno'].tolist(), ['5', '6', '1', '3', '2', '4', '7'])
+        self.assertEqual(res['rank'].tolist(), [0, 1, 2, 3, 0, 1, 2])
+
+        res = PineconeReranker(api=api, batch_size=2, top_n=2)(inp)
+        self.assertEqual(res['docno'].tolist(), ['5', '6', '2', '4'])
+        self.assertEqual(res['rank'].tolist(), [0, 1, 0, 1])
+
+    def test_dense_scorer(self):
+        api = FakePineconeApi()
+        model = PineconeDenseModel(api=api)
+        inp = pd.DataFrame({
+            'qid': ['2', '2', '1', '2', '1'],
+            'query': ['aa', 'aa', 'a', 'aa', 'a'],
+            'docno': ['1', '2', '3', '4', '5'],
+            'text': ['a', 'aaa', 'b', 'aa', 'aab'],
+        })
+        res = model.scorer()(inp)
+        self.assertEqual(sorted(api.embed_calls), sorted([['aa', 'a'], ['a', 'aaa', 'b', 'aa', 'aab']])) # one encoding per unique query
+        self.assertEqual(res['qid'].tolist(), ['2', '2', '2', '1', '1'])
+        self.assertEqual(res['docno'].tolist(), ['2', '4', '1', '5', '3'])
+        self.assertEqual(res['rank'].tolist(), [0, 1, 2, 0, 1])
+        self.assertEqual(res['score'].tolist(), [2*3 + 2*3 + 1, 2*2 + 2*2 + 1, 2*1 + 2*1 + 1, 1*3 + 1*2 + 1, 1*1 + 0 + 1])
+
+    def test_sparse_scorer(self):
+        api = FakePineconeApi()
+        model = PineconeSparseModel(api=api)
+        inp = pd.DataFrame({
+            'qid': ['2', '2', '1', '1'],
+            'query': ['a b', 'a b', 'c', 'c'],
+            'docno': ['1', '2', '3', '4'],
+            'text': ['a', 'a b c', 'd', 'c'],
+        })
+        res = model(inp)
+        self.assertEqual(sorted(api.embed_calls), sorted([['a b', 'c'], ['a', 'a b c', 'd', 'c']]))
+        self.assertEqual(res['docno'].tolist(), ['2', '1', '4', '3'])
+        self.assertEqual(res['score'].tolist(), [2., 1., 1., 0.])
+        self.assertEqual(res['rank'].tolist(), [0, 1, 0, 1])
+
+    def test_sparse_csr(self):
+        api = FakePineconeApi()
+        model = PineconeSparseModel(api=api, sparse_format='csr')
+        res = model.doc_encoder()(pd.DataFrame({'docno': ['1', '2', '3'], 'text': ['a b', 'b c', 'a b']}))
+        self.assertEqual(res['toks'].tolist(), [{'a': 1., 'b': 1.}, {'b': 1., 'c': 1.}, {'a': 1., 'b': 1.}])
+        self.assertEqual(res['toks'][1]['c'], 1.)
+        self.assertNotIn('a', res['toks'][1])
+        self.assertIs(res['toks'][0]._vectors, res['toks'][2]._vectors) # backed by one shared batch
+
+    def test_sparse_dict_precision(self):
+        api = FakePineconeApi()
+        api._embed = lambda model, inputs, parameters: SimpleNamespace(vector_type='sparse', data=[SimpleNamespace(sparse_tokens=['a'], sparse_values=[0.1]) for _ in inputs])
+        res = PineconeSparseModel(api=api).doc_encoder()(pd.DataFrame({'docno': ['1'], 'text': ['a']}))
+        self.assertEqual(res['toks'][0], {'a': 0.1}) # not rounded to float32
+        res = PineconeSparseModel(api=api, sparse_format='csr').doc_encoder()(pd.DataFrame({'docno': ['1'], 'text': ['a']}))
+        self.assertAlmostEqual(res['toks'][0]['a'], 0.1, places=6)
@@ -0,0 +1,123 @@
+import asyncio
+import os
+import tempfile
+import threading
+import time
+import unittest
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from pyterrier_services import Metrics, RateLimiter, http_error_retry
+from pyterrier_services.ratelimit import retry_after
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_rate(self):
+        limiter = RateLimiter(20., burst=1.)
+        start = time.time()
+        for _ in range(6):
+            with limiter.limit():
+                pass
+        self.assertGreaterEqual(time.time() - start, 0.2) # 5 refills at 20/sec
+        self.assertEqual(limiter.stats()['requests'], 6)
+
+    def test_shared_file(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'bucket')
+            limiters = [RateLimiter(20., burst=1., path=path) for _ in range(2)] # e.g., in two processes
+            start = time.time()
+            for i in range(6):
+                with limiters[i % 2].limit():
+                    pass
+            self.assertGreaterEqual(time.time() - start, 0.2)
+
+    def test_aimd(self):
+        limiter = RateLimiter(1000., burst=1000., max_concurrency=8)
+        self.assertEqual(limiter.stats()['concurrency'], 8)
+        with limiter.limit() as permit:
+            permit.observe(429)
+        self.assertEqual(limiter.stats()['concurrency'], 4)
+        with limiter.limit() as permit:
+            permit.observe(429)
+        self.assertEqual(limiter.stats()['concurrency'], 2)
+        for _ in range(6): # roughly +1 per `concurrency` successes: 2 -> 2.5 -> 2.9 -> ... -> 4.09
+            with limiter.limit() as permit:
+                permit.observe(200)
+        self.assertEqual(limiter.stats()['concurrency'], 4)
+        self.assertEqual(limiter.stats()['throttled'], 2)
+
+    def test_concurrency_bound(self):
+        limiter = RateLimiter(1000., burst=1000., max_concurrency=2)
+        in_flight, peak = [0], [0]
+        def work(_):
+            with limiter.limit():
+                in_flight[0] += 1
+                peak[0] = max(peak[0], in_flight[0])
+                time.sleep(0.02)
+                in_flight[0] -= 1
+        with ThreadPoolExecutor(8) as pool:
+            list(pool.map(work, range(16)))
+        self.assertLessEqual(peak[0], 2)
+
+    def test_async_concurrency_bound(self):
+        limiter = RateLimiter(1000., burst=1000., max_concurrency=2)
+        active, peak = [0], [0]
+        async def work():
+            async with limiter.async_limit():
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+                await asyncio.sleep(0.01)
+                active[0] -= 1
+        held = threading.Event()
+        def hold():
+            with limiter.limit():
+                held.set()
+                time.sleep(0.05)
+        async def main():
+            loop = asyncio.get_running_loop()
+            with ThreadPoolExecutor(1) as pool:
+                holder = loop.run_in_executor(pool, hold) # a slot held by another thread, released while the coroutines wait
+                await loop.run_in_executor(None, held.wait)
+                await asyncio.wait_for(asyncio.gather(holder, *[work() for _ in range(10)]), timeout=5.)
+        asyncio.run(main())
+        self.assertEqual(peak[0], 2)
+        self.assertEqual(limiter.stats()['requests'], 11)
+
+        with tempfile.TemporaryDirectory() as d:
+            limiter = RateLimiter(1000., burst=1000., max_concurrency=2, path=os.path.join(d, 'bucket'))
+            async def shared():
+                await asyncio.gather(*[work() for _ in range(4)])
+            asyncio.run(shared())
+            self.assertEqual(limiter.stats()['requests'], 4)
+
+    def test_retry_after(self):
+        self.assertEqual(retry_after({'Retry-After': '3'}), 3.)
+        self.assertEqual(retry_after({'retry-after': '1.5'}), 1.5)
+        self.assertIsNone(retry_after({}))
+        self.assertEqual(retry_after({'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'}), 0.)
+        limiter = RateLimiter(1000., burst=1000.)
+        with limiter.limit() as permit:
+            permit.observe(429, {'Retry-After': '0.1'})
+        start = time.time()
+        with limiter.limit():
+            pass
+        self.assertGreaterEqual(time.time() - start, 0.05)
+
+    def test_retry_after_once(self):
+        # the Retry-After of a throttled request pauses the limiter, and is not slept again before retrying
+        limiter = RateLimiter(1000., burst=1000.)
+        metrics = Metrics()
+        calls = []
+        def fn():
+            with limiter.limit() as permit:
+                calls.append(time.time())
+                if len(calls) == 1:
+                    response = requests.Response()
+                    response.status_code = 429
+                    response.headers['Retry-After'] = '0.2'
+                    permit.observe(429, response.headers)
+                    raise requests.exceptions.HTTPError(response=response)
+                return 'ok'
+        self.assertEqual(http_error_retry(fn, rate_limiter=limiter, endpoint='svc/a', metrics=metrics)(), 'ok')
+        self.assertGreaterEqual(calls[1] - calls[0], 0.15) # waited for the pause
+        self.assertEqual(metrics.stats()['retries'], 1)
+        self.assertEqual(metrics.stats()['cooldown'], 0.) # without sleeping in the retry loop
@@ -0,0 +1,151 @@
+import asyncio
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from pyterrier_services import http_error_retry, async_http_error_retry, HedgePolicy, CircuitBreaker, CircuitOpenError, SingleFlight
+
+
+def _http_error(status_code):
+    response = requests.Response()
+    response.status_code = status_code
+    return requests.exceptions.HTTPError(response=response)
+
+
+class TestResilience(unittest.TestCase):
+    def test_retry_transient(self):
+        calls = []
+        def fn():
+            calls.append(1)
+            if len(calls) == 1:
+                raise _http_error(503)
+            if len(calls) == 2:
+                raise requests.exceptions.ConnectionError('connection reset')
+            return 'ok'
+        self.assertEqual(http_error_retry(fn, cooldown=0.)(), 'ok')
+        self.assertEqual(len(calls), 3)
+
+    def test_no_retry_client_error(self):
+        calls = []
+        def fn():
+            calls.append(1)
+            raise _http_error(404)
+        with self.assertRaises(requests.exceptions.HTTPError):
+            http_error_retry(fn, cooldown=0.)()
+        self.assertEqual(len(calls), 1)
+
+    def test_no_cooldown(self):
+        calls = []
+        def fn():
+            calls.append(1)
+            raise _http_error(429)
+        with self.assertRaises(requests.exceptions.HTTPError):
+            http_error_retry(fn, cooldown=None)()
+        self.assertEqual(len(calls), 1)
+
+    def test_circuit_breaker(self):
+        breaker = CircuitBreaker(failure_threshold=3, reset_timeout=0.1)
+        calls = []
+        def failing():
+            calls.append(1)
+            raise requests.exceptions.Timeout()
+        fn = http_error_retry(failing, retries=5, cooldown=0., circuit_breaker=breaker, endpoint='svc/search')
+        with self.assertRaises(CircuitOpenError):
+            fn()
+        self.assertEqual(len(calls), 3)
+        with self.assertRaises(CircuitOpenError):
+            fn() # fails fast without calling
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(breaker.stats(), {'opened': 1, 'rejected': 2, 'open': 1})
+        time.sleep(0.1)
+        self.assertEqual(http_error_retry(lambda: 'ok', circuit_breaker=breaker, endpoint='svc/search')(), 'ok') # trial succeeds
+        self.assertEqual(breaker.stats()['open'], 0)
+
+    def test_circuit_breaker_client_error(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30.)
+        def missing():
+            raise _http_error(404)
+        fn = http_error_retry(missing, cooldown=0., circuit_breaker=breaker, endpoint='svc/paper')
+        for _ in range(5):
+            with self.assertRaises(requests.exceptions.HTTPError):
+                fn()
+        self.assertEqual(breaker.stats(), {'opened': 0, 'rejected': 0, 'open': 0})
+        self.assertEqual(http_error_retry(lambda: 'ok', circuit_breaker=breaker, endpoint='svc/paper')(), 'ok')
+
+    def test_hedge(self):
+        hedge = HedgePolicy(50., min_samples=3)
+        for _ in range(3):
+            hedge.run(time.sleep, 0.01)
+        calls = []
+        def slow_first():
+            calls.append(1)
+            time.sleep(0.5 if len(calls) == 1 else 0.01)
+            return len(calls)
+        start = time.time()
+        self.assertEqual(http_error_retry(slow_first, hedge=hedge)(), 2)
+        self.assertLess(time.time() - start, 0.4)
+        self.assertEqual(hedge.stats(), {'requests': 4, 'hedged': 1, 'hedge_wins': 1})
+
+    def test_hedge_queued(self):
+        hedge = HedgePolicy(50., min_samples=3, max_workers=2)
+        for _ in range(3):
+            hedge.run(time.sleep, 0.05)
+        pool = hedge._get_pool()
+        busy = [pool.submit(time.sleep, 0.2) for _ in range(2)] # the original waits for a worker longer than the delay
+        self.assertIsNone(hedge.run(time.sleep, 0.01))
+        self.assertEqual(hedge.stats()['hedged'], 0) # the delay only counts once the original has started
+        for future in busy:
+            future.result()
+        hedge.close()
+        self.assertIsNone(hedge._pool)
+        self.assertIsNone(hedge.run(time.sleep, 0.01)) # re-creates the pool
+        hedge.close()
+
+    def test_async_hedge(self):
+        hedge = HedgePolicy(50., min_samples=3)
+        async def main():
+            for _ in range(3):
+                await hedge.async_run(asyncio.sleep, 0.01)
+            calls = []
+            async def slow_first():
+                calls.append(1)
+                await asyncio.sleep(0.5 if len(calls) == 1 else 0.01)
+                return len(calls)
+            return await async_http_error_retry(slow_first, hedge=hedge)()
+        self.assertEqual(asyncio.run(main()), 2)
+        self.assertEqual(hedge.stats()['hedge_wins'], 1)
+
+    def test_single_flight(self):
+        flights = SingleFlight()
+        calls = []
+        def search(query, offset=0):
+            calls.append((query, offset))
+            time.sleep(0.1)
+            if query == 'fail':
+                raise ValueError(query)
+            return f'{query}@{offset}'
+        search = flights.wrap(search, 'svc/search')
+        with ThreadPoolExecutor(6) as pool:
+            futures = [pool.submit(search, q, offset=o) for q, o in [('a', 0), ('a', 0), ('a', 10), ('a', 0), ('fail', 0), ('fail', 0)]]
+            self.assertEqual([f.result() for f in futures[:4]], ['a@0', 'a@0', 'a@10', 'a@0'])
+            for f in futures[4:]:
+                with self.assertRaises(ValueError): # errors are shared with every waiting call
+                    f.result()
+        self.assertEqual(sorted(calls), [('a', 0), ('a', 10), ('fail', 0)])
+        self.assertEqual(flights.stats(), {'calls': 6, 'coalesced': 3})
+        self.assertEqual(search('a'), 'a@0') # nothing is kept once a call finishes
+        self.assertEqual(len(calls), 4)
+
+    def test_async_single_flight(self):
+        flights = SingleFlight()
+        calls = []
+        async def search(query):
+            calls.append(query)
+            await asyncio.sleep(0.05)
+            return query.upper()
+        search = flights.async_wrap(search, 'svc/search')
+        async def main():
+            return await asyncio.gather(search('a'), search('b'), search('a'))
+        self.assertEqual(asyncio.run(main()), ['A', 'B', 'A'])
+        self.assertEqual(calls, ['a', 'b'])
+        self.assertEqual(flights.stats(), {'calls': 3, 'coalesced': 1})
@@ -1,6 +1,11 @@
+import json
+import threading
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
 import pandas as pd
-from pyterrier_services import SemanticScholarApi
+from pyterrier_services import SemanticScholarApi, RateLimiter
 
 class TestSemanticScholar(unittest.TestCase):
     def test_retriever(self):
@@ -10,3 +15,123 @@ class TestSemanticScholar(unittest.TestCase):
         self.assertIsInstance(res, pd.DataFrame)
         self.assertEqual(len(res), 15)
         self.assertEqual(set(res.columns), {'qid', 'query', 'docno', 'score', 'rank', 'title', 'abstract', 'authors', 'openAccessPdf'})
+
+
+def _response(body):
+    return SimpleNamespace(status_code=200, headers={}, content=json.dumps(body).encode(), raise_for_status=lambda: None)
+
+
+class _FakeTransport:
+    """Answers /paper/batch requests for the papers "p<i>" (other IDs are not found), and searches over 2,500 papers."""
+    def __init__(self):
+        self.requests = []
+        self.searches = []
+        self._lock = threading.Lock()
+
+    def get(self, url, *, params=None, headers=None):
+        with self._lock:
+            self.searches.append((url.split('/graph/v1')[1], dict(params)))
+        fields = params['fields'].split(',')
+        if url.endswith('/paper/search/bulk'):
+            start = int(params.get('token', 0))
+            ids = range(start, min(start + 1000, 2500))
+            body = {'total': 2500, 'token': str(ids.stop) if ids.stop < 2500 else None}
+        else:
+            start = params['offset']
+            ids = range(start, min(start + params['limit'], 1000))
+            body = {'total': 2500, 'offset': start, 'next': ids.stop}
+        body['data'] = [{'paperId': f'p{i}', **{f: f'{f}-p{i}' for f in fields}} for i in ids]
+        return _response(body)
+
+    def post(self, url, *, params=None, json=None, headers=None):
+        assert url.endswith('/paper/batch')
+        with self._lock:
+            self.requests.append(list(json['ids']))
+        fields = params['fields'].split(',')
+        papers = [{'paperId': i, **{f: f'{f}-{i}' for f in fields}} if i.startswith('p') else None for i in json['ids']]
+        return _response(papers)
+
+
+class TestSemanticScholarOffline(unittest.TestCase):
+    def test_loader(self):
+        transport = _FakeTransport()
+        s2 = SemanticScholarApi(transport=transport, rate_limiter=RateLimiter(1000., burst=1000.))
+        docnos = [f'p{i % 700}' for i in range(1000)] + ['missing']
+        inp = pd.DataFrame({'qid': '1', 'docno': docnos, 'title': 'old'})
+        res = s2.loader(fields=['title', 'year'], verbose=False, max_workers=2)(inp)
+        self.assertEqual(sorted(len(r) for r in transport.requests), [201, 500]) # 701 unique IDs in chunks of 500
+        self.assertEqual(list(res.columns), ['qid', 'docno', 'title', 'year'])
+        self.assertEqual(res['title'].iloc[705], 'title-p5')
+        self.assertEqual(res['year'].iloc[3], 'year-p3')
+        self.assertTrue(pd.isna(res['year'].iloc[-1]))
+
+    def test_loader_missing_docno(self):
+        s2 = SemanticScholarApi(transport=_FakeTransport(), rate_limiter=RateLimiter(1000., burst=1000.))
+        inp = pd.DataFrame({'qid': '1', 'docno': ['p1', None, 'p2']})
+        res = s2.loader(fields=['title'], verbose=False)(inp)
+        self.assertEqual(res['title'].iloc[0], 'title-p1')
+        self.assertTrue(pd.isna(res['title'].iloc[1]))
+        self.assertEqual(res['title'].iloc[2], 'title-p2')
+
+    def test_single_flight(self):
+        transport = _FakeTransport()
+        get = transport.get
+        def slow_get(*args, **kwargs):
+            time.sleep(0.05)
+            return get(*args, **kwargs)
+        transport.get = slow_get
+        s2 = SemanticScholarApi(transport=transport, rate_limiter=RateLimiter(1000., burst=1000.))
+        retr = s2.retriever(num_results=150, verbose=False)
+        topics = [{'qid': str(i), 'query': 'dense retrieval'} for i in range(4)]
+        with ThreadPoolExecutor(2) as pool: # overlapping pipelines sending the same requests
+            results = list(pool.map(lambda _: list(retr.transform_iter(topics)), range(2)))
+        self.assertEqual(results[0], results[1])
+        self.assertEqual([r['qid'] for r in results[0][::150]], ['0', '1', '2', '3'])
+        self.assertEqual(len(transport.searches), 8) # two pages per query, each shared by both pipelines
+        self.assertEqual(s2.single_flight.stats(), {'calls': 16, 'coalesced': 8})
+
+    def test_transform_iter_call(self):
+        s2 = SemanticScholarApi(transport=_FakeTransport(), rate_limiter=RateLimiter(1000., burst=1000.))
+        it = s2.retriever(num_results=150, verbose=False).transform_iter([{'qid': '1', 'query': 'dense retrieval'}])
+        self.assertEqual(s2.metrics.snapshot()['calls'], []) # recorded once the results are consumed
+        self.assertEqual(len(list(it)), 150)
+        calls = s2.metrics.snapshot()['calls']
+        self.assertEqual([c['name'] for c in calls], ['SemanticScholarRetriever'])
+        self.assertGreater(calls[0]['stages']['request'], 0.)
+
+    def test_batch(self):
+        s2 = SemanticScholarApi(transport=_FakeTransport(), rate_limiter=RateLimiter(1000., burst=1000.))
+        res = s2.batch(['p2', 'x', 'p1'], fields=['authors.name', 'citationCount'])
+        self.assertEqual(list(res.columns), ['docno', 'authors', 'citationCount'])
+        self.assertEqual(res['docno'].tolist(), ['p2', 'x', 'p1'])
+        self.assertEqual(res['citationCount'].iloc[[0, 2]].tolist(), ['citationCount-p2', 'citationCount-p1'])
+        self.assertTrue(pd.isna(res['citationCount'].iloc[1]))
+
+    def test_bulk_retriever(self):
+        transport = _FakeTransport()
+        s2 = SemanticScholarApi(transport=transport, rate_limiter=RateLimiter(1000., burst=1000.))
+        topics = pd.DataFrame([{'qid': '1', 'query': 'dense retrieval'}])
+
+        retr = s2.retriever(num_results=2200, verbose=False, filters={'year': '2020-'})
+        self.assertTrue(retr.bulk) # more results than /paper/search can serve
+        res = retr(topics)
+        self.assertEqual(res['rank'].tolist(), list(range(2200)))
+        self.assertEqual(res['score'].tolist(), [-r for r in range(2200)])
+        self.assertEqual(res['docno'].iloc[1500], 'p1500')
+        self.assertEqual([endpoint for endpoint, _ in transport.searches], ['/paper/search/bulk'] * 3)
+        self.assertEqual([params.get('token') for _, params in transport.searches], [None, '1000', '2000'])
+        self.assertEqual(transport.searches[0][1]['year'], '2020-')
+        self.assertEqual(s2.metrics.snapshot()['endpoints']['semantic_scholar/paper/search/bulk']['requests'], 3)
+        self.assertTrue(s2.metrics.snapshot()['calls'][-1]['name'].startswith('SemanticScholarRetriever'))
+
+        transport.searches.clear()
+        res = s2.retriever(num_results=50, verbose=False, sort='citationCount:desc')(topics)
+        self.assertEqual(len(res), 50)
+        self.assertEqual(transport.searches[0][1]['sort'], 'citationCount:desc')
+        with self.assertRaises(ValueError):
+            s2.retriever(verbose=False, bulk=False, sort='citationCount:desc') # /paper/search cannot sort
+
+        transport.searches.clear()
+        res = s2.retriever(num_results=150, verbose=False, filters={'minCitationCount': 10})(topics)
+        self.assertEqual(res['rank'].tolist(), list(range(150)))
+        self.assertEqual([(endpoint, params['minCitationCount']) for endpoint, params in transport.searches], [('/paper/search', 10)] * 2)
@@ -0,0 +1,105 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from pyterrier_services import SparseIndex, SparseVectors
+from pyterrier_services.sparse_index import _vbyte_decode, _vbyte_encode
+
+
+class TestSparseIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'index')
+        rng = np.random.default_rng(0)
+        vocab = [f't{i}' for i in range(200)]
+        popularity = 1 / np.arange(1, len(vocab) + 1) # a few terms in most documents, most terms in few
+        self.docs = []
+        for i in range(2000):
+            toks = rng.choice(len(vocab), rng.integers(1, 30), replace=False, p=popularity / popularity.sum())
+            self.docs.append({'docno': f'd{i}', 'toks': {vocab[t]: float(rng.exponential()) for t in toks}})
+        self.queries = []
+        for i in range(30):
+            toks = rng.choice(len(vocab), rng.integers(1, 8), replace=False)
+            self.queries.append({vocab[t]: float(rng.uniform(0.1, 2.)) for t in toks})
+        self.topics = pd.DataFrame({'qid': [str(i) for i in range(30)], 'query_toks': self.queries})
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _index(self, **kwargs):
+        index = SparseIndex(self.path)
+        index.indexer(verbose=False, **kwargs).index(iter(self.docs))
+        return index
+
+    def _expected(self, index, num_results):
+        # exhaustive scoring over the quantised weights
+        scale = index.meta['scale']
+        res = []
+        for query in self.queries:
+            scores = {}
+            for i, doc in enumerate(self.docs):
+                score = sum(w * scale * min(max(round(doc['toks'][t] / scale), 1), 255) for t, w in query.items() if t in doc['toks'])
+                if any(t in doc['toks'] for t in query):
+                    scores[i] = score
+            res.append(sorted(scores.items(), key=lambda x: (-x[1], x[0]))[:num_results])
+        return res
+
+    def test_vbyte(self):
+        values = np.array([0, 1, 127, 128, 16383, 16384, 2**21, 2**28 + 5, 2**35 - 1])
+        data, lengths = _vbyte_encode(values)
+        self.assertEqual(lengths.tolist(), [1, 1, 1, 2, 2, 3, 4, 5, 5])
+        np.testing.assert_array_equal(_vbyte_decode(data), values)
+
+    def test_indexer(self):
+        for run_size in [10_000_000, 1000]: # a single run, and many runs merged a group of terms at a time
+            with self.subTest(run_size=run_size):
+                index = self._index(run_size=run_size, overwrite=True)
+                self.assertEqual(len(index), 2000)
+                self.assertEqual(index.meta['postings'], sum(len(d['toks']) for d in self.docs))
+                self.assertEqual(index.docnos([0, 1999]), ['d0', 'd1999'])
+                scale = index.meta['scale']
+                for term in ['t0', 't5', 't199']:
+                    docids, impacts = index.postings(term)
+                    expected = [i for i, d in enumerate(self.docs) if term in d['toks']]
+                    self.assertEqual(docids.tolist(), expected)
+                    np.testing.assert_array_equal(impacts, [min(max(round(self.docs[i]['toks'][term] / scale), 1), 255) for i in expected])
+                self.assertEqual(len(index.postings('missing')[0]), 0)
+        self.assertGreater(len(index.postings('t0')[0]), 2 * SparseIndex.BLOCK_SIZE) # spans several blocks
+        with self.assertRaises(FileExistsError):
+            index.indexer(verbose=False).index([])
+        with self.assertRaises(ValueError):
+            index.indexer(verbose=False, overwrite=True).index([{'docno': 'x', 'toks': {'a': -1.}}])
+        index.indexer(verbose=False, overwrite=True).index([])
+        self.assertEqual(len(index), 0)
+        self.assertEqual(len(index.retriever()(self.topics)), 0)
+        self.assertFalse(os.path.exists(os.path.join(self.path, 'runs')))
+
+    def test_retriever(self):
+        index = self._index()
+        for num_results in [1, 10, 5000]:
+            expected = self._expected(index, num_results)
+            for max_workers in [1, 4]:
+                with self.subTest(num_results=num_results, max_workers=max_workers):
+                    res = index.retriever(num_results=num_results, max_workers=max_workers)(self.topics)
+                    self.assertEqual(list(res.columns), ['qid', 'query_toks', 'docno', 'score', 'rank'])
+                    for qid, exp in enumerate(expected):
+                        q = res[res['qid'] == str(qid)]
+                        self.assertEqual(q['docno'].tolist(), [f'd{i}' for i, _ in exp])
+                        np.testing.assert_allclose(q['score'].to_numpy(), [s for _, s in exp])
+                        self.assertEqual(q['rank'].tolist(), list(range(len(exp))))
+        res = index.retriever(num_results=10)(pd.DataFrame({'qid': ['a', 'b'], 'query_toks': [{'missing': 1.}, {}]}))
+        self.assertEqual(len(res), 0)
+        self.assertEqual(len(index.retriever()(self.topics.iloc[:0])), 0)
+        self.assertEqual(index.retriever(num_results=10).fuse_rank_cutoff(5).num_results, 5)
+
+    def test_sparse_vectors(self):
+        # toks and query_toks can also be rows of SparseVectors (i.e., sparse_format='csr')
+        index = SparseIndex(self.path)
+        toks = SparseVectors.from_dicts([d['toks'] for d in self.docs])
+        index.indexer(verbose=False).index({'docno': d['docno'], 'toks': toks[i]} for i, d in enumerate(self.docs))
+        query_toks = SparseVectors.from_dicts(self.queries)
+        topics = self.topics.assign(query_toks=[query_toks[i] for i in range(len(self.queries))])
+        res = index.retriever(num_results=10)(topics)
+        expected = index.retriever(num_results=10)(self.topics)
+        self.assertEqual(res['docno'].tolist(), expected['docno'].tolist())
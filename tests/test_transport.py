@@ -0,0 +1,43 @@
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pyterrier_services import HttpTransport
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # keep-alive
+
+    def do_GET(self):
+        self.server.client_ports.add(self.client_address[1])
+        body = json.dumps({'path': self.path, 'accept_encoding': self.headers.get('Accept-Encoding')}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestHttpTransport(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self.server.client_ports = set()
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_keep_alive(self):
+        transport = HttpTransport(pool_size=2)
+        for i in range(5):
+            res = transport.get(self.url + '/search', params={'q': str(i)})
+            res.raise_for_status()
+            self.assertEqual(res.json()['path'], f'/search?q={i}')
+            self.assertIn('gzip', res.json()['accept_encoding'])
+        self.assertEqual(len(self.server.client_ports), 1) # a single connection was re-used
+        transport.close()